@@ -1,13 +1,52 @@
-from fastapi import FastAPI, UploadFile, HTTPException
+from fastapi import FastAPI, UploadFile, HTTPException, Response, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import json
-import shutil
-from pathlib import Path
-import tempfile
-import os
+import math
+import re
+import time
+from datetime import date as Date, datetime
+from email.utils import formatdate, parsedate_to_datetime
+import asyncio
+from contextlib import ExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
 from main import analyze_meal_from_image  # import your function from main.py
+from llm.usage import get_usage_tracker
+from llm.resilience import get_resilience_stats
+from llm.rate_limit import get_rate_limiter
+from llm.cache import get_response_cache
+from agent_pool import get_agent_pool
+from batch import analyze_batch
+from config.settings import (
+    BATCH_CONCURRENCY, BATCH_MAX_IMAGES, JOB_LEASE_SECONDS, JOB_WORKERS, RECENT_DAYS, SSE_HEARTBEAT_SECONDS
+)
+from job_queue import AdmissionRejected, JobWorkers, get_job_events, get_job_queue
+from metrics import get_metrics, render_samples
+from tools.images import uploaded_image
+from tools.db_tools import day_detail, list_days, load_db_view, nutrition_trend
+
+# Analyses run on job worker threads (started with the app), never on the event loop
+_workers: Optional[JobWorkers] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the agents once at startup so requests never pay for it, then start the job workers"""
+    global _workers
+    try:
+        await asyncio.to_thread(get_agent_pool().warm_up)
+    except Exception as e:
+        print(f"⚠️  Agent pool warm-up failed, agents will be built on first use: {str(e)}")
+    _workers = JobWorkers(get_job_queue(), _process_job, JOB_WORKERS, events=get_job_events()).start()
+    yield
+    await asyncio.to_thread(_workers.stop, 5)
+    _workers = None
+
 
-app = FastAPI(title="Nutrition Agent API")
+app = FastAPI(title="Nutrition Agent API", lifespan=lifespan)
+
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+USER_ID_MAX_LENGTH = 256
 
 # Enable CORS so your JS backend can call it
 app.add_middleware(
@@ -18,39 +57,168 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/analyze")
-async def analyze_meal(file: UploadFile, meal_type: str = ""):
+@app.post("/analyze", status_code=202)
+async def analyze_meal(file: UploadFile, response: Response, meal_type: str = "",
+                       x_request_id: Optional[str] = Header(default=None),
+                       x_user_id: Optional[str] = Header(default=None)):
     """
     Endpoint to analyze a meal image.
-    Accepts an image upload and optional meal_type.
-    Returns JSON result from analyze_food.
+    Accepts an image upload and optional meal_type, queues the analysis and returns its job ID
+    immediately; poll GET /jobs/{job_id} for the result, or follow GET /jobs/{job_id}/events.
+    The job ID is also the request ID (X-Request-ID header, GET /usage/{request_id}).
+    Sending the ID of a failed job back in an X-Request-ID request header retries it, resuming
+    after its last completed step.
+    Rejected with 503 when the job queue is full, or 429 when the X-User-ID user already has
+    JOB_MAX_ACTIVE_PER_USER unfinished jobs; both carry a Retry-After header.
     """
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file uploaded")
+    _check_ids(x_request_id, x_user_id)
+
+    image = await file.read()
+    job_id = await asyncio.to_thread(_submit_job, {"filename": file.filename, "meal_type": meal_type}, image,
+                                     x_request_id, x_user_id)
+    response.headers["X-Request-ID"] = job_id
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+
+@app.post("/analyze/batch", status_code=202)
+async def analyze_meal_batch(files: List[UploadFile], response: Response, meal_type: str = "",
+                             x_request_id: Optional[str] = Header(default=None),
+                             x_user_id: Optional[str] = Header(default=None)):
+    """
+    Endpoint to analyze several meal images in one request (a full day, or a multi-plate meal).
+    Queued as one job like /analyze; its result lists one {"meal_id", "dishes"} (or {"error"})
+    per image, in upload order. All meals are saved in one grouped database write.
+    Admission (503 / 429 with Retry-After) is the same as /analyze; a batch counts as one job.
+    meal_type is a batch-level field: given or inferred once (from the upload time), it applies
+    to every image of the batch.
+    """
+    if not files or not all(file.filename for file in files):
+        raise HTTPException(status_code=400, detail="No file uploaded")
+    if len(files) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_IMAGES} images per batch")
+    _check_ids(x_request_id, x_user_id)
+
+    images = [await file.read() for file in files]
+    # The job row holds one blob: the images back to back, split again by their sizes
+    payload = {"meal_type": meal_type,
+               "batch": [{"filename": file.filename, "size": len(image)} for file, image in zip(files, images)]}
+    # Images run BATCH_CONCURRENCY at a time, each with its own deadline: lease one round per wave
+    lease_seconds = JOB_LEASE_SECONDS * math.ceil(len(images) / BATCH_CONCURRENCY)
+    job_id = await asyncio.to_thread(_submit_job, payload, b"".join(images), x_request_id, x_user_id,
+                                     lease_seconds)
+    response.headers["X-Request-ID"] = job_id
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}", "images": len(images)}
+
+
+def _check_ids(request_id: Optional[str], user_id: Optional[str]):
+    if request_id is not None and not REQUEST_ID_PATTERN.match(request_id):
+        raise HTTPException(status_code=400, detail="Invalid X-Request-ID")
+    if user_id is not None and not 0 < len(user_id) <= USER_ID_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid X-User-ID")
 
-    # Save uploaded file temporarily
+
+def _submit_job(payload: dict, image: bytes, job_id: Optional[str], user: Optional[str] = None,
+                lease_seconds: Optional[float] = None) -> str:
+    """Queue a job, or reject it at once (before any analysis work) when over the admission limits"""
+    queue = get_job_queue()
+    if job_id is not None:
+        previous = queue.get(job_id)
+        if previous is not None and previous["status"] == "failed":
+            get_job_events().clear(job_id)  # the retry's event stream starts over
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            shutil.copyfileobj(file.file, tmp)
-            tmp_path = tmp.name
-            
-        # Call your existing analyze_food function
-        result = analyze_meal_from_image(tmp_path, meal_type)
-        #with open("output.json", "w", encoding="utf-8") as f:
-        #    json.dump(result, f, ensure_ascii=False, indent=4)# indent for pretty printing
-        
-        BASE_DIR = Path(__file__).resolve().parent
-
-# Build the full path to meals.json dynamically
-        meals_file = BASE_DIR / "ai_nutrition_agent/db/meals.json"
-
-        with meals_file.open( "r", encoding="utf-8") as f:
-           data = json.load(f)
-
-# Get the most recent day
-        latest_day = data['days'][-1]
-        last_meal = latest_day['meals'][-1]  # Get the last meal of that day
-        dish_array = [
+        return queue.submit(payload, image, job_id, user=user, lease_seconds=lease_seconds)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """
+    Status of an analysis job: queued / running / done / failed.
+    "result" holds {"meal_id", "dishes"} once done, "error" the reason once failed.
+    """
+    job = await asyncio.to_thread(get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job_id")
+    job.pop("payload")
+    return job
+
+
+def _sse(event: Dict[str, Any], seq: Optional[int] = None) -> str:
+    """Format one server-sent event"""
+    lines = [f"id: {seq}"] if seq is not None else []
+    lines += [f"event: {event['event']}", f"data: {json.dumps(event, ensure_ascii=False)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+async def _job_event_stream(job_id: str, after: int) -> AsyncIterator[str]:
+    """Replay the job's events after `after`, follow new ones, and stop after done / failed"""
+    events, queue = get_job_events(), get_job_queue()
+    idle_since = time.monotonic()
+    while True:
+        new = await events.wait(job_id, after, 1.0)
+        for seq, event in new:
+            yield _sse(event, seq)
+            after = seq
+            if event["event"] in ("done", "failed"):
+                return
+        if new:
+            idle_since = time.monotonic()
+            continue
+        # Idle: a job run by another process (or finished before this process started) has no
+        # events here, only its stored status
+        job = await asyncio.to_thread(queue.get, job_id)
+        if job is None:
+            return
+        if job["status"] in ("done", "failed") and events.since(job_id, after):
+            continue  # published while the status was read; they end with done / failed
+        if job["status"] == "done":
+            yield _sse({"event": "done", "data": {"result": job["result"]}})
+            return
+        if job["status"] == "failed":
+            yield _sse({"event": "failed", "data": {"error": job["error"]}})
+            return
+        if time.monotonic() - idle_since >= SSE_HEARTBEAT_SECONDS:
+            idle_since = time.monotonic()
+            yield ": keep-alive\n\n"
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, last_event_id: Optional[str] = Header(default=None)):
+    """
+    Server-sent events of a job's progress, each as soon as its step finishes:
+    dish_detected (one per dish, while recognition is still running), dishes_detected,
+    portions_refined, nutrition, totals, meal_score, week_score, recommendation, saved;
+    then a final done (with the job result) or failed event.
+    Events carry an id; reconnecting with Last-Event-ID resumes after it.
+    """
+    if await asyncio.to_thread(get_job_queue().get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job_id")
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    return StreamingResponse(_job_event_stream(job_id, after), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _process_job(job: dict):
+    """Run one queued analysis (job worker thread), publishing its step events"""
+    payload = job["payload"]
+    events = get_job_events()
+    if "batch" in payload:
+        return _analyze_batch_job(job, on_event=lambda event: events.publish(job["id"], event))
+    return _analyze_image(job["image"], payload["filename"], payload.get("meal_type", ""), job["id"],
+                          on_event=lambda event: events.publish(job["id"], event))
+
+
+def _meal_response(meal: Dict[str, Any]) -> Dict[str, Any]:
+    """Job result for a saved meal: its ID and per-dish macros"""
+    return {
+        "meal_id": meal.get("meal_id"),
+        "dishes": [
             {
                 "name": dish["name"],
                 "calories": dish["nutrition_total"]["calories"],
@@ -58,10 +226,154 @@ async def analyze_meal(file: UploadFile, meal_type: str = ""):
                 "protein": dish["nutrition_total"]["protein"],
                 "fats": dish["nutrition_total"]["fat"]
             }
-            for dish in last_meal["dishes"]
+            for dish in meal.get("dishes", [])
         ]
-        return dish_array
+    }
+
+
+def _analyze_image(image: bytes, filename: str, meal_type: str, request_id: str, on_event=None):
+    """Analyze an uploaded image; the response is built from the meal this run saved (no database read)"""
+    # The bytes go to the vision model from memory (large uploads spill to a temp file)
+    with uploaded_image(image, filename) as image_path:
+        result = analyze_meal_from_image(image_path, meal_type, request_id=request_id, on_event=on_event)
+    if not result or result.get("error"):
+        raise RuntimeError((result or {}).get("error") or "Analysis failed")
+    meal = result.get("meal")
+    if not meal:
+        raise RuntimeError("Analysis finished without saving a meal")
+    return _meal_response(meal)
+
+
+def _analyze_batch_job(job: dict, on_event=None):
+    """Analyze every image of a batch job; one result (or error) per image, in upload order"""
+    payload, offset = job["payload"], 0
+    with ExitStack() as stack:
+        images = []
+        for item in payload["batch"]:
+            data = job["image"][offset:offset + item["size"]]
+            offset += item["size"]
+            images.append((stack.enter_context(uploaded_image(data, item["filename"])), payload.get("meal_type", "")))
+        results = analyze_batch(images, job["id"], on_event=on_event)
+    return {"results": [_meal_response(result["meal"]) if "meal" in result else {"error": result["error"]}
+                        for result in results]}
+
+
+def _not_modified(etag: str, modified: float, if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+    """Conditional GET: If-None-Match wins over If-Modified-Since (RFC 9110)"""
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if if_modified_since is not None:
+        try:
+            return int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _history_response(body_fn, etag: str, modified: float, if_none_match: Optional[str],
+                      if_modified_since: Optional[str]) -> Response:
+    """200 with the body, or 304 without building it when the client's copy is current"""
+    headers = {"ETag": etag, "Last-Modified": formatdate(modified, usegmt=True), "Cache-Control": "no-cache"}
+    if _not_modified(etag, modified, if_none_match, if_modified_since):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body_fn(), headers=headers)
+
+
+@app.get("/days")
+async def history_days(if_none_match: Optional[str] = Header(default=None),
+                       if_modified_since: Optional[str] = Header(default=None)):
+    """
+    Every day with meals: date, meal count and daily summary, oldest first.
+    The history endpoints are read from a cached view of meals.json (parsed again only after it
+    changes) and carry an ETag / Last-Modified of its version; revalidating an unchanged copy
+    answers 304.
+    """
+    view = await asyncio.to_thread(load_db_view)
+    return _history_response(lambda: {"days": list_days(view)}, f'"{view["version"]}"', view["modified"],
+                             if_none_match, if_modified_since)
+
+
+@app.get("/days/{date}/summary")
+async def history_day_summary(date: str, if_none_match: Optional[str] = Header(default=None),
+                              if_modified_since: Optional[str] = Header(default=None)):
+    """Daily summary and meal overviews (ID, type, time, totals, scores) of one day (YYYY-MM-DD)"""
+    try:
+        Date.fromisoformat(date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
+    view = await asyncio.to_thread(load_db_view)
+    detail = day_detail(view, date)
+    if detail is None:
+        raise HTTPException(status_code=404, detail=f"No meals on {date}")
+    return _history_response(lambda: detail, f'"{view["version"]}"', view["modified"],
+                             if_none_match, if_modified_since)
+
+
+@app.get("/trend")
+async def history_trend(days: int = Query(default=RECENT_DAYS, ge=1, le=366),
+                        if_none_match: Optional[str] = Header(default=None),
+                        if_modified_since: Optional[str] = Header(default=None)):
+    """Per-day summaries of the last `days` days (today included) and their daily average"""
+    view = await asyncio.to_thread(load_db_view)
+    now = datetime.now()
+    today = now.strftime("%Y-%m-%d")
+    # The window moves at midnight even when the store does not change
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    return _history_response(lambda: nutrition_trend(view, days, today), f'"{view["version"]}-{today}"',
+                             max(view["modified"], midnight), if_none_match, if_modified_since)
+
+
+@app.get("/health")
+async def health():
+    """Liveness check; answers immediately even while analyses are running"""
+    queue = get_job_queue()
+    jobs = await asyncio.to_thread(queue.counts)
+    return {"status": "ok", "analyses_in_flight": _workers.busy if _workers else 0, "workers": JOB_WORKERS,
+            "jobs": jobs, "limits": {"max_queued": queue.max_queued, "max_active_per_user": queue.max_active_per_user}}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus metrics: pipeline step, analysis and database save latency histograms, model
+    calls / errors / cache hits per model, response cache hit ratio, job queue depth and
+    analyses in flight.
+    """
+    jobs = await asyncio.to_thread(get_job_queue().counts)
+    cache = get_response_cache().stats()
+    resilience = get_resilience_stats()["counters"]
+    lines = get_metrics().render()
+    lines += render_samples("nutrition_jobs", "Analysis jobs per status (queued = queue depth)",
+                            [({"status": status}, count) for status, count in jobs.items()])
+    lines += render_samples("nutrition_analyses_in_flight", "Analyses running on job workers",
+                            [({}, _workers.busy if _workers else 0)])
+    lines += render_samples("nutrition_job_workers", "Job worker threads", [({}, JOB_WORKERS)])
+    lines += render_samples("nutrition_llm_cache_lookups_total", "Response cache lookups",
+                            [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])], "counter")
+    lines += render_samples("nutrition_llm_cache_hit_ratio", "Response cache hit ratio", [({}, cache["hit_ratio"])])
+    lines += render_samples("nutrition_llm_retries_total", "Upstream call retries",
+                            [({"model": model}, bucket["retries"]) for model, bucket in resilience.items()], "counter")
+    lines += render_samples("nutrition_llm_breaker_trips_total", "Circuit breaker trips",
+                            [({"model": model}, bucket["trips"]) for model, bucket in resilience.items()], "counter")
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+@app.get("/usage")
+async def usage_summary():
+    """Token, latency and cost totals for this process, by tool and by model"""
+    return get_usage_tracker().process_summary()
+
+
+@app.get("/usage/{request_id}")
+async def request_usage(request_id: str):
+    """Per-call usage of one analysis request"""
+    summary = get_usage_tracker().request_summary(request_id)
+    if not summary["calls"]:
+        raise HTTPException(status_code=404, detail="Unknown request_id")
+    return summary
+
 
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
+@app.get("/resilience")
+async def resilience_stats():
+    """Retry, circuit-breaker trip and short-circuit counters per model, plus rate-limit waits and agent pool usage"""
+    return {**get_resilience_stats(), "rate_limit": get_rate_limiter().stats(), "agent_pool": get_agent_pool().stats()}
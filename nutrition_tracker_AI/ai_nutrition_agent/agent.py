@@ -1,23 +1,27 @@
 """
 Main Agent file - Nutrition Analysis Agent
 Built using LangChain 1.0 create_agent
+The chat model and the LangGraph graph are built on first agent-mode use (at construction when
+ANALYSIS_MODE=agent), so pipeline-mode processes never import langgraph or langchain_openai.
 """
 import os
 import sys
+from contextlib import nullcontext
 from datetime import datetime
-from langchain_community.chat_models.tongyi import ChatTongyi
-from langgraph.prebuilt import create_react_agent
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from typing import Any, Callable, Dict, Optional
 
 # Add project root to path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from config.settings import AGENT_SYSTEM_PROMPT, DASHSCOPE_API_KEY
+from config.settings import AGENT_SYSTEM_PROMPT, DASHSCOPE_API_KEY, ANALYSIS_MODE, AGENT_ARTIFACT_HANDLES
+from llm.client import get_chat_model
+from pipeline import MealPipeline
+from tools.artifacts import artifact_handles
 from tools.vision_tools import detect_dishes_and_portions
 from tools.portion_tools import check_and_refine_portions
 from tools.nutrition_tools import query_nutrition_per_100g, add_nutrition_to_dishes
 from tools.compute_tools import compute_meal_nutrition, score_current_meal
-from tools.db_tools import load_recent_meals, save_meal, get_daily_summary
+from tools.db_tools import load_recent_meals, save_meal, get_daily_summary, recording_saved_meals
 from tools.recommendation_tools import (
     score_current_meal_llm,
     score_weekly_adjusted,
@@ -28,15 +32,18 @@ from tools.recommendation_tools import (
 class NutritionAgent:
     """Nutrition Analysis Agent class"""
     
-    def __init__(self):
-        """Initialize Agent"""
+    def __init__(self, build_graph: bool = ANALYSIS_MODE == "agent"):
+        """
+        Initialize Agent
+        
+        Args:
+            build_graph: Build the chat model and agent graph now (default: only in agent mode;
+                         otherwise on first use)
+        """
         # Check if API Key is configured
         if not DASHSCOPE_API_KEY:
             raise ValueError("DASHSCOPE_API_KEY is not configured, please set it in .env file")
         
-        # Initialize model - ChatTongyi will automatically read DASHSCOPE_API_KEY from environment variables
-        self.model = ChatTongyi()  # type: ignore
-        
         # Initialize tool list
         self.tools = [
             detect_dishes_and_portions,
@@ -53,24 +60,38 @@ class NutritionAgent:
             recommend_next_meal
         ]
         
-        # Create Agent using LangGraph (LangChain 1.0 recommended approach)
-        self.agent_executor = create_react_agent(
+        self._model = None
+        self._agent_executor = self._build_graph() if build_graph else None
+    
+    @property
+    def model(self):
+        """Chat model - shares the pooled keep-alive connections used by the tools"""
+        if self._model is None:
+            self._model = get_chat_model()
+        return self._model
+    
+    @property
+    def agent_executor(self):
+        """ReAct agent graph (built on first use; an agent serves one request at a time)"""
+        if self._agent_executor is None:
+            self._agent_executor = self._build_graph()
+        return self._agent_executor
+    
+    def _build_graph(self):
+        """Create Agent using LangGraph (LangChain 1.0 recommended approach)"""
+        from langgraph.prebuilt import create_react_agent
+        from compaction import compaction_hook
+        
+        return create_react_agent(
             model=self.model,
-            tools=self.tools
+            tools=self.tools,
+            prompt=AGENT_SYSTEM_PROMPT,
+            pre_model_hook=compaction_hook  # bound the context re-sent on every orchestration call
         )
     
-    def analyze_meal(self, image_path: str, meal_type: str = "Lunch") -> dict:
-        """
-        Complete workflow for analyzing meal image
-        
-        Args:
-            image_path: Image file path
-            meal_type: Meal type (Breakfast/Lunch/Dinner/Snack)
-        
-        Returns:
-            Analysis result dictionary
-        """
-        query = f"""
+    def _build_analyze_query(self, image_path: str, meal_type: str) -> str:
+        """Build the user query for meal analysis"""
+        return f"""
 Please analyze this meal image: {image_path}
 This is a {meal_type}.
 
@@ -84,11 +105,64 @@ Please complete the following tasks:
 
 Please execute step by step and provide me with a complete analysis report.
 """
+    
+    def _tool_results_scope(self):
+        """Tools exchange artifact:// handles during an agent run (dropped when the run ends)"""
+        return artifact_handles() if AGENT_ARTIFACT_HANDLES else nullcontext()
+    
+    def _with_saved_meal(self, result: dict, saved: list) -> dict:
+        """Attach the meal the agent's save_meal call stored (the pipeline result has it already)"""
+        if saved:
+            result = {**result, "meal": saved[-1], "meal_id": saved[-1].get("meal_id")}
+        return result
+    
+    def analyze_meal(self, image_path: str, meal_type: str = "Lunch", mode: str = ANALYSIS_MODE,
+                     on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> dict:
+        """
+        Complete workflow for analyzing meal image
+        
+        Args:
+            image_path: Image file path
+            meal_type: Meal type (Breakfast/Lunch/Dinner/Snack)
+            mode: "pipeline" (fixed tool sequence in code) or "agent" (ReAct agent decides)
+            on_event: Progress listener for pipeline step events (pipeline mode only)
         
+        Returns:
+            Analysis result dictionary; "meal" / "meal_id" hold the saved record
+        """
         try:
-            result = self.agent_executor.invoke({"messages": [("user", query)]})
+            if mode == "pipeline":
+                return MealPipeline(on_event=on_event).run(image_path, meal_type)
+            query = self._build_analyze_query(image_path, meal_type)
+            with self._tool_results_scope(), recording_saved_meals() as saved:
+                result = self.agent_executor.invoke({"messages": [("user", query)]})
             print(result)
-            return result
+            return self._with_saved_meal(result, saved)
+        except Exception as e:
+            print(f"Agent execution error: {str(e)}")
+            return {"error": str(e)}
+    
+    async def aanalyze_meal(self, image_path: str, meal_type: str = "Lunch", mode: str = ANALYSIS_MODE,
+                            on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> dict:
+        """
+        Async version of analyze_meal - tools run on their native async implementations
+        
+        Args:
+            image_path: Image file path
+            meal_type: Meal type (Breakfast/Lunch/Dinner/Snack)
+            mode: "pipeline" (fixed tool sequence in code) or "agent" (ReAct agent decides)
+            on_event: Progress listener for pipeline step events (pipeline mode only)
+        
+        Returns:
+            Analysis result dictionary; "meal" / "meal_id" hold the saved record
+        """
+        try:
+            if mode == "pipeline":
+                return await MealPipeline(on_event=on_event).arun(image_path, meal_type)
+            query = self._build_analyze_query(image_path, meal_type)
+            with self._tool_results_scope(), recording_saved_meals() as saved:
+                result = await self.agent_executor.ainvoke({"messages": [("user", query)]})
+            return self._with_saved_meal(result, saved)
         except Exception as e:
             print(f"Agent execution error: {str(e)}")
             return {"error": str(e)}
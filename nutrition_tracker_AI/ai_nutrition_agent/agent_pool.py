@@ -0,0 +1,131 @@
+"""
+Agent Pool - Process-wide NutritionAgent instances built once and reused across requests
+Building an agent creates the chat model and compiles the LangGraph graph; the pool pays that
+once at startup (warm_up) instead of on every request.
+"""
+import asyncio
+import os
+import queue
+import sys
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from config.settings import AGENT_POOL_SIZE
+
+
+def build_nutrition_agent() -> Any:
+    """Default factory (imports the agent module on first build, not when the pool is imported)"""
+    from agent import NutritionAgent
+    return NutritionAgent()
+
+
+class AgentPool:
+    """Fixed-size pool of agents; a leased agent is used by one request at a time"""
+
+    def __init__(self, size: int = AGENT_POOL_SIZE, factory: Callable[[], Any] = build_nutrition_agent):
+        """
+        Args:
+            size: Maximum number of agents (and of concurrent leases)
+            factory: Builds one agent (NutritionAgent by default)
+        """
+        self.size = max(1, size)
+        self._factory = factory
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._built = 0
+        self._leases = 0
+
+    def _build(self) -> Optional[Any]:
+        """Build one more agent if the pool is not full yet"""
+        with self._lock:
+            if self._built >= self.size:
+                return None
+            self._built += 1
+        try:
+            return self._factory()
+        except BaseException:
+            with self._lock:
+                self._built -= 1
+            raise
+
+    def warm_up(self) -> "AgentPool":
+        """Build every agent now (call at startup); safe to call more than once"""
+        while True:
+            agent = self._build()
+            if agent is None:
+                return self
+            self._idle.put(agent)
+
+    def acquire(self, timeout: Optional[float] = None) -> Any:
+        """
+        Take an agent, building one if the pool is not full yet.
+
+        Raises:
+            TimeoutError: No agent became free within `timeout` seconds
+        """
+        try:
+            agent = self._idle.get_nowait()
+        except queue.Empty:
+            agent = self._build()
+            if agent is None:
+                try:
+                    agent = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No agent available within {timeout}s") from None
+        with self._lock:
+            self._leases += 1
+        return agent
+
+    def release(self, agent: Any) -> None:
+        """Return a leased agent to the pool"""
+        self._idle.put(agent)
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """with pool.lease() as agent: ... (released on exit)"""
+        agent = self.acquire(timeout)
+        try:
+            yield agent
+        finally:
+            self.release(agent)
+
+    @asynccontextmanager
+    async def alease(self, timeout: Optional[float] = None) -> AsyncIterator[Any]:
+        """Async version of lease - waiting for a free agent does not block the event loop"""
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.acquire, timeout))
+        try:
+            agent = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The worker thread may still take an agent after the caller is gone: return it then
+            acquiring.add_done_callback(self._release_abandoned)
+            raise
+        try:
+            yield agent
+        finally:
+            self.release(agent)
+
+    def _release_abandoned(self, acquiring: "asyncio.Future[Any]") -> None:
+        if not acquiring.cancelled() and acquiring.exception() is None:
+            self.release(acquiring.result())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": self.size, "built": self._built, "idle": self._idle.qsize(), "leases": self._leases}
+
+
+_pool: Optional[AgentPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_agent_pool() -> AgentPool:
+    """Get the process-wide agent pool (created on first use, agents built lazily or by warm_up)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = AgentPool()
+    return _pool
@@ -0,0 +1,108 @@
+"""
+Batch Analysis - Several meal images analyzed as one request (a full day, or a multi-plate meal)
+Images run through the pipeline with bounded parallelism in the "batch" priority lane. Recent
+history is loaded once for the whole batch, repeated dishes hit the shared LLM response cache,
+and all meals are written to the database in one grouped commit at the end.
+Batches always use the pipeline: the grouped commit needs the records before anything is saved.
+"""
+import contextvars
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from checkpoint import get_checkpoint_store, request_scope_key
+from config.settings import ANALYSIS_DEADLINE, BATCH_CONCURRENCY
+from llm.context import request_scope
+from llm.rate_limit import priority_lane
+from llm.resilience import deadline_scope
+from pipeline import DEFAULT_POST_COMPUTE_STEPS, MealPipeline, PipelineStep, build_meal_record
+from tools.db_tools import load_recent_meals, save_meal_records
+from tools.meal_type_tools import infer_meal_type
+
+
+def _build_meal(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    return build_meal_record(ctx["compute_result"], ctx["meal_type"], ctx["score_current_meal_llm"],
+                             ctx["score_weekly_adjusted"], ctx["recommend_next_meal"])
+
+
+def batch_post_compute_steps(history: Dict[str, Any]) -> Tuple[PipelineStep, ...]:
+    """Default step graph with the batch's shared history and the meal built, not saved"""
+    steps = []
+    for step in DEFAULT_POST_COMPUTE_STEPS:
+        if step.name == "load_recent_meals":
+            steps.append(PipelineStep("load_recent_meals", lambda ctx: history))
+        elif step.name == "save_meal":
+            steps.append(PipelineStep("build_meal", _build_meal, requires=step.requires))
+        else:
+            steps.append(step)
+    return tuple(steps)
+
+
+def image_request_id(request_id: str, index: int) -> str:
+    """Request ID of one image of a batch (its own checkpoints and usage)"""
+    return f"{request_id}-{index}"
+
+
+def analyze_batch(images: Sequence[Tuple[str, str]], request_id: str, concurrency: int = BATCH_CONCURRENCY,
+                  on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+    """
+    Analyze several meal images and save them together.
+
+    Args:
+        images: (image_path, meal_type) per image. An empty meal type is inferred once, from the
+                upload time and recent history, and applies to every image left empty: the
+                images carry no capture time of their own, so per-image inference would only
+                repeat the same answer. Pass each image's meal type to label a full day.
+        request_id: Batch request ID; retrying with it resumes every image from its checkpoints
+        concurrency: Images analyzed at once
+        on_event: Pipeline step events, each tagged with the image's index ("image")
+
+    Returns:
+        Per image, in input order: the pipeline result ("meal" is the saved record) or {"error": message}
+    """
+    store = get_checkpoint_store()
+    with priority_lane("batch"):
+        history = load_recent_meals.invoke({})
+        default_meal_type = None
+        if any(not meal_type for _, meal_type in images):
+            default_meal_type = infer_meal_type.invoke({
+                "timestamp": datetime.now().isoformat(),
+                "recent_meals": history.get("recent_days", [])
+            })
+        steps = batch_post_compute_steps(history)
+
+        def run_one(index: int, image_path: str, meal_type: str) -> Dict[str, Any]:
+            with request_scope(image_request_id(request_id, index)) as image_id, deadline_scope(ANALYSIS_DEADLINE):
+                saved = store.get(request_scope_key(image_id), "save_meal")
+                if saved is not None:
+                    return {"mode": "pipeline", "meal": saved, "meal_id": saved.get("meal_id"), "resumed": True}
+                listener = (lambda event: on_event({**event, "image": index})) if on_event else None
+                pipeline = MealPipeline(steps, result_step="build_meal", on_event=listener)
+                return pipeline.run(image_path, meal_type or default_meal_type)
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch") as pool:
+            # Each image gets a copy of the batch context (lane, request ID)
+            futures = [pool.submit(contextvars.copy_context().run, run_one, index, image_path, meal_type)
+                       for index, (image_path, meal_type) in enumerate(images)]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append({"error": str(e)})
+
+    # One database write for every new meal of the batch
+    new = [(index, result) for index, result in enumerate(results) if "meal" in result and not result.get("resumed")]
+    save_meal_records([result["meal"] for _, result in new])
+    for index, result in new:
+        result["meal_id"] = result["meal"]["meal_id"]
+        store.put(request_scope_key(image_request_id(request_id, index)), "save_meal", result["meal"])
+        if on_event is not None:
+            on_event({"event": "saved", "step": "save_meal", "image": index,
+                      "data": {"meal_id": result["meal_id"], "meal": result["meal"]}})
+    return results
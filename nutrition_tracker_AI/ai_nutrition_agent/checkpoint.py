@@ -0,0 +1,121 @@
+"""
+Checkpoint Store - Completed pipeline step results in a local SQLite file
+Results are kept per scope: "request:<request_id>" lets a retried request resume after its last
+completed step (save_meal included, so a retry never saves twice), "image:<sha256>" lets a
+re-submitted image skip recognition, portion and nutrition lookups.
+Steps fed by an upstream result are keyed on a hash of that input too, so a changed upstream
+result (e.g. recognition succeeding on a retry after a fallback) never restores stale results.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config.settings import CHECKPOINT_ENABLED, CHECKPOINT_DB, CHECKPOINT_TTL
+from tools.images import read_image
+
+
+def request_scope_key(request_id: str) -> str:
+    return f"request:{request_id}"
+
+
+def image_scope_key(image_path: str) -> str:
+    """Scope of an image's content (the path of a re-uploaded file differs, its bytes do not)"""
+    return f"image:{hashlib.sha256(read_image(image_path)).hexdigest()}"
+
+
+def step_key(step: str, upstream: Any = None) -> str:
+    """Checkpoint key of a step; with an upstream input, only that exact input restores it"""
+    if upstream is None:
+        return step
+    if not isinstance(upstream, str):
+        upstream = json.dumps(upstream, ensure_ascii=False, sort_keys=True, default=str)
+    return f"{step}@{hashlib.sha256(upstream.encode('utf-8')).hexdigest()[:16]}"
+
+
+def is_failed_result(value: Any) -> bool:
+    """Tool fallbacks carry an "error" field; those results are never checkpointed"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return False
+    return isinstance(value, dict) and bool(value.get("error"))
+
+
+class CheckpointStore:
+    """Step results keyed by (scope, step), expiring after `ttl` seconds"""
+
+    def __init__(self, db_path: str = CHECKPOINT_DB, ttl: float = CHECKPOINT_TTL,
+                 enabled: bool = CHECKPOINT_ENABLED):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.enabled = enabled
+        self._local = threading.local()
+        if enabled:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            conn = self._connection()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "scope TEXT, step TEXT, result TEXT, created REAL, PRIMARY KEY (scope, step))"
+            )
+            conn.execute("DELETE FROM checkpoints WHERE created < ?", (time.time() - ttl,))
+
+    def _connection(self) -> sqlite3.Connection:
+        """Per-thread connection (pipeline steps run on worker threads)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, scope: str, step: str) -> Optional[Any]:
+        """Stored result of a step, or None (missing, expired or store disabled)"""
+        if not self.enabled:
+            return None
+        row = self._connection().execute(
+            "SELECT result FROM checkpoints WHERE scope = ? AND step = ? AND created >= ?",
+            (scope, step, time.time() - self.ttl)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, scope: str, step: str, result: Any) -> None:
+        if not self.enabled:
+            return
+        self._connection().execute(
+            "INSERT OR REPLACE INTO checkpoints (scope, step, result, created) VALUES (?, ?, ?, ?)",
+            (scope, step, json.dumps(result, ensure_ascii=False), time.time())
+        )
+
+    def steps(self, scope: str) -> Dict[str, Any]:
+        """All live results of a scope, keyed by step"""
+        if not self.enabled:
+            return {}
+        rows = self._connection().execute(
+            "SELECT step, result FROM checkpoints WHERE scope = ? AND created >= ?",
+            (scope, time.time() - self.ttl)
+        ).fetchall()
+        return {step: json.loads(result) for step, result in rows}
+
+    def clear(self, scope: str) -> None:
+        if not self.enabled:
+            return
+        self._connection().execute("DELETE FROM checkpoints WHERE scope = ?", (scope,))
+
+
+_store: Optional[CheckpointStore] = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """Get the process-wide checkpoint store (created on first use)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CheckpointStore()
+    return _store
@@ -0,0 +1,99 @@
+"""
+Context Compaction - Keep the ReAct agent's per-call context bounded
+Runs as the agent graph's pre_model_hook. Tool results the agent has already reacted to are
+replaced by compact summaries in the messages sent to the model; the graph state keeps the
+full history, so results returned to callers are unchanged.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+
+from config.settings import AGENT_CONTEXT_TOKEN_BUDGET, AGENT_TOOL_RESULT_MAX_TOKENS
+
+
+_CHARS_PER_TOKEN = 4
+_MAX_LIST_ITEMS = 3
+_MAX_DEPTH = 3
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """Rough token count of a message (~4 characters per token, tool-call arguments included)"""
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content, default=str)
+    chars = len(content)
+    for call in getattr(message, "tool_calls", None) or []:
+        chars += len(json.dumps(call.get("args", {}), ensure_ascii=False, default=str))
+    return chars // _CHARS_PER_TOKEN + 4
+
+
+def _summarize_value(value: Any, depth: int = 0) -> Any:
+    """Keep the shape and scalars of a JSON value; long lists and deep nesting are elided"""
+    if isinstance(value, dict):
+        if depth >= _MAX_DEPTH:
+            return f"<object with {len(value)} keys omitted>"
+        return {key: _summarize_value(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, list):
+        if len(value) > _MAX_LIST_ITEMS or depth >= _MAX_DEPTH:
+            return f"<{len(value)} items omitted>"
+        return [_summarize_value(item, depth + 1) for item in value]
+    if isinstance(value, str) and len(value) > 200:
+        return value[:200] + "…"
+    return value
+
+
+def summarize_tool_result(content: str, max_tokens: int = AGENT_TOOL_RESULT_MAX_TOKENS) -> str:
+    """
+    Compact text for a consumed tool result.
+
+    JSON results keep their keys and scalar values (e.g. weekly_trend, total_meals) while dish and
+    meal lists are reduced to counts; anything still too long is cut off.
+    """
+    max_chars = max_tokens * _CHARS_PER_TOKEN
+    if len(content) <= max_chars:
+        return content
+    try:
+        summary = json.dumps(_summarize_value(json.loads(content)), ensure_ascii=False)
+    except (json.JSONDecodeError, TypeError):
+        summary = content
+    if len(summary) > max_chars:
+        summary = summary[:max_chars] + "…"
+    return f"[compacted tool result, {len(content)} chars originally] {summary}"
+
+
+def compact_messages(messages: List[BaseMessage], budget: Optional[int] = None,
+                     max_tool_tokens: Optional[int] = None) -> List[BaseMessage]:
+    """
+    Compact a message list to fit the token budget.
+
+    Only tool results followed by a later AI message (already consumed) are touched, oldest first,
+    and each keeps its tool_call_id so the call/result pairing stays valid.
+
+    Args:
+        budget: Token budget (AGENT_CONTEXT_TOKEN_BUDGET by default)
+        max_tool_tokens: Size a compacted tool result is cut to (AGENT_TOOL_RESULT_MAX_TOKENS by default)
+
+    Returns:
+        The original list if it fits, otherwise a new list with compacted tool messages
+    """
+    budget = AGENT_CONTEXT_TOKEN_BUDGET if budget is None else budget
+    max_tool_tokens = AGENT_TOOL_RESULT_MAX_TOKENS if max_tool_tokens is None else max_tool_tokens
+    sizes = [message_tokens(message) for message in messages]
+    total = sum(sizes)
+    if total <= budget:
+        return messages
+    last_ai = max((i for i, message in enumerate(messages) if isinstance(message, AIMessage)), default=-1)
+    compacted = list(messages)
+    for i, message in enumerate(messages[:last_ai]):
+        if total <= budget:
+            break
+        if not isinstance(message, ToolMessage) or not isinstance(message.content, str) or sizes[i] <= max_tool_tokens:
+            continue
+        shorter = message.model_copy(update={"content": summarize_tool_result(message.content, max_tool_tokens)})
+        total -= sizes[i] - message_tokens(shorter)
+        compacted[i] = shorter
+    return compacted
+
+
+def compaction_hook(state: Dict[str, Any]) -> Dict[str, Any]:
+    """pre_model_hook for create_react_agent: send the compacted history to the model only"""
+    return {"llm_input_messages": compact_messages(state["messages"])}
@@ -1,6 +1,7 @@
 """
 Configuration File - Model and API Configuration
 """
+import json
 import os
 from dotenv import load_dotenv
 
@@ -11,13 +12,121 @@ load_dotenv(override=True)
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
 QWEN_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 
+# LLM Backend: "dashscope" (live API) or "fake" (local fake_qwen_server.py for offline benchmarking)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "dashscope").lower()
+FAKE_LLM_BASE_URL = os.getenv("FAKE_LLM_BASE_URL", "http://127.0.0.1:8001/compatible-mode/v1")
+if LLM_BACKEND == "fake":
+    QWEN_BASE_URL = FAKE_LLM_BASE_URL
+    DASHSCOPE_API_KEY = DASHSCOPE_API_KEY or "fake-key"
+
 # Model Configuration
 QWEN_VL_MODEL = "qwen-vl-plus"  # Multimodal vision model
 QWEN_TEXT_MODEL = "qwen-plus"    # Text model
+AGENT_MODEL = os.getenv("AGENT_MODEL", "qwen-turbo")  # Orchestration model for the ReAct agent
+# Meal analysis mode: "pipeline" runs the fixed tool sequence in code, "agent" lets the ReAct agent drive it
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "pipeline").lower()
+# In agent mode tools exchange short artifact:// handles instead of full JSON results
+AGENT_ARTIFACT_HANDLES = os.getenv("AGENT_ARTIFACT_HANDLES", "true").lower() == "true"
+ARTIFACT_MAX_REQUESTS = int(os.getenv("ARTIFACT_MAX_REQUESTS", "256"))  # Requests kept in the artifact store
+# Uploads up to this size stay in memory (image:// handles); larger ones go through a temp file
+IMAGE_SPILL_BYTES = int(os.getenv("IMAGE_SPILL_BYTES", str(8 * 1024 * 1024)))
+# Prebuilt NutritionAgent instances shared by the server, CLI and GUI (max concurrent agent runs)
+AGENT_POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", "4"))
+# Analyses agent_server runs at once on its worker threads (the event loop itself never blocks)
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", str(AGENT_POOL_SIZE)))
+# POST /analyze/batch: images of one batch analyzed at once, and the most images per batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "20"))
+# Agent context compaction: once the conversation exceeds the budget, tool results the agent has
+# already reacted to are summarized (oldest first) before each orchestration call
+AGENT_CONTEXT_TOKEN_BUDGET = int(os.getenv("AGENT_CONTEXT_TOKEN_BUDGET", "6000"))
+AGENT_TOOL_RESULT_MAX_TOKENS = int(os.getenv("AGENT_TOOL_RESULT_MAX_TOKENS", "300"))
+
+# LLM HTTP Connection Pool Configuration (shared by all tools and the agent)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "16"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "90"))  # seconds
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))  # seconds
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))  # seconds
+
+# LLM Retry / Circuit Breaker Configuration (the OpenAI client's own retries are disabled)
+LLM_RETRY_MAX_ATTEMPTS = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3"))  # Including the first attempt
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))  # seconds
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))  # seconds
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))  # Consecutive transient failures
+LLM_BREAKER_RESET_TIMEOUT = float(os.getenv("LLM_BREAKER_RESET_TIMEOUT", "30"))  # seconds before a probe call
+ANALYSIS_DEADLINE = float(os.getenv("ANALYSIS_DEADLINE", "120"))  # seconds budget for one meal analysis
+
+# Model pricing per 1K tokens (prompt, completion), CNY - used for cost accounting
+LLM_PRICING = {
+    "qwen-vl-plus": (0.0015, 0.0045),
+    "qwen-plus": (0.0008, 0.002),
+    "qwen-turbo": (0.0003, 0.0006),
+}
+USAGE_MAX_TRACKED_REQUESTS = int(os.getenv("USAGE_MAX_TRACKED_REQUESTS", "200"))  # Per-request usage kept in memory
+
+# Upstream Rate Limit (token buckets shared by all local processes through a SQLite file)
+LLM_RATE_LIMIT_ENABLED = os.getenv("LLM_RATE_LIMIT_ENABLED", "true").lower() == "true"
+LLM_RATE_LIMIT_DB = os.getenv(
+    "LLM_RATE_LIMIT_DB",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "db", "rate_limit.sqlite3")
+)
+LLM_RATE_LIMIT_DEFAULT = {
+    "rps": float(os.getenv("LLM_RATE_LIMIT_RPS", "10")),  # requests per second
+    "tpm": float(os.getenv("LLM_RATE_LIMIT_TPM", "300000")),  # tokens per minute
+}
+# Per-model overrides, e.g. LLM_RATE_LIMITS='{"qwen-vl-plus": {"rps": 2, "tpm": 60000}}'
+LLM_RATE_LIMITS = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+LLM_RATE_LIMIT_BATCH_RESERVE = float(os.getenv("LLM_RATE_LIMIT_BATCH_RESERVE", "0.2"))  # Share kept for interactive calls
+
+# Structured output: auto (probe json_schema → json_object → none per model) or a pinned mode
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "auto").lower()
+
+# LLM Response Cache Configuration
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_DIR = os.getenv(
+    "LLM_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "db", "llm_cache")
+)
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512"))
+LLM_PROMPT_VERSION = os.getenv("LLM_PROMPT_VERSION", "v1")  # Bump to invalidate cached responses
+# Per-tool TTL in seconds; tools not listed here are never cached
+LLM_CACHE_TTL = {
+    "check_and_refine_portions": 7 * 24 * 3600,
+    "query_nutrition_per_100g": 30 * 24 * 3600,
+    "score_current_meal_llm": 7 * 24 * 3600,
+    "score_weekly_adjusted": 24 * 3600,
+    "infer_meal_type": 3600,
+}
+# Comma-separated tool names that should always skip the cache
+LLM_CACHE_BYPASS_TOOLS = {name.strip() for name in os.getenv("LLM_CACHE_BYPASS_TOOLS", "").split(",") if name.strip()}
 
 # Database Configuration
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "db", "meals.json")
 
+# Pipeline step checkpoints: a retried request resumes after its last completed step and a
+# re-submitted image reuses its recognition / nutrition results
+CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "true").lower() == "true"
+CHECKPOINT_DB = os.getenv(
+    "CHECKPOINT_DB", os.path.join(os.path.dirname(os.path.dirname(__file__)), "db", "checkpoints.sqlite3")
+)
+CHECKPOINT_TTL = int(os.getenv("CHECKPOINT_TTL", str(24 * 3600)))  # seconds
+
+# Background analysis jobs (agent_server): persistent SQLite queue drained by worker threads
+JOB_DB = os.getenv("JOB_DB", os.path.join(os.path.dirname(os.path.dirname(__file__)), "db", "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", str(ANALYSIS_CONCURRENCY)))
+# A running job whose worker died is handed to another worker once its lease expires
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", str(ANALYSIS_DEADLINE + 60)))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))  # finished jobs kept (seconds)
+# Admission control: beyond these, new jobs are rejected at once (503 / 429 with Retry-After)
+# instead of queueing behind work the model quota cannot absorb
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", str(JOB_WORKERS * 4)))  # jobs waiting for a worker
+JOB_MAX_ACTIVE_PER_USER = int(os.getenv("JOB_MAX_ACTIVE_PER_USER", "2"))  # queued + running jobs per X-User-ID
+# Progress events of recent jobs kept in memory for GET /jobs/{job_id}/events (replayed to late subscribers)
+JOB_EVENTS_MAX_JOBS = int(os.getenv("JOB_EVENTS_MAX_JOBS", "256"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
 # Prompt file path
 PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "prompts")
 
@@ -46,6 +155,9 @@ Your tasks are:
 3. add_nutrition_to_dishes(portion_result) → nutrition_result  ← 🔴 Must call!
 4. compute_meal_nutrition(nutrition_result) → compute_result
 5. save_meal(compute_result)
-
-Note: All tools return JSON strings, just pass directly to the next tool.
+"""
+if AGENT_ARTIFACT_HANDLES:
+    AGENT_SYSTEM_PROMPT += """
+Note: Tools return short artifact handles such as {"artifact": "artifact://req_123/portion", ...}.
+Pass the handle string itself to the next tool - do not rewrite or expand the data.
 """
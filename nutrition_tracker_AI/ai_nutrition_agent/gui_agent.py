@@ -12,7 +12,8 @@ import threading
 # Add project root to path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from agent import NutritionAgent
+from agent_pool import get_agent_pool
+from pipeline import describe_event
 
 
 class NutritionAnalyzerGUI:
@@ -24,8 +25,8 @@ class NutritionAnalyzerGUI:
         self.root.geometry("900x700")
         self.root.configure(bg="#f0f0f0")
         
-        # Initialize Agent
-        self.agent = None
+        # Initialize Agent pool (shared with the CLI / server code paths)
+        self.agent_pool = None
         self.analyzing = False
         
         self.setup_ui()
@@ -192,7 +193,7 @@ class NutritionAnalyzerGUI:
         def _init():
             try:
                 self.update_status("Initializing Agent...")
-                self.agent = NutritionAgent()
+                self.agent_pool = get_agent_pool().warm_up()
                 self.update_status("✅ Agent initialization complete! Ready")
                 self.log_result("✅ System initialization successful!\n\nPlease click the button to select a meal image to start analysis.\n")
             except Exception as e:
@@ -206,7 +207,7 @@ class NutritionAnalyzerGUI:
         if self.analyzing:
             return
         
-        if not self.agent:
+        if not self.agent_pool:
             self.log_result("❌ Agent not yet initialized, please wait...\n")
             return
         
@@ -268,8 +269,9 @@ class NutritionAnalyzerGUI:
                 self.log_result("  7️⃣  Next Meal Recommendation\n")
                 self.log_result("  8️⃣  Save Data\n\n")
                 
-                # Execute analysis
-                result = self.agent.analyze_meal(image_path, meal_type)
+                # Execute analysis (step results are shown as soon as each step finishes)
+                with self.agent_pool.lease() as agent:
+                    result = agent.analyze_meal(image_path, meal_type, on_event=self._on_pipeline_event)
                 
                 # Calculate duration
                 end_time = datetime.now()
@@ -282,7 +284,9 @@ class NutritionAnalyzerGUI:
                 self.log_result(f"{'='*60}\n\n")
                 
                 # Display Agent's output
-                if "messages" in result:
+                if "meal" in result:
+                    self.log_result(f"📊 Meal {result['meal'].get('meal_id')} saved\n")
+                elif "messages" in result:
                     # Extract last message (Agent's final reply)
                     messages = result["messages"]
                     if messages:
@@ -309,6 +313,10 @@ class NutritionAnalyzerGUI:
         # Execute in background thread
         threading.Thread(target=_analyze, daemon=True).start()
     
+    def _on_pipeline_event(self, event: dict):
+        """Show a pipeline step event (called from analysis threads)"""
+        self.root.after(0, self.log_result, f"  {describe_event(event)}  [{event['elapsed_ms'] / 1000:.1f}s]\n")
+    
     def _finish_analysis(self):
         """Restore UI after analysis completion"""
         self.analyzing = False
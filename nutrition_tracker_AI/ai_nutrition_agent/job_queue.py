@@ -0,0 +1,439 @@
+"""
+Job Queue - Persistent analysis jobs in a local SQLite file, drained by worker threads
+Submitting only writes a row, so uploads are accepted at disk speed whatever the model latency.
+A job's ID doubles as its request ID: when a worker dies mid-run the job's lease expires, another
+worker claims it, and the pipeline resumes from the request's checkpoints. Every claim gets its
+own lease token; only the current holder can finish the job, so a worker that outlived its
+lease cannot overwrite the result of the worker that took the job over. While a job runs, its
+worker renews the lease (heartbeat), so a slow but healthy job is never claimed a second time.
+Step events published while a job runs are kept in memory (JobEventLog) for streaming to clients.
+Submissions are admitted against a queue depth limit and a per-user cap of unfinished jobs in the
+same transaction that inserts them, so the limits hold across processes.
+"""
+import asyncio
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config.settings import (
+    JOB_DB, JOB_WORKERS, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_RETENTION, JOB_EVENTS_MAX_JOBS,
+    JOB_MAX_QUEUED, JOB_MAX_ACTIVE_PER_USER
+)
+from llm.context import new_request_id
+
+
+STATUSES = ("queued", "running", "done", "failed")
+
+# Retry-After when no job has finished yet to estimate from (seconds)
+DEFAULT_JOB_SECONDS = 30.0
+
+
+class AdmissionRejected(Exception):
+    """A job was not queued; retry after `retry_after` seconds"""
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(AdmissionRejected):
+    """Too many jobs are waiting for a worker"""
+    status_code = 503
+
+
+class UserBusy(AdmissionRejected):
+    """The user already has the maximum number of unfinished jobs"""
+    status_code = 429
+
+
+class JobQueue:
+    """FIFO job table; claims are atomic across threads and processes (BEGIN IMMEDIATE)"""
+
+    def __init__(self, db_path: str = JOB_DB, lease_seconds: float = JOB_LEASE_SECONDS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, retention: float = JOB_RETENTION,
+                 max_queued: Optional[int] = JOB_MAX_QUEUED,
+                 max_active_per_user: Optional[int] = JOB_MAX_ACTIVE_PER_USER, workers: int = JOB_WORKERS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.max_queued = max_queued
+        self.max_active_per_user = max_active_per_user
+        self.workers = max(1, workers)
+        self._local = threading.local()
+        self._submitted = threading.Condition()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT, payload TEXT, image BLOB, result TEXT, error TEXT, "
+                "attempts INTEGER DEFAULT 0, created REAL, started REAL, finished REAL, lease_until REAL)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            for column, kind in (("user", "TEXT"), ("lease_owner", "TEXT"), ("lease_seconds", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user, status)")
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+                         (time.time() - retention,))
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """Per-thread connection; BEGIN IMMEDIATE serializes claims across processes"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def submit(self, payload: Dict[str, Any], image: Optional[bytes] = None, job_id: Optional[str] = None,
+               user: Optional[str] = None, lease_seconds: Optional[float] = None) -> str:
+        """
+        Queue a job.
+
+        Args:
+            payload: JSON-serializable job parameters (meal_type, filename, ...)
+            image: Uploaded image bytes, kept with the job until it finishes
+            job_id: Reuse an ID (defaults to a new request ID)
+            user: Submitting user, for the per-user cap (None = not capped)
+            lease_seconds: Lease of this job (defaults to the queue's; longer for a batch of images)
+
+        Returns:
+            The job ID
+
+        Raises:
+            QueueFull: max_queued jobs are already waiting
+            UserBusy: the user already has max_active_per_user queued or running jobs
+        """
+        job_id = job_id or new_request_id()
+        with self._connection() as conn:
+            existing = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if existing is None or existing[0] == "failed":
+                self._admit(conn, user)
+            # Re-submitting a failed job's ID queues it again (it resumes from its checkpoints);
+            # re-submitting a queued, running or finished job changes nothing
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, image, created, user, lease_seconds) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET status = 'queued', payload = excluded.payload, "
+                "image = excluded.image, error = NULL, attempts = 0, finished = NULL, lease_until = NULL, "
+                "lease_owner = NULL, user = excluded.user, lease_seconds = excluded.lease_seconds "
+                "WHERE jobs.status = 'failed'",
+                (job_id, json.dumps(payload, ensure_ascii=False), image, time.time(), user, lease_seconds)
+            )
+        with self._submitted:
+            self._submitted.notify()
+        return job_id
+
+    def _admit(self, conn: sqlite3.Connection, user: Optional[str]) -> None:
+        """Reject a new job that would exceed the queue depth or the user's cap"""
+        if self.max_queued is not None:
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                # The queue drains at about `workers` jobs per job duration
+                raise QueueFull(f"{queued} jobs are already queued",
+                                self._retry_after(conn, (queued - self.max_queued + 1) / self.workers))
+        if user is not None and self.max_active_per_user is not None:
+            active = conn.execute("SELECT COUNT(*) FROM jobs WHERE user = ? AND status IN ('queued', 'running')",
+                                  (user,)).fetchone()[0]
+            if active >= self.max_active_per_user:
+                raise UserBusy(f"{active} analyses of this user are still running", self._retry_after(conn, 1))
+
+    def _retry_after(self, conn: sqlite3.Connection, jobs: float) -> int:
+        """Seconds until about `jobs` job durations have passed (mean of the last finished jobs)"""
+        mean = conn.execute(
+            "SELECT AVG(finished - started) FROM (SELECT finished, started FROM jobs WHERE status = 'done' "
+            "ORDER BY finished DESC LIMIT 20)"
+        ).fetchone()[0]
+        return max(1, math.ceil((DEFAULT_JOB_SECONDS if mean is None else mean) * jobs))
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Take the oldest queued job, or a running one whose worker's lease expired.
+
+        Returns:
+            {"id", "payload", "image", "attempt", "lease"}, or None; "lease" is the token
+            complete() and fail() need
+        """
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT id, payload, image, attempts, lease_seconds FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, payload, image, attempts, lease_seconds = row
+            if attempts >= self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, image = NULL, finished = ?, lease_owner = NULL "
+                    "WHERE id = ?", (f"Gave up after {attempts} attempts", now, job_id)
+                )
+                return None
+            lease = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started = ?, lease_until = ?, "
+                "lease_owner = ? WHERE id = ?", (now, now + (lease_seconds or self.lease_seconds), lease, job_id)
+            )
+        return {"id": job_id, "payload": json.loads(payload), "image": image, "attempt": attempts + 1,
+                "lease": lease}
+
+    def renew(self, job_id: str, lease: str) -> bool:
+        """
+        Extend a running job's lease by its full length (worker heartbeat).
+        Returns False when `lease` no longer holds the job.
+        """
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ? + COALESCE(lease_seconds, ?) "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (time.time(), self.lease_seconds, job_id, lease)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, lease: str, result: Any) -> bool:
+        """
+        Store a job's result.
+
+        Returns:
+            False (nothing written) when `lease` no longer holds the job: it expired and another
+            worker claimed the job, whose result counts instead
+        """
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, image = NULL, finished = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id, lease)
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, lease: str, error: str) -> bool:
+        """
+        Mark a job failed (upstream calls were already retried inside the pipeline).
+        Returns False when `lease` no longer holds the job (see complete).
+        """
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, image = NULL, finished = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (error, time.time(), job_id, lease)
+            )
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Public view of a job (no image bytes), or None"""
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT id, status, payload, result, error, attempts, created, started, finished "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, status, payload, result, error, attempts, created, started, finished = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "payload": json.loads(payload),
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "attempts": attempts,
+            "created_at": created,
+            "started_at": started,
+            "finished_at": finished
+        }
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status"""
+        with self._connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: 0 for status in STATUSES} | dict(rows)
+
+    def wait_for_submit(self, timeout: float) -> None:
+        """Sleep until a job is submitted in this process (or the timeout passes)"""
+        with self._submitted:
+            self._submitted.wait(timeout)
+
+
+class JobWorkers:
+    """
+    Worker threads that claim jobs and run them through `handler(job) -> result`.
+    A running job's lease is renewed every `heartbeat_interval` seconds (a third of the lease by default).
+    With an event log, each job's stream gets "started" (attempt number) and a final "done"
+    (result) or "failed" (error) event around whatever the handler publishes.
+    """
+
+    def __init__(self, queue: JobQueue, handler: Callable[[Dict[str, Any]], Any], count: int = JOB_WORKERS,
+                 poll_interval: float = 1.0, events: Optional["JobEventLog"] = None,
+                 heartbeat_interval: Optional[float] = None):
+        self.queue = queue
+        self.handler = handler
+        self.events = events
+        self.count = max(1, count)
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval or queue.lease_seconds / 3
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+
+    def start(self) -> "JobWorkers":
+        for i in range(self.count):
+            thread = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop claiming new jobs; running jobs finish (or are recovered after a restart)"""
+        self._stop.set()
+        with self.queue._submitted:
+            self.queue._submitted.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    @property
+    def busy(self) -> int:
+        with self._busy_lock:
+            return self._busy
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self.queue.wait_for_submit(self.poll_interval)
+                continue
+            with self._busy_lock:
+                self._busy += 1
+            finished = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job, finished),
+                                         name=f"{threading.current_thread().name}-heartbeat", daemon=True)
+            heartbeat.start()
+            try:
+                self._publish(job["id"], "started", {"attempt": job["attempt"]})
+                result = self.handler(job)
+                # A lost lease means another worker owns the job now: drop this result
+                if self.queue.complete(job["id"], job["lease"], result):
+                    self._publish(job["id"], "done", {"result": result})
+            except Exception as e:
+                traceback.print_exc()
+                if self.queue.fail(job["id"], job["lease"], str(e)):
+                    self._publish(job["id"], "failed", {"error": str(e)})
+            finally:
+                finished.set()
+                heartbeat.join()
+                with self._busy_lock:
+                    self._busy -= 1
+
+    def _heartbeat(self, job: Dict[str, Any], finished: threading.Event) -> None:
+        """Keep renewing the job's lease until the handler returns (or the lease is lost)"""
+        while not finished.wait(self.heartbeat_interval):
+            try:
+                if not self.queue.renew(job["id"], job["lease"]):
+                    return
+            except sqlite3.Error:
+                traceback.print_exc()  # try again on the next beat
+
+    def _publish(self, job_id: str, event: str, data: Dict[str, Any]) -> None:
+        if self.events is not None:
+            self.events.publish(job_id, {"event": event, "data": data})
+
+
+class JobEventLog:
+    """
+    In-memory, per-job sequence of progress events (this process only).
+    Workers publish from their threads; async readers are woken on their own event loop.
+    Events are numbered from 1, so a reader resumes with `since(job_id, last_seen)`.
+    """
+
+    def __init__(self, max_jobs: int = JOB_EVENTS_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._events: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, job_id: str, event: Dict[str, Any]) -> None:
+        with self._lock:
+            events = self._events.setdefault(job_id, [])
+            events.append(event)
+            self._events.move_to_end(job_id)
+            while len(self._events) > self.max_jobs:
+                self._events.popitem(last=False)
+            waiters = list(self._waiters.get(job_id, ()))
+        for loop, flag in waiters:
+            loop.call_soon_threadsafe(flag.set)
+
+    def clear(self, job_id: str) -> None:
+        """Forget a job's events (before it is run again)"""
+        with self._lock:
+            self._events.pop(job_id, None)
+
+    def since(self, job_id: str, after: int = 0) -> List[Tuple[int, Dict[str, Any]]]:
+        """(sequence number, event) pairs published after `after`"""
+        with self._lock:
+            events = self._events.get(job_id, [])
+            return [(seq, event) for seq, event in enumerate(events[after:], start=after + 1)]
+
+    async def wait(self, job_id: str, after: int, timeout: float) -> List[Tuple[int, Dict[str, Any]]]:
+        """Events after `after`, waiting up to `timeout` seconds for one to be published"""
+        flag = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), flag)
+        with self._lock:
+            self._waiters.setdefault(job_id, []).append(waiter)
+        try:
+            events = self.since(job_id, after)
+            if events:
+                return events
+            try:
+                await asyncio.wait_for(flag.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return self.since(job_id, after)
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(job_id, [])
+                waiters.remove(waiter)
+                if not waiters:
+                    self._waiters.pop(job_id, None)
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+_events: Optional[JobEventLog] = None
+
+
+def get_job_queue() -> JobQueue:
+    """Get the process-wide job queue (created on first use)"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
+
+
+def get_job_events() -> JobEventLog:
+    """Get the process-wide job event log"""
+    global _events
+    if _events is None:
+        with _queue_lock:
+            if _events is None:
+                _events = JobEventLog()
+    return _events
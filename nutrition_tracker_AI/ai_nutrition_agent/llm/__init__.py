@@ -0,0 +1,50 @@
+"""
+LLM包初始化文件
+Exports are imported on first access, so importing one submodule (llm.context, llm.usage, ...)
+does not load the clients and their openai / httpx dependencies.
+"""
+import importlib
+
+# Exported name -> submodule
+_EXPORTS = {
+    "get_client": "client",
+    "get_async_client": "client",
+    "get_http_client": "client",
+    "get_chat_model": "client",
+    "close_clients": "client",
+    "ResponseCache": "cache",
+    "get_response_cache": "cache",
+    "cache_bypass": "cache",
+    "chat_completion": "calls",
+    "achat_completion": "calls",
+    "stream_chat_completion": "calls",
+    "astream_chat_completion": "calls",
+    "extract_json": "json_extract",
+    "find_json": "json_extract",
+    "JSONStreamParser": "json_extract",
+    "iter_json_items": "json_extract",
+    "aiter_json_items": "json_extract",
+    "request_scope": "context",
+    "get_request_id": "context",
+    "new_request_id": "context",
+    "get_usage_tracker": "usage",
+    "probe_structured_output": "structured",
+    "get_structured_mode": "structured",
+    "get_rate_limiter": "rate_limit",
+    "priority_lane": "rate_limit",
+    "CircuitOpenError": "resilience",
+    "DeadlineExceeded": "resilience",
+    "deadline_scope": "resilience",
+    "remaining_time": "resilience",
+    "get_resilience_stats": "resilience",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,197 @@
+"""
+LLM Response Cache - Content-addressed cache for deterministic tool calls
+Memory LRU layer in front of a disk backend, with per-tool TTL and bypass flags
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config.settings import (
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_DIR,
+    LLM_CACHE_MEMORY_ENTRIES,
+    LLM_CACHE_TTL,
+    LLM_CACHE_BYPASS_TOOLS
+)
+
+
+# Scoped bypass (e.g. a user-requested re-analysis), propagated through contextvars
+_bypass: ContextVar[bool] = ContextVar("llm_cache_bypass", default=False)
+
+
+@contextmanager
+def cache_bypass() -> Iterator[None]:
+    """Skip cache reads and writes for every call made inside this block"""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def make_cache_key(model: str, prompt_version: str, messages: List[Dict[str, Any]],
+                   temperature: float, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Hash everything that affects the model output into a stable key.
+
+    Args:
+        model: Model name
+        prompt_version: Prompt version tag (bump to invalidate old entries)
+        messages: Request messages
+        temperature: Sampling temperature
+        params: Other response-affecting request parameters
+
+    Returns:
+        sha256 hex digest
+    """
+    payload = {
+        "model": model,
+        "prompt_version": prompt_version,
+        "messages": messages,
+        "temperature": temperature,
+        "params": params or {}
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-level (memory LRU + disk) response cache"""
+
+    def __init__(self, cache_dir: Optional[str] = LLM_CACHE_DIR,
+                 max_memory_entries: int = LLM_CACHE_MEMORY_ENTRIES,
+                 ttl_by_tool: Optional[Dict[str, float]] = None,
+                 bypass_tools: Optional[set] = None,
+                 enabled: bool = LLM_CACHE_ENABLED):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.ttl_by_tool = dict(LLM_CACHE_TTL if ttl_by_tool is None else ttl_by_tool)
+        self.bypass_tools = set(LLM_CACHE_BYPASS_TOOLS if bypass_tools is None else bypass_tools)
+        self.enabled = enabled
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def is_cacheable(self, tool_name: str, use_cache: bool = True) -> bool:
+        """Only tools with a configured TTL are cached; flags can switch caching off"""
+        return (
+            self.enabled
+            and use_cache
+            and not _bypass.get()
+            and tool_name not in self.bypass_tools
+            and tool_name in self.ttl_by_tool
+        )
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir or "", key[:2], f"{key}.json")
+
+    def _remember(self, key: str, created_at: float, content: str) -> None:
+        with self._lock:
+            self._memory[key] = (created_at, content)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str, tool_name: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Returns:
+            Cached content, or None on miss/expiry
+        """
+        ttl = self.ttl_by_tool.get(tool_name, 0)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._memory[key]
+
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+                if now - record["created_at"] <= ttl:
+                    self._remember(key, record["created_at"], record["content"])
+                    with self._lock:
+                        self.hits += 1
+                    return record["content"]
+                os.remove(path)
+            except (OSError, ValueError, KeyError):
+                pass
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, content: str, tool_name: str, model: str = "") -> None:
+        """Store a response in memory and on disk"""
+        created_at = time.time()
+        self._remember(key, created_at, content)
+
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write temp file first, then replace atomically (same as the meal database)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "created_at": created_at,
+                    "tool": tool_name,
+                    "model": model,
+                    "content": content
+                }, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"⚠️  LLM cache write failed: {str(e)}")
+
+    def clear(self) -> None:
+        """Drop the memory layer and delete all disk entries"""
+        with self._lock:
+            self._memory.clear()
+            self.hits = 0
+            self.misses = 0
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith(".json"):
+                        os.remove(os.path.join(root, name))
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and hit ratio"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "memory_entries": len(self._memory)
+            }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Get the process-wide response cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
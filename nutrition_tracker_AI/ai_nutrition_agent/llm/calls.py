@@ -0,0 +1,290 @@
+"""
+LLM Calls - Shared sync/async call path for every LLM-backed tool
+Cached responses, retries and circuit breaking live here, so tools need none of their own
+Streaming variants yield text deltas for incremental parsing (see llm.json_extract)
+"""
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Type
+
+from pydantic import BaseModel
+
+from config.settings import LLM_PROMPT_VERSION
+from llm.client import get_client, get_async_client
+from llm.cache import get_response_cache, make_cache_key
+from llm.structured import MODES, apply_structured_output, downgrade_on_error
+from llm.resilience import Attempts, call_with_resilience, acall_with_resilience
+from llm.rate_limit import estimate_tokens, get_rate_limiter
+from llm.usage import record_response, record_cache_hit, record_error
+
+
+def _extract_content(response: Any) -> str:
+    """Take the text content out of a chat completion response"""
+    content = response.choices[0].message.content
+    if not content:
+        raise ValueError("Model returned empty content")
+    return content
+
+
+def _cache_lookup(tool_name: str, model: str, messages: List[Dict[str, Any]], temperature: float,
+                  use_cache: bool, prompt_version: str, params: Dict[str, Any]):
+    """
+    Returns:
+        (cache_key, cached_content) - key is None when the call is not cacheable
+    """
+    cache = get_response_cache()
+    if not cache.is_cacheable(tool_name, use_cache):
+        return None, None
+    key = make_cache_key(model, prompt_version, messages, temperature, params)
+    return key, cache.get(key, tool_name)
+
+
+def _total_tokens(response: Any) -> int:
+    usage = getattr(response, "usage", None)
+    return (getattr(usage, "prompt_tokens", 0) or 0) + (getattr(usage, "completion_tokens", 0) or 0)
+
+
+def _rate_limited(client: Any, model: str, estimated: int, request: Dict[str, Any]):
+    """Upstream call for call_with_resilience; every attempt first takes from the rate limiter"""
+    def attempt(timeout: float) -> Any:
+        limiter = get_rate_limiter()
+        limiter.acquire(model, estimated)
+        try:
+            return client.chat.completions.create(model=model, timeout=timeout, **request)
+        except BaseException:
+            # No response, no usage: a failed attempt (retried or not) must not drain the bucket
+            limiter.refund(model, estimated)
+            raise
+    return attempt
+
+
+def _arate_limited(client: Any, model: str, estimated: int, request: Dict[str, Any]):
+    """Async version of _rate_limited"""
+    async def attempt(timeout: float) -> Any:
+        limiter = get_rate_limiter()
+        await limiter.aacquire(model, estimated)
+        try:
+            return await client.chat.completions.create(model=model, timeout=timeout, **request)
+        except BaseException:
+            await limiter.arefund(model, estimated)
+            raise
+    return attempt
+
+
+def chat_completion(tool_name: str, model: str, messages: List[Dict[str, Any]],
+                    temperature: float, use_cache: bool = True,
+                    prompt_version: str = LLM_PROMPT_VERSION,
+                    response_schema: Optional[Type[BaseModel]] = None,
+                    response_is_list: bool = False, **kwargs: Any) -> str:
+    """
+    Call the chat completions endpoint (blocking).
+
+    Args:
+        tool_name: Name of the calling tool (selects cache TTL)
+        model: Model name
+        messages: OpenAI-format message list
+        temperature: Sampling temperature
+        use_cache: Set False to bypass the response cache for this call
+        prompt_version: Prompt version tag, part of the cache key
+        response_schema: Pydantic model of the expected JSON; requests structured output if supported
+        response_is_list: The expected JSON is an array of response_schema objects
+        **kwargs: Extra request parameters
+
+    Returns:
+        Response text content
+    """
+    # One attempt per structured-output mode at most: each retry is a step down
+    for attempt in range(len(MODES)):
+        mode, call_messages, params = apply_structured_output(model, messages, kwargs, response_schema, response_is_list)
+        try:
+            return _complete(tool_name, model, call_messages, temperature, use_cache, prompt_version, params)
+        except Exception as e:
+            # only a 400 rejecting response_format
+            if attempt == len(MODES) - 1 or not downgrade_on_error(model, mode, e):
+                raise
+
+
+def _complete(tool_name: str, model: str, messages: List[Dict[str, Any]], temperature: float,
+              use_cache: bool, prompt_version: str, kwargs: Dict[str, Any]) -> str:
+    """One chat completion through cache, resilience and usage accounting"""
+    started_at = time.perf_counter()
+    key, cached = _cache_lookup(tool_name, model, messages, temperature, use_cache, prompt_version, kwargs)
+    if cached is not None:
+        record_cache_hit(tool_name, model, started_at)
+        return cached
+
+    client = get_client()
+    attempts = Attempts()
+    estimated = estimate_tokens(messages, kwargs)
+    try:
+        response = call_with_resilience(model, _rate_limited(client, model, estimated, dict(
+            messages=messages,
+            temperature=temperature,
+            **kwargs
+        )), attempts)
+        content = _extract_content(response)
+    except Exception as e:
+        record_error(tool_name, model, e, started_at, retries=attempts.retries)
+        raise
+    record_response(tool_name, model, response, started_at, retries=attempts.retries)
+    get_rate_limiter().settle(model, estimated, _total_tokens(response))
+
+    if key is not None:
+        get_response_cache().set(key, content, tool_name, model)
+    return content
+
+
+async def achat_completion(tool_name: str, model: str, messages: List[Dict[str, Any]],
+                           temperature: float, use_cache: bool = True,
+                           prompt_version: str = LLM_PROMPT_VERSION,
+                           response_schema: Optional[Type[BaseModel]] = None,
+                           response_is_list: bool = False, **kwargs: Any) -> str:
+    """
+    Call the chat completions endpoint (asyncio).
+
+    Args:
+        tool_name: Name of the calling tool (selects cache TTL)
+        model: Model name
+        messages: OpenAI-format message list
+        temperature: Sampling temperature
+        use_cache: Set False to bypass the response cache for this call
+        prompt_version: Prompt version tag, part of the cache key
+        response_schema: Pydantic model of the expected JSON; requests structured output if supported
+        response_is_list: The expected JSON is an array of response_schema objects
+        **kwargs: Extra request parameters
+
+    Returns:
+        Response text content
+    """
+    # One attempt per structured-output mode at most: each retry is a step down
+    for attempt in range(len(MODES)):
+        mode, call_messages, params = apply_structured_output(model, messages, kwargs, response_schema, response_is_list)
+        try:
+            return await _acomplete(tool_name, model, call_messages, temperature, use_cache, prompt_version, params)
+        except Exception as e:
+            # only a 400 rejecting response_format
+            if attempt == len(MODES) - 1 or not downgrade_on_error(model, mode, e):
+                raise
+
+
+async def _acomplete(tool_name: str, model: str, messages: List[Dict[str, Any]], temperature: float,
+                     use_cache: bool, prompt_version: str, kwargs: Dict[str, Any]) -> str:
+    """One async chat completion through cache, resilience and usage accounting"""
+    started_at = time.perf_counter()
+    key, cached = _cache_lookup(tool_name, model, messages, temperature, use_cache, prompt_version, kwargs)
+    if cached is not None:
+        record_cache_hit(tool_name, model, started_at)
+        return cached
+
+    client = get_async_client()
+    attempts = Attempts()
+    estimated = estimate_tokens(messages, kwargs)
+    try:
+        response = await acall_with_resilience(model, _arate_limited(client, model, estimated, dict(
+            messages=messages,
+            temperature=temperature,
+            **kwargs
+        )), attempts)
+        content = _extract_content(response)
+    except Exception as e:
+        record_error(tool_name, model, e, started_at, retries=attempts.retries)
+        raise
+    record_response(tool_name, model, response, started_at, retries=attempts.retries)
+    await get_rate_limiter().asettle(model, estimated, _total_tokens(response))
+
+    if key is not None:
+        get_response_cache().set(key, content, tool_name, model)
+    return content
+
+
+def _stream_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Ask for a final usage chunk so streamed calls are accounted like normal ones"""
+    return {"stream": True, "stream_options": {"include_usage": True}, **kwargs}
+
+
+def stream_chat_completion(tool_name: str, model: str, messages: List[Dict[str, Any]],
+                           temperature: float, use_cache: bool = True,
+                           prompt_version: str = LLM_PROMPT_VERSION, **kwargs: Any) -> Iterator[str]:
+    """
+    Call the chat completions endpoint and yield text deltas as they arrive (blocking).
+    Retries cover opening the stream; a cached response is yielded as one chunk.
+
+    Args:
+        Same as chat_completion
+
+    Yields:
+        Response text chunks
+    """
+    started_at = time.perf_counter()
+    key, cached = _cache_lookup(tool_name, model, messages, temperature, use_cache, prompt_version, kwargs)
+    if cached is not None:
+        record_cache_hit(tool_name, model, started_at)
+        yield cached
+        return
+
+    client = get_client()
+    attempts = Attempts()
+    estimated = estimate_tokens(messages, kwargs)
+    parts: List[str] = []
+    usage_chunk = None
+    try:
+        stream = call_with_resilience(model, _rate_limited(client, model, estimated, dict(
+            messages=messages,
+            temperature=temperature,
+            **_stream_kwargs(kwargs)
+        )), attempts)
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage_chunk = chunk
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        if not parts:
+            raise ValueError("Model returned empty content")
+    except Exception as e:
+        record_error(tool_name, model, e, started_at, retries=attempts.retries)
+        raise
+    record_response(tool_name, model, usage_chunk, started_at, retries=attempts.retries)
+    get_rate_limiter().settle(model, estimated, _total_tokens(usage_chunk))
+
+    if key is not None:
+        get_response_cache().set(key, "".join(parts), tool_name, model)
+
+
+async def astream_chat_completion(tool_name: str, model: str, messages: List[Dict[str, Any]],
+                                  temperature: float, use_cache: bool = True,
+                                  prompt_version: str = LLM_PROMPT_VERSION, **kwargs: Any) -> AsyncIterator[str]:
+    """Async version of stream_chat_completion"""
+    started_at = time.perf_counter()
+    key, cached = _cache_lookup(tool_name, model, messages, temperature, use_cache, prompt_version, kwargs)
+    if cached is not None:
+        record_cache_hit(tool_name, model, started_at)
+        yield cached
+        return
+
+    client = get_async_client()
+    attempts = Attempts()
+    estimated = estimate_tokens(messages, kwargs)
+    parts: List[str] = []
+    usage_chunk = None
+    try:
+        stream = await acall_with_resilience(model, _arate_limited(client, model, estimated, dict(
+            messages=messages,
+            temperature=temperature,
+            **_stream_kwargs(kwargs)
+        )), attempts)
+        async for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage_chunk = chunk
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        if not parts:
+            raise ValueError("Model returned empty content")
+    except Exception as e:
+        record_error(tool_name, model, e, started_at, retries=attempts.retries)
+        raise
+    record_response(tool_name, model, usage_chunk, started_at, retries=attempts.retries)
+    await get_rate_limiter().asettle(model, estimated, _total_tokens(usage_chunk))
+
+    if key is not None:
+        get_response_cache().set(key, "".join(parts), tool_name, model)
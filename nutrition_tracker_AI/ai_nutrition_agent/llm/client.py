@@ -0,0 +1,151 @@
+"""
+LLM Client - One pooled, keep-alive HTTP connection shared by every tool and the agent
+Clients (and the openai / httpx imports behind them) are created on first use, not at import.
+"""
+import asyncio
+import threading
+import weakref
+from typing import TYPE_CHECKING, Optional
+
+from config.settings import (
+    DASHSCOPE_API_KEY,
+    QWEN_BASE_URL,
+    AGENT_MODEL,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_CONNECT_TIMEOUT,
+    LLM_READ_TIMEOUT
+)
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import OpenAI, AsyncOpenAI
+
+
+_lock = threading.Lock()
+_http_client: Optional["httpx.Client"] = None
+_client: Optional["OpenAI"] = None
+# Async connections are bound to the event loop that opened them, so keep one client per loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+
+def _build_timeout() -> "httpx.Timeout":
+    """Connect timeout is short so a dead endpoint fails fast; read timeout covers generation"""
+    import httpx
+
+    return httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def _build_limits() -> "httpx.Limits":
+    """Connection pool sized for one analysis fanning out to 6-10 upstream calls"""
+    import httpx
+
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+    )
+
+
+def get_http_client() -> "httpx.Client":
+    """
+    Get the process-wide pooled HTTP client (created on first use).
+
+    Returns:
+        httpx.Client with keep-alive connection pool and timeouts
+    """
+    global _http_client
+    if _http_client is None:
+        import httpx
+
+        with _lock:
+            if _http_client is None:
+                _http_client = httpx.Client(limits=_build_limits(), timeout=_build_timeout())
+    return _http_client
+
+
+def get_client() -> "OpenAI":
+    """
+    Get the shared OpenAI-compatible client for the Qwen API (created on first use).
+
+    Returns:
+        OpenAI client reusing the pooled HTTP connections
+    """
+    global _client
+    if _client is None:
+        from openai import OpenAI
+
+        http_client = get_http_client()
+        with _lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=DASHSCOPE_API_KEY,
+                    base_url=QWEN_BASE_URL,
+                    timeout=_build_timeout(),
+                    max_retries=0,  # Retries are handled by llm.resilience
+                    http_client=http_client
+                )
+    return _client
+
+
+def get_async_client() -> "AsyncOpenAI":
+    """
+    Get the shared async OpenAI-compatible client for the running event loop.
+
+    Returns:
+        AsyncOpenAI client with its own pooled keep-alive connections
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        import httpx
+        from openai import AsyncOpenAI
+
+        with _lock:
+            client = _async_clients.get(loop)
+            if client is None:
+                client = AsyncOpenAI(
+                    api_key=DASHSCOPE_API_KEY,
+                    base_url=QWEN_BASE_URL,
+                    timeout=_build_timeout(),
+                    max_retries=0,
+                    http_client=httpx.AsyncClient(limits=_build_limits(), timeout=_build_timeout())
+                )
+                _async_clients[loop] = client
+    return client
+
+
+def get_chat_model(model: str = AGENT_MODEL):
+    """
+    Build a LangChain chat model for the agent on top of the shared connection pool.
+
+    Args:
+        model: Model name (defaults to AGENT_MODEL)
+
+    Returns:
+        ChatOpenAI instance talking to the Qwen compatible-mode endpoint
+    """
+    from langchain_openai import ChatOpenAI
+    from llm.usage import UsageCallbackHandler
+
+    return ChatOpenAI(
+        model=model,
+        api_key=DASHSCOPE_API_KEY,  # type: ignore
+        base_url=QWEN_BASE_URL,
+        timeout=_build_timeout(),
+        http_client=get_http_client(),
+        callbacks=[UsageCallbackHandler()]
+    )
+
+
+def close_clients() -> None:
+    """Close pooled connections (call on process shutdown)"""
+    global _http_client, _client
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = None
+        _client = None
+        # Async clients close with their event loop; just drop the references
+        _async_clients.clear()
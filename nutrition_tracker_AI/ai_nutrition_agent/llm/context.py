@@ -0,0 +1,39 @@
+"""
+Request Context - Per-request ID propagated to every upstream call via contextvars
+"""
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+def new_request_id() -> str:
+    """Generate a short unique request ID"""
+    return f"req_{uuid.uuid4().hex[:12]}"
+
+
+def get_request_id() -> Optional[str]:
+    """ID of the request currently being processed (None outside a request)"""
+    return _request_id.get()
+
+
+@contextmanager
+def request_scope(request_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Run a block as one request; calls made inside are attributed to it.
+
+    Args:
+        request_id: Existing ID to reuse (a new one is generated if omitted)
+
+    Yields:
+        The request ID
+    """
+    request_id = request_id or new_request_id()
+    token = _request_id.set(request_id)
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(token)
@@ -0,0 +1,241 @@
+"""
+JSON Extraction - Find, parse and validate the JSON value in a model response
+Shared by every LLM-backed tool; also parses streamed completions incrementally
+"""
+import json
+from typing import Any, AsyncIterator, Iterable, Iterator, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _parsed(content: str, spans: List[Tuple[int, int]]) -> Iterator[Tuple[Any, int]]:
+    for begin, end in spans:
+        try:
+            yield json.loads(content[begin:end]), end
+        except ValueError:
+            pass
+
+
+def iter_json_values(content: str) -> Iterator[Tuple[Any, int]]:
+    """
+    Yield each balanced JSON object/array found in free text, left to right.
+    Preambles, trailing prose and any number of code fences are skipped.
+    One pass over the text: a candidate that does not parse (a bracket in prose, e.g. "[note]")
+    is skipped as a whole, and brackets that never close are dropped at the point they fail.
+
+    Yields:
+        (parsed value, index just past it)
+    """
+    stack: List[Tuple[str, int]] = []  # (expected closer, index of the opening bracket)
+    # Balanced values closed inside a bracket that is still open, outermost only: tried if
+    # that bracket turns out never to close (e.g. '{ result: [1, 2]' or '[ {"a": 1} }')
+    inner: List[Tuple[int, int]] = []
+    in_string = False
+    escape = False
+    for i, char in enumerate(content):
+        if not stack:
+            if char in _CLOSERS:
+                stack.append((_CLOSERS[char], i))
+        elif in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append((_CLOSERS[char], i))
+        elif char in "}]":
+            closer, begin = stack.pop()
+            if char != closer:
+                # No bracket open here can close any more
+                stack = []
+                yield from _parsed(content, inner)
+                inner = []
+                continue
+            while inner and inner[-1][0] > begin:
+                inner.pop()  # nested in the value that just closed
+            if stack:
+                inner.append((begin, i + 1))
+            else:
+                yield from _parsed(content, [(begin, i + 1)])
+    yield from _parsed(content, inner)
+
+
+def find_json(content: str) -> Tuple[Any, int]:
+    """
+    Find the first balanced JSON object/array in free text.
+
+    Returns:
+        (parsed value, index just past it)
+
+    Raises:
+        ValueError: If no valid JSON value is present
+    """
+    for found in iter_json_values(content):
+        return found
+    raise ValueError("No JSON value found in model output")
+
+
+def _validate_item(item: Any, schema: Type[BaseModel]) -> Any:
+    """Validate one object; unknown keys the tools rely on (dish_id, ...) are kept"""
+    model = schema.model_validate(item)
+    return {**item, **model.model_dump()}
+
+
+def validate_json(data: Any, schema: Optional[Type[BaseModel]]) -> Any:
+    """
+    Validate a parsed value against a pydantic schema (each element if it is a list).
+
+    Raises:
+        pydantic.ValidationError (a ValueError) on schema mismatch
+    """
+    if schema is None:
+        return data
+    if isinstance(data, list):
+        return [_validate_item(item, schema) for item in data]
+    return _validate_item(data, schema)
+
+
+def extract_json(content: str, schema: Optional[Type[BaseModel]] = None) -> Any:
+    """
+    Extract and validate the JSON value of a model response.
+
+    Args:
+        content: Raw response text
+        schema: Optional pydantic model each object must satisfy
+
+    Returns:
+        Parsed (and validated) JSON value
+    """
+    first_error: Optional[ValueError] = None
+    for value, _ in iter_json_values(content):
+        if schema is not None and isinstance(value, dict) and list(value) == ["items"]:
+            # Schema-constrained array answers arrive wrapped as {"items": [...]}
+            value = value["items"]
+        try:
+            return validate_json(value, schema)
+        except ValueError as e:
+            # A bracketed aside like "[1]" parses but is not the answer - try the next value
+            first_error = first_error or e
+    if first_error is not None:
+        raise first_error
+    raise ValueError("No JSON value found in model output")
+
+
+class JSONStreamParser:
+    """
+    Incremental parser for a streamed completion.
+    When the top-level value is an array, each object/array element is emitted as soon as it
+    closes, so downstream work can start before the stream finishes.
+    """
+
+    def __init__(self, schema: Optional[Type[BaseModel]] = None):
+        self.schema = schema
+        self.buffer = ""
+        self._pos = 0
+        self._top_start: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._done = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        """
+        Add a chunk of text.
+
+        Returns:
+            Array elements completed by this chunk (validated against the schema)
+        """
+        self.buffer += chunk
+        items = []
+        while self._pos < len(self.buffer) and not self._done:
+            item = self._step(self.buffer[self._pos])
+            self._pos += 1
+            if item is not None:
+                items.append(item)
+        return items
+
+    def _step(self, char: str) -> Any:
+        if self._top_start is None:
+            if char in _CLOSERS:
+                self._top_start = self._pos
+                self._stack = [_CLOSERS[char]]
+            return None
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+            return None
+        if char == '"':
+            self._in_string = True
+        elif char in _CLOSERS:
+            if len(self._stack) == 1 and self._stack[0] == "]":
+                self._item_start = self._pos
+            self._stack.append(_CLOSERS[char])
+        elif char in "}]":
+            if char != self._stack.pop():
+                self._restart()  # resume after the mismatched closer
+                return None
+            if not self._stack:
+                if self._is_answer(self.buffer[self._top_start:self._pos + 1]):
+                    self._done = True
+                else:
+                    self._restart()
+            elif len(self._stack) == 1 and self._item_start is not None:
+                raw = self.buffer[self._item_start:self._pos + 1]
+                self._item_start = None
+                return self._emit(raw)
+        return None
+
+    def _emit(self, raw: str) -> Any:
+        try:
+            return validate_json(json.loads(raw), self.schema)
+        except ValueError:
+            # Not valid (yet) - the final parse in close() decides
+            return None
+
+    def _is_answer(self, raw: str) -> bool:
+        """A closed top-level value only ends the search if it parses and validates"""
+        try:
+            validate_json(json.loads(raw), self.schema)
+            return True
+        except ValueError:
+            return False
+
+    def _restart(self) -> None:
+        """The candidate was prose: search on after the bracket that ended it (close() re-scans the buffer)"""
+        self._top_start = None
+        self._item_start = None
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+
+    def close(self) -> Any:
+        """Parse the complete buffer (authoritative result)"""
+        return extract_json(self.buffer, self.schema)
+
+
+def iter_json_items(chunks: Iterable[str], schema: Optional[Type[BaseModel]] = None) -> Iterator[Any]:
+    """Yield array elements from a stream of text chunks as each one completes"""
+    parser = JSONStreamParser(schema)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+
+async def aiter_json_items(chunks: AsyncIterator[str],
+                           schema: Optional[Type[BaseModel]] = None) -> AsyncIterator[Any]:
+    """Async version of iter_json_items"""
+    parser = JSONStreamParser(schema)
+    async for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
@@ -0,0 +1,257 @@
+"""
+Rate Limiter - Token buckets for requests/sec and tokens/min per model, shared across processes
+State lives in a small SQLite file so every agent_server worker draws from the same buckets.
+Batch work may not dip into the reserve kept for interactive requests.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from config.settings import (
+    LLM_RATE_LIMIT_ENABLED,
+    LLM_RATE_LIMIT_DB,
+    LLM_RATE_LIMITS,
+    LLM_RATE_LIMIT_DEFAULT,
+    LLM_RATE_LIMIT_BATCH_RESERVE
+)
+from llm.resilience import DeadlineExceeded, remaining_time
+
+
+LANES = ("interactive", "batch")
+# Rough prompt cost of one image for the token estimate
+_IMAGE_TOKENS = 1024
+_DEFAULT_COMPLETION_TOKENS = 512
+
+_lane: ContextVar[str] = ContextVar("llm_priority_lane", default="interactive")
+
+
+@contextmanager
+def priority_lane(lane: str) -> Iterator[None]:
+    """
+    Run a block in a priority lane ("interactive" or "batch").
+    Batch calls leave LLM_RATE_LIMIT_BATCH_RESERVE of each bucket to interactive ones.
+    """
+    if lane not in LANES:
+        raise ValueError(f"Unknown priority lane: {lane}")
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def get_priority_lane() -> str:
+    return _lane.get()
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], params: Dict[str, Any]) -> int:
+    """Estimate prompt + completion tokens of a request (~4 characters per token)"""
+    chars = 0
+    images = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and part.get("type") == "image_url":
+                    images += 1
+                elif isinstance(part, dict):
+                    chars += len(str(part.get("text") or ""))
+        else:
+            chars += len(str(content))
+    completion = params.get("max_tokens") or _DEFAULT_COMPLETION_TOKENS
+    return chars // 4 + images * _IMAGE_TOKENS + completion
+
+
+class RateLimiter:
+    """Process-shared token buckets (one for requests, one for tokens) per model"""
+
+    def __init__(self, db_path: str = LLM_RATE_LIMIT_DB, limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 default: Optional[Dict[str, float]] = None, batch_reserve: float = LLM_RATE_LIMIT_BATCH_RESERVE,
+                 enabled: bool = LLM_RATE_LIMIT_ENABLED):
+        self.db_path = db_path
+        self.limits = LLM_RATE_LIMITS if limits is None else limits
+        self.default = LLM_RATE_LIMIT_DEFAULT if default is None else default
+        self.batch_reserve = batch_reserve
+        self.enabled = enabled
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {lane: {"acquired": 0, "waited": 0, "wait_s": 0.0} for lane in LANES}
+        if enabled:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            with self._connection() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS buckets ("
+                    "model TEXT, kind TEXT, level REAL, updated REAL, PRIMARY KEY (model, kind))"
+                )
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """Per-thread connection; BEGIN IMMEDIATE serializes bucket updates across processes"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _buckets(self, model: str) -> Dict[str, Dict[str, float]]:
+        """capacity and refill rate (per second) of the request and token buckets"""
+        limit = {**self.default, **self.limits.get(model, {})}
+        return {
+            "requests": {"capacity": max(1.0, limit["rps"]), "rate": limit["rps"]},
+            "tokens": {"capacity": limit["tpm"], "rate": limit["tpm"] / 60}
+        }
+
+    def _levels(self, conn: sqlite3.Connection, model: str, buckets: Dict[str, Dict[str, float]],
+                now: float) -> Dict[str, float]:
+        """Current refilled levels (full for a model seen for the first time)"""
+        rows = dict(
+            (kind, (level, updated)) for kind, level, updated in
+            conn.execute("SELECT kind, level, updated FROM buckets WHERE model = ?", (model,))
+        )
+        levels = {}
+        for kind, bucket in buckets.items():
+            level, updated = rows.get(kind, (bucket["capacity"], now))
+            levels[kind] = min(bucket["capacity"], level + (now - updated) * bucket["rate"])
+        return levels
+
+    def _store(self, conn: sqlite3.Connection, model: str, levels: Dict[str, float], now: float) -> None:
+        conn.executemany(
+            "INSERT OR REPLACE INTO buckets (model, kind, level, updated) VALUES (?, ?, ?, ?)",
+            [(model, kind, level, now) for kind, level in levels.items()]
+        )
+
+    def try_acquire(self, model: str, tokens: int, lane: str = "interactive") -> float:
+        """
+        Take one request and `tokens` tokens if available. A request larger than a bucket costs
+        the whole bucket (never more), so it cannot drive the level negative and starve others.
+
+        Returns:
+            0 if acquired, otherwise seconds to wait before trying again
+        """
+        buckets = self._buckets(model)
+        reserve = self.batch_reserve if lane == "batch" else 0.0
+        need = {kind: min(amount, buckets[kind]["capacity"])
+                for kind, amount in (("requests", 1.0), ("tokens", float(tokens)))}
+        with self._connection() as conn:
+            now = time.time()
+            levels = self._levels(conn, model, buckets, now)
+            wait = 0.0
+            for kind, bucket in buckets.items():
+                floor = bucket["capacity"] * reserve
+                # A request larger than what is above the reserve would never fit; let it through on a full bucket
+                amount = min(need[kind], bucket["capacity"] - floor)
+                if levels[kind] - amount < floor:
+                    wait = max(wait, (amount + floor - levels[kind]) / bucket["rate"])
+            if wait == 0.0:
+                for kind in buckets:
+                    levels[kind] -= need[kind]
+            self._store(conn, model, levels, now)
+        return wait
+
+    def settle(self, model: str, estimated: int, actual: int) -> None:
+        """Correct the token bucket once the real usage of a call is known"""
+        if not self.enabled or actual <= 0 or actual == estimated:
+            return
+        self._credit(model, estimated, actual)
+
+    def refund(self, model: str, tokens: int) -> None:
+        """Give back the tokens taken for an attempt that got no response (it used none upstream)"""
+        if not self.enabled or tokens <= 0:
+            return
+        self._credit(model, tokens, 0)
+
+    def _credit(self, model: str, estimated: int, actual: int) -> None:
+        buckets = self._buckets(model)
+        capacity = buckets["tokens"]["capacity"]
+        with self._connection() as conn:
+            now = time.time()
+            levels = self._levels(conn, model, buckets, now)
+            # One call never costs more than a full bucket (see try_acquire)
+            levels["tokens"] = min(capacity, levels["tokens"] + min(estimated, capacity) - min(actual, capacity))
+            self._store(conn, model, levels, now)
+
+    async def asettle(self, model: str, estimated: int, actual: int) -> None:
+        """Async version of settle (the SQLite transaction runs off the event loop)"""
+        if not self.enabled or actual <= 0 or actual == estimated:
+            return
+        await asyncio.to_thread(self.settle, model, estimated, actual)
+
+    async def arefund(self, model: str, tokens: int) -> None:
+        """Async version of refund"""
+        if not self.enabled or tokens <= 0:
+            return
+        await asyncio.to_thread(self.refund, model, tokens)
+
+    def _check_wait(self, wait: float) -> None:
+        remaining = remaining_time()
+        if remaining is not None and wait >= remaining:
+            raise DeadlineExceeded("Rate limit wait exceeds the request deadline")
+
+    def _record(self, lane: str, waited: float) -> None:
+        with self._stats_lock:
+            stats = self._stats[lane]
+            stats["acquired"] += 1
+            if waited > 0:
+                stats["waited"] += 1
+                stats["wait_s"] += waited
+
+    def acquire(self, model: str, tokens: int) -> None:
+        """Block until the call may go upstream (current priority lane)"""
+        if not self.enabled:
+            return
+        lane = get_priority_lane()
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(model, tokens, lane)
+            if wait == 0.0:
+                break
+            self._check_wait(wait)
+            time.sleep(wait)
+            waited += wait
+        self._record(lane, waited)
+
+    async def aacquire(self, model: str, tokens: int) -> None:
+        """Async version of acquire (bucket transactions wait for the SQLite lock on a worker thread)"""
+        if not self.enabled:
+            return
+        lane = get_priority_lane()
+        waited = 0.0
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, model, tokens, lane)
+            if wait == 0.0:
+                break
+            self._check_wait(wait)
+            await asyncio.sleep(wait)
+            waited += wait
+        self._record(lane, waited)
+
+    def stats(self) -> Dict[str, Any]:
+        """Acquisitions and time spent waiting, per lane (this process)"""
+        with self._stats_lock:
+            return {lane: {**stats, "wait_s": round(stats["wait_s"], 3)} for lane, stats in self._stats.items()}
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Get the process-wide rate limiter (created on first use)"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
@@ -0,0 +1,312 @@
+"""
+Resilience Layer - Jittered retries, per-request deadline and per-model circuit breaker
+Wraps every upstream call made through llm.calls
+"""
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+from config.settings import (
+    LLM_READ_TIMEOUT,
+    LLM_RETRY_MAX_ATTEMPTS,
+    LLM_RETRY_BASE_DELAY,
+    LLM_RETRY_MAX_DELAY,
+    LLM_BREAKER_FAILURE_THRESHOLD,
+    LLM_BREAKER_RESET_TIMEOUT
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling upstream while a model's circuit breaker is open"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the request's deadline leaves no time for another call"""
+
+
+# ---------------------------------------------------------------------------
+# Deadline budget (propagated through contextvars to every step of a request)
+# ---------------------------------------------------------------------------
+
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Give every call inside this block a shared time budget.
+    Nested scopes can only shorten the budget, never extend it.
+
+    Args:
+        seconds: Budget in seconds (None = no deadline)
+    """
+    if seconds is None:
+        yield
+        return
+    new_deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(new_deadline if current is None else min(current, new_deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left in the current deadline (None when no deadline is set)"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def call_timeout(default: float = LLM_READ_TIMEOUT) -> float:
+    """Timeout for the next upstream call, capped by the remaining deadline"""
+    remaining = remaining_time()
+    if remaining is None:
+        return default
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(default, remaining)
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _count(model: str, key: str) -> None:
+    with _stats_lock:
+        bucket = _stats.setdefault(model, {"retries": 0, "trips": 0, "short_circuits": 0, "deadline_exceeded": 0})
+        bucket[key] += 1
+
+
+def get_resilience_stats() -> Dict[str, Any]:
+    """Retry / breaker-trip / short-circuit counters per model, plus breaker states"""
+    with _stats_lock:
+        counters = {model: dict(bucket) for model, bucket in _stats.items()}
+    with _breakers_lock:
+        states = {model: breaker.state for model, breaker in _breakers.items()}
+    return {"counters": counters, "breakers": states}
+
+
+def reset_resilience_state() -> None:
+    """Clear counters and breakers (tests / admin)"""
+    with _stats_lock:
+        _stats.clear()
+    with _breakers_lock:
+        _breakers.clear()
+
+
+# ---------------------------------------------------------------------------
+# Circuit breaker
+# ---------------------------------------------------------------------------
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    closed → open after N transient failures; open → half_open after reset_timeout;
+    one probe call in half_open decides between closed and open.
+    """
+
+    def __init__(self, model: str, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = LLM_BREAKER_RESET_TIMEOUT):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError if the call must not go upstream"""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    _count(self.model, "short_circuits")
+                    raise CircuitOpenError(f"Circuit open for model {self.model}")
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open":
+                if self._probe_in_flight:
+                    _count(self.model, "short_circuits")
+                    raise CircuitOpenError(f"Circuit half-open for model {self.model}, probe in flight")
+                self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """The call ended without a verdict on the model's health: free the half-open probe slot"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    _count(self.model, "trips")
+                    print(f"⚠️  Circuit breaker opened for {self.model} after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+_breakers_lock = threading.Lock()
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(model: str) -> CircuitBreaker:
+    """Get (or create) the circuit breaker for a model"""
+    with _breakers_lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = _breakers[model] = CircuitBreaker(model)
+        return breaker
+
+
+# ---------------------------------------------------------------------------
+# Retry policy
+# ---------------------------------------------------------------------------
+
+def is_retryable(error: BaseException) -> bool:
+    """Timeouts, connection errors, 429 and 5xx are transient; everything else is not"""
+    import openai
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt: int, error: Optional[BaseException] = None,
+                  base_delay: float = LLM_RETRY_BASE_DELAY, max_delay: float = LLM_RETRY_MAX_DELAY) -> float:
+    """
+    Full-jitter exponential backoff; a 429's Retry-After header is honoured as a floor.
+
+    Args:
+        attempt: Zero-based attempt number that just failed
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, min(max_delay, float(retry_after)))
+        except ValueError:
+            pass
+    return delay
+
+
+@dataclass
+class Attempts:
+    """Retry count of one logical call (read by usage accounting)"""
+    retries: int = 0
+
+
+def _next_delay(model: str, attempt: int, error: BaseException, max_attempts: int) -> Optional[float]:
+    """Delay before the next attempt, or None if the error should be raised now"""
+    if not is_retryable(error) or attempt + 1 >= max_attempts:
+        return None
+    delay = backoff_delay(attempt, error)
+    remaining = remaining_time()
+    if remaining is not None and remaining <= delay:
+        _count(model, "deadline_exceeded")
+        return None
+    _count(model, "retries")
+    return delay
+
+
+def call_with_resilience(model: str, fn: Callable[[float], Any], attempts: Attempts,
+                         max_attempts: int = LLM_RETRY_MAX_ATTEMPTS) -> Any:
+    """
+    Run fn(timeout) with breaker check, deadline-capped timeout and jittered retries.
+
+    Args:
+        model: Model name (selects circuit breaker)
+        fn: Upstream call taking the per-attempt timeout in seconds
+        attempts: Receives the number of retries made
+        max_attempts: Total attempts including the first
+    """
+    breaker = get_breaker(model)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            timeout = call_timeout()
+        except DeadlineExceeded:
+            breaker.release_probe()
+            _count(model, "deadline_exceeded")
+            raise
+        try:
+            response = fn(timeout)
+        except Exception as e:
+            if is_retryable(e):
+                breaker.record_failure()
+            else:
+                # Not the model's fault (a 400, or no request sent at all): leave the state as it is
+                breaker.release_probe()
+            delay = _next_delay(model, attempt, e, max_attempts)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            attempts.retries = attempt
+            continue
+        except BaseException:
+            # Cancelled mid-call: a half-open breaker must not wait forever for this probe
+            breaker.release_probe()
+            raise
+        breaker.record_success()
+        return response
+
+
+async def acall_with_resilience(model: str, fn: Callable[[float], Awaitable[Any]], attempts: Attempts,
+                                max_attempts: int = LLM_RETRY_MAX_ATTEMPTS) -> Any:
+    """Async version of call_with_resilience"""
+    breaker = get_breaker(model)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            timeout = call_timeout()
+        except DeadlineExceeded:
+            breaker.release_probe()
+            _count(model, "deadline_exceeded")
+            raise
+        try:
+            response = await fn(timeout)
+        except Exception as e:
+            if is_retryable(e):
+                breaker.record_failure()
+            else:
+                # Not the model's fault (a 400, or no request sent at all): leave the state as it is
+                breaker.release_probe()
+            delay = _next_delay(model, attempt, e, max_attempts)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            attempts.retries = attempt
+            continue
+        except BaseException:
+            # Cancelled mid-call: a half-open breaker must not wait forever for this probe
+            breaker.release_probe()
+            raise
+        breaker.record_success()
+        return response
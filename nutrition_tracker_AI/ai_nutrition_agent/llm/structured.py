@@ -0,0 +1,158 @@
+"""
+Structured Output - Request JSON-mode / schema-constrained responses where the endpoint supports them
+Capability is probed per model and downgraded json_schema → json_object → none on rejection
+"""
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from config.settings import LLM_STRUCTURED_OUTPUT
+
+if TYPE_CHECKING:
+    import openai
+
+
+MODES = ("json_schema", "json_object", "none")
+
+_lock = threading.Lock()
+_capabilities: Dict[str, str] = {}
+
+
+def get_structured_mode(model: str) -> str:
+    """
+    Structured-output mode to use for a model.
+    LLM_STRUCTURED_OUTPUT pins a mode; "auto" starts at json_schema until the model rejects it.
+    """
+    if LLM_STRUCTURED_OUTPUT in MODES:
+        return LLM_STRUCTURED_OUTPUT
+    with _lock:
+        return _capabilities.get(model, MODES[0])
+
+
+def set_structured_mode(model: str, mode: str) -> None:
+    with _lock:
+        _capabilities[model] = mode
+
+
+def reset_structured_modes() -> None:
+    """Forget probed capabilities (tests / after an endpoint upgrade)"""
+    with _lock:
+        _capabilities.clear()
+
+
+def _schema_for(schema: Type[BaseModel], many: bool) -> Dict[str, Any]:
+    """JSON schema for the response; arrays are wrapped as {"items": [...]} (object root required)"""
+    item_schema = schema.model_json_schema()
+    if not many:
+        return item_schema
+    defs = item_schema.pop("$defs", None)
+    wrapper: Dict[str, Any] = {
+        "type": "object",
+        "properties": {"items": {"type": "array", "items": item_schema}},
+        "required": ["items"]
+    }
+    if defs:
+        wrapper["$defs"] = defs
+    return wrapper
+
+
+def response_format_for(mode: str, schema: Type[BaseModel], many: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Build the response_format request parameter.
+
+    Returns:
+        response_format dict, or None when the mode cannot express this response
+    """
+    if mode == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": schema.__name__, "schema": _schema_for(schema, many)}
+        }
+    if mode == "json_object" and not many:
+        # JSON mode always yields an object, so array answers keep the prose path
+        return {"type": "json_object"}
+    return None
+
+
+def _mentions_json(messages: List[Dict[str, Any]]) -> bool:
+    for message in messages:
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"text": content}]
+        for part in parts:
+            if isinstance(part, dict) and "json" in str(part.get("text") or "").lower():
+                return True
+    return False
+
+
+def apply_structured_output(model: str, messages: List[Dict[str, Any]], params: Dict[str, Any],
+                            schema: Optional[Type[BaseModel]], many: bool = False
+                            ) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Add response_format to a request when the model supports it.
+
+    Returns:
+        (mode used, messages, request params)
+    """
+    if schema is None or "response_format" in params:
+        return "none", messages, params
+    mode = get_structured_mode(model)
+    response_format = response_format_for(mode, schema, many)
+    if response_format is None:
+        return "none", messages, params
+    if not _mentions_json(messages):
+        # JSON mode requires the word "JSON" somewhere in the prompt
+        messages = messages + [{"role": "system", "content": "Respond with JSON only."}]
+    return mode, messages, {**params, "response_format": response_format}
+
+
+def downgrade_on_error(model: str, mode: str, error: BaseException) -> bool:
+    """
+    Step the model down one mode if the endpoint rejected response_format.
+
+    Returns:
+        True if the call should be repeated with the lower mode; False for other errors, for the
+        lowest mode and when LLM_STRUCTURED_OUTPUT pins the mode (a retry would send the same request)
+    """
+    import openai
+
+    if LLM_STRUCTURED_OUTPUT in MODES or mode == MODES[-1] or not isinstance(error, openai.BadRequestError):
+        return False
+    message = str(error).lower()
+    if "response_format" not in message and "json" not in message:
+        return False
+    lower = MODES[MODES.index(mode) + 1]
+    set_structured_mode(model, lower)
+    print(f"⚠️  {model} rejected {mode} output, falling back to {lower}")
+    return True
+
+
+def probe_structured_output(model: str, client: Optional["openai.OpenAI"] = None) -> str:
+    """
+    Probe which structured-output mode a model accepts with a tiny request per mode.
+
+    Returns:
+        The best supported mode (also stored for later calls)
+    """
+    import openai
+    from llm.client import get_client
+
+    client = client or get_client()
+
+    class _Probe(BaseModel):
+        ok: bool
+
+    for mode in MODES[:-1]:
+        try:
+            client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": 'Reply with the JSON {"ok": true}.'}],
+                response_format=response_format_for(mode, _Probe),  # type: ignore
+                max_tokens=16
+            )
+        except openai.BadRequestError:
+            continue
+        set_structured_mode(model, mode)
+        return mode
+    set_structured_mode(model, "none")
+    return "none"
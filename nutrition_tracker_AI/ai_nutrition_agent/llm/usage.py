@@ -0,0 +1,238 @@
+"""
+Usage Accounting - Tokens, latency, retries and cost of every upstream model call
+Aggregated per request and per process
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from config.settings import LLM_PRICING, USAGE_MAX_TRACKED_REQUESTS
+from llm.context import get_request_id
+
+
+@dataclass
+class CallRecord:
+    """One upstream model call"""
+    tool: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms: float = 0.0
+    retries: int = 0
+    cached: bool = False
+    error: Optional[str] = None
+    request_id: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+    @property
+    def cost(self) -> float:
+        """Estimated cost from LLM_PRICING (per 1K tokens)"""
+        prompt_price, completion_price = LLM_PRICING.get(self.model, (0.0, 0.0))
+        return (self.prompt_tokens * prompt_price + self.completion_tokens * completion_price) / 1000
+
+
+def _empty_bucket() -> Dict[str, Any]:
+    return {
+        "calls": 0,
+        "cached": 0,
+        "errors": 0,
+        "retries": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "latency_ms_total": 0.0,
+        "latency_ms_max": 0.0,
+        "cost": 0.0
+    }
+
+
+def _add(bucket: Dict[str, Any], record: CallRecord) -> None:
+    bucket["calls"] += 1
+    bucket["cached"] += int(record.cached)
+    bucket["errors"] += int(record.error is not None)
+    bucket["retries"] += record.retries
+    bucket["prompt_tokens"] += record.prompt_tokens
+    bucket["completion_tokens"] += record.completion_tokens
+    bucket["total_tokens"] += record.prompt_tokens + record.completion_tokens
+    bucket["latency_ms_total"] += record.latency_ms
+    bucket["latency_ms_max"] = max(bucket["latency_ms_max"], record.latency_ms)
+    bucket["cost"] += record.cost
+
+
+def _finalize(bucket: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a bucket with average latency and rounded figures"""
+    result = dict(bucket)
+    result["latency_ms_avg"] = round(result["latency_ms_total"] / result["calls"], 2) if result["calls"] else 0.0
+    result["latency_ms_total"] = round(result["latency_ms_total"], 2)
+    result["latency_ms_max"] = round(result["latency_ms_max"], 2)
+    result["cost"] = round(result["cost"], 6)
+    return result
+
+
+def _finalize_group(buckets: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Finalize buckets, most token-hungry first"""
+    finished = {name: _finalize(bucket) for name, bucket in buckets.items()}
+    return dict(sorted(finished.items(), key=lambda item: item[1]["total_tokens"], reverse=True))
+
+
+def summarize(records: List[CallRecord]) -> Dict[str, Any]:
+    """
+    Aggregate call records.
+
+    Returns:
+        {"total": {...}, "by_tool": {...}, "by_model": {...}}, buckets sorted by total tokens
+    """
+    total = _empty_bucket()
+    by_tool: Dict[str, Dict[str, Any]] = {}
+    by_model: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        _add(total, record)
+        _add(by_tool.setdefault(record.tool, _empty_bucket()), record)
+        _add(by_model.setdefault(record.model, _empty_bucket()), record)
+
+    return {
+        "total": _finalize(total),
+        "by_tool": _finalize_group(by_tool),
+        "by_model": _finalize_group(by_model)
+    }
+
+
+class UsageTracker:
+    """Thread-safe store of call records (recent requests kept in full)"""
+
+    def __init__(self, max_requests: int = USAGE_MAX_TRACKED_REQUESTS):
+        self.max_requests = max_requests
+        self._lock = threading.Lock()
+        self._requests: "OrderedDict[str, List[CallRecord]]" = OrderedDict()
+        self._process_total = _empty_bucket()
+        self._process_by_tool: Dict[str, Dict[str, Any]] = {}
+        self._process_by_model: Dict[str, Dict[str, Any]] = {}
+        self._listeners: List[Any] = []
+
+    def add_listener(self, callback) -> None:
+        """Register callback(record) invoked for every recorded call"""
+        self._listeners.append(callback)
+
+    def record(self, record: CallRecord) -> None:
+        """Record a call; attributed to the current request if one is active"""
+        if record.request_id is None:
+            record.request_id = get_request_id()
+        with self._lock:
+            _add(self._process_total, record)
+            _add(self._process_by_tool.setdefault(record.tool, _empty_bucket()), record)
+            _add(self._process_by_model.setdefault(record.model, _empty_bucket()), record)
+            if record.request_id:
+                self._requests.setdefault(record.request_id, []).append(record)
+                self._requests.move_to_end(record.request_id)
+                while len(self._requests) > self.max_requests:
+                    self._requests.popitem(last=False)
+        for callback in self._listeners:
+            callback(record)
+
+    def request_records(self, request_id: str) -> List[CallRecord]:
+        with self._lock:
+            return list(self._requests.get(request_id, []))
+
+    def request_summary(self, request_id: str) -> Dict[str, Any]:
+        """Usage of one request, with each call listed in order"""
+        records = self.request_records(request_id)
+        summary = summarize(records)
+        summary["request_id"] = request_id
+        summary["calls"] = [dict(asdict(r), cost=round(r.cost, 6)) for r in records]
+        return summary
+
+    def process_summary(self) -> Dict[str, Any]:
+        """Usage of the whole process since start"""
+        with self._lock:
+            return {
+                "total": _finalize(self._process_total),
+                "by_tool": _finalize_group(self._process_by_tool),
+                "by_model": _finalize_group(self._process_by_model)
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._requests.clear()
+            self._process_total = _empty_bucket()
+            self._process_by_tool.clear()
+            self._process_by_model.clear()
+
+
+_tracker = UsageTracker()
+
+
+def get_usage_tracker() -> UsageTracker:
+    """Get the process-wide usage tracker"""
+    return _tracker
+
+
+def record_response(tool_name: str, model: str, response: Any, started_at: float,
+                    retries: int = 0) -> None:
+    """Record a successful call from the response's usage block"""
+    usage = getattr(response, "usage", None)
+    _tracker.record(CallRecord(
+        tool=tool_name,
+        model=model,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        latency_ms=(time.perf_counter() - started_at) * 1000,
+        retries=retries
+    ))
+
+
+def record_cache_hit(tool_name: str, model: str, started_at: float) -> None:
+    """Record a call answered from the response cache (no tokens spent)"""
+    _tracker.record(CallRecord(
+        tool=tool_name,
+        model=model,
+        latency_ms=(time.perf_counter() - started_at) * 1000,
+        cached=True
+    ))
+
+
+def record_error(tool_name: str, model: str, error: BaseException, started_at: float,
+                 retries: int = 0) -> None:
+    """Record a failed call"""
+    _tracker.record(CallRecord(
+        tool=tool_name,
+        model=model,
+        latency_ms=(time.perf_counter() - started_at) * 1000,
+        retries=retries,
+        error=f"{type(error).__name__}: {error}"
+    ))
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """Records the agent's orchestration LLM calls (made through LangChain, not llm.calls)"""
+
+    def __init__(self, tool_name: str = "agent_orchestration"):
+        self.tool_name = tool_name
+        self._started: Dict[Any, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        started_at = self._started.pop(run_id, time.perf_counter())
+        llm_output = response.llm_output or {}
+        token_usage = llm_output.get("token_usage") or {}
+        _tracker.record(CallRecord(
+            tool=self.tool_name,
+            model=llm_output.get("model_name", "unknown"),
+            prompt_tokens=token_usage.get("prompt_tokens", 0) or 0,
+            completion_tokens=token_usage.get("completion_tokens", 0) or 0,
+            latency_ms=(time.perf_counter() - started_at) * 1000
+        ))
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        started_at = self._started.pop(run_id, time.perf_counter())
+        _tracker.record(CallRecord(
+            tool=self.tool_name,
+            model="unknown",
+            latency_ms=(time.perf_counter() - started_at) * 1000,
+            error=f"{type(error).__name__}: {error}"
+        ))
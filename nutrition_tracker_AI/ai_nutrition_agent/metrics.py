@@ -0,0 +1,154 @@
+"""
+Metrics - Process-wide counters and latency histograms in the Prometheus text format
+Pipeline steps, database saves and whole analyses are timed where they run; upstream model
+calls are counted from the usage tracker. Values that already live elsewhere (cache hits,
+job queue depth, in-flight analyses) are read when the metrics are rendered.
+"""
+import math
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from llm.usage import CallRecord, get_usage_tracker
+
+
+# Upper bounds (seconds); model calls take seconds, database writes milliseconds
+STEP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+SAVE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, one value per label set"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def total(self) -> float:
+        """Sum over all label sets"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_labels(key)} {_number(value)}" for key, value in sorted(self._values.items())]
+        return lines
+
+
+class Histogram:
+    """Latency histogram (cumulative buckets, sum and count), one series per label set"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = STEP_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._lock = threading.Lock()
+        self._series: Dict[Labels, List[float]] = {}  # per-bucket counts, then sum, then count
+
+    def observe(self, seconds: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            series = self._series.get(tuple(sorted(labels.items())))
+            return series[-1] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(key, ('le', _number(bound)))} {count}")
+                lines.append(f"{self.name}_sum{_labels(key)} {_number(round(series[-2], 6))}")
+                lines.append(f"{self.name}_count{_labels(key)} {series[-1]}")
+        return lines
+
+
+def render_samples(name: str, help_text: str, samples: Iterable[Tuple[Dict[str, str], float]],
+                   kind: str = "gauge") -> List[str]:
+    """Lines of a metric whose values are read at render time: samples of (labels, value)"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{_labels(tuple(sorted(labels.items())))} {_number(value)}" for labels, value in samples]
+    return lines
+
+
+class Metrics:
+    """The analysis metrics of this process"""
+
+    def __init__(self):
+        self.step_seconds = Histogram("nutrition_pipeline_step_duration_seconds",
+                                      "Duration of each pipeline step (vision, portion, nutrition, compute, "
+                                      "scoring, recommendation, save)")
+        self.step_resumed = Counter("nutrition_pipeline_step_resumed_total",
+                                    "Pipeline steps restored from a checkpoint instead of run")
+        self.analysis_seconds = Histogram("nutrition_analysis_duration_seconds",
+                                          "End-to-end duration of one meal image analysis")
+        self.save_seconds = Histogram("nutrition_db_save_duration_seconds",
+                                      "Meal database write latency (lock wait, load and save)", SAVE_BUCKETS)
+        self.model_calls = Counter("nutrition_llm_calls_total", "Upstream model calls (cache hits included)")
+        self.model_errors = Counter("nutrition_llm_errors_total", "Upstream model calls that failed")
+        self.model_cached = Counter("nutrition_llm_cached_calls_total", "Model calls answered from the response cache")
+        self.model_seconds = Histogram("nutrition_llm_call_duration_seconds", "Upstream model call latency")
+
+    def record_call(self, record: CallRecord) -> None:
+        """Usage tracker listener: count one model call"""
+        self.model_calls.inc(model=record.model, tool=record.tool)
+        if record.error is not None:
+            self.model_errors.inc(model=record.model, tool=record.tool)
+        if record.cached:
+            self.model_cached.inc(model=record.model, tool=record.tool)
+        else:
+            self.model_seconds.observe(record.latency_ms / 1000, model=record.model)
+
+    def render(self) -> List[str]:
+        lines: List[str] = []
+        for metric in (self.step_seconds, self.step_resumed, self.analysis_seconds, self.save_seconds,
+                       self.model_calls, self.model_errors, self.model_cached, self.model_seconds):
+            lines += metric.render()
+        return lines
+
+
+_metrics = Metrics()
+get_usage_tracker().add_listener(_metrics.record_call)
+
+
+def get_metrics() -> Metrics:
+    """Get the process-wide metrics"""
+    return _metrics
@@ -0,0 +1,443 @@
+"""
+Meal Analysis Pipeline - Runs the fixed analysis sequence directly in code
+detect → refine portions → add nutrition → compute, then the post-compute step graph:
+score / history → trend / recommend (concurrently) → join → save
+No orchestration LLM calls: each tool's output is handed straight to the steps that need it.
+Completed steps are checkpointed, so a retried request (same request ID) resumes where it
+failed and a re-submitted image skips recognition and nutrition lookup.
+With an on_event listener, every finished step is reported as soon as it is done (dishes are
+announced one by one while Qwen-VL is still generating).
+"""
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from checkpoint import (
+    CheckpointStore, get_checkpoint_store, image_scope_key, is_failed_result, request_scope_key, step_key
+)
+from llm.context import get_request_id
+from metrics import get_metrics
+from tools.vision_tools import detect_dishes_and_portions, detect_dishes_progressively, adetect_dishes_progressively
+from tools.portion_tools import check_and_refine_portions
+from tools.nutrition_tools import add_nutrition_to_dishes
+from tools.compute_tools import compute_meal_nutrition
+from tools.db_tools import load_recent_meals, save_meal_record
+from tools.images import image_exists
+from tools.recommendation_tools import (
+    score_current_meal_llm,
+    score_weekly_adjusted,
+    recommend_next_meal
+)
+
+
+def build_meal_record(compute_result: Dict[str, Any], meal_type: str, score: Dict[str, Any],
+                      trend: Dict[str, Any], recommendation: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Assemble the meal record saved to the database.
+
+    Args:
+        compute_result: Output of compute_meal_nutrition (parsed)
+        meal_type: Meal type
+        score / trend / recommendation: Outputs of the scoring and recommendation tools
+
+    Returns:
+        Meal record in the format expected by save_meal
+    """
+    return {
+        "meal_type": meal_type,
+        "image_path": compute_result.get("image_path", ""),
+        "dishes": compute_result.get("dishes", []),
+        "meal_nutrition_total": compute_result.get("meal_nutrition_total", {}),
+        "scores": {
+            "current_meal_score": score.get("score"),
+            "week_adjusted_score": trend.get("score")
+        },
+        "advice": {
+            "current_meal_advice": score.get("advice", ""),
+            "week_adjusted_advice": trend.get("advice", "")
+        },
+        "next_meal_recommendation": {k: v for k, v in recommendation.items() if k != "error"}
+    }
+
+
+def _parsed(result: Any) -> Dict[str, Any]:
+    return json.loads(result) if isinstance(result, str) else result
+
+
+def _dish_view(dish: Dict[str, Any], *keys: str) -> Dict[str, Any]:
+    return {"dish_id": dish.get("dish_id"), "name": dish.get("name"), **{key: dish.get(key) for key in keys}}
+
+
+def _dishes_event(*keys: str) -> Callable[[Any], Dict[str, Any]]:
+    return lambda result: {"dishes": [_dish_view(dish, *keys) for dish in _parsed(result).get("dishes", [])]}
+
+
+# Step name -> (event name, event data built from the step's result)
+STEP_EVENTS: Dict[str, Tuple[str, Callable[[Any], Dict[str, Any]]]] = {
+    "detect_dishes_and_portions": ("dishes_detected", _dishes_event("estimated_weight_g", "portion_level")),
+    "check_and_refine_portions": ("portions_refined", _dishes_event("final_weight_g")),
+    "add_nutrition_to_dishes": ("nutrition", _dishes_event("final_weight_g", "nutrition_per_100g")),
+    "compute_meal_nutrition": ("totals", lambda result: {
+        "dishes": [_dish_view(dish, "nutrition_total") for dish in _parsed(result).get("dishes", [])],
+        "meal_nutrition_total": _parsed(result).get("meal_nutrition_total", {})
+    }),
+    "score_current_meal_llm": ("meal_score", lambda result: {"score": result.get("score"),
+                                                             "advice": result.get("advice", "")}),
+    "score_weekly_adjusted": ("week_score", lambda result: {"score": result.get("score"),
+                                                            "advice": result.get("advice", "")}),
+    "recommend_next_meal": ("recommendation", lambda result: {k: v for k, v in result.items() if k != "error"}),
+    "save_meal": ("saved", lambda result: {"meal_id": result.get("meal_id"), "meal": result}),
+}
+
+
+def describe_event(event: Dict[str, Any]) -> str:
+    """One-line progress message for a pipeline event (CLI / GUI output)"""
+    name, data = event["event"], event["data"]
+    if name == "dish_detected":
+        return f"🍽️  Detected: {data['name']} (~{data.get('estimated_weight_g')}g)"
+    if name == "dishes_detected":
+        return f"📸 Dishes: {', '.join(dish['name'] for dish in data['dishes'])}"
+    if name == "portions_refined":
+        return "⚖️  Portions: " + ", ".join(f"{dish['name']} {dish['final_weight_g']}g" for dish in data["dishes"])
+    if name == "nutrition":
+        return "🥗 Nutrition per 100g: " + ", ".join(
+            f"{dish['name']} {(dish.get('nutrition_per_100g') or {}).get('calories', 0):.0f} kcal" for dish in data["dishes"]
+        )
+    if name == "totals":
+        total = data["meal_nutrition_total"]
+        return (f"🔥 Total: {total.get('calories', 0)} kcal, protein {total.get('protein', 0)}g, "
+                f"fat {total.get('fat', 0)}g, carbs {total.get('carbs', 0)}g")
+    if name == "meal_score":
+        return f"⭐ Meal score: {data['score']} - {data['advice']}"
+    if name == "week_score":
+        return f"📈 Weekly-adjusted score: {data['score']} - {data['advice']}"
+    if name == "recommendation":
+        return "💡 Next meal: " + " / ".join(option.get("title", "") for option in data.get("options", []))
+    if name == "saved":
+        return f"💾 Saved as {data['meal_id']}"
+    return f"{name}: {data}"
+
+
+@dataclass(frozen=True)
+class PipelineStep:
+    """
+    One node of the post-compute step graph.
+
+    run / arun receive the shared context: image_path, meal_type, compute_result, nutrition
+    and the output of every finished step (keyed by step name). A step starts as soon as all
+    of its `requires` have finished; steps without an async version run in a worker thread.
+    """
+    name: str
+    run: Callable[[Dict[str, Any]], Any]
+    arun: Optional[Callable[[Dict[str, Any]], Awaitable[Any]]] = None
+    requires: Tuple[str, ...] = ()
+
+
+def _save(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    meal = build_meal_record(ctx["compute_result"], ctx["meal_type"], ctx["score_current_meal_llm"],
+                             ctx["score_weekly_adjusted"], ctx["recommend_next_meal"])
+    return save_meal_record(meal)
+
+
+def _trend_input(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    return {"current_meal": ctx["nutrition"], "weekly_trend": ctx["load_recent_meals"].get("weekly_trend", {})}
+
+
+def _recommend_input(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    return {"current_nutrition": ctx["nutrition"], "recent_history": ctx["load_recent_meals"]}
+
+
+# The saved record holds the scores and recommendation, so save_meal is the join node
+DEFAULT_POST_COMPUTE_STEPS: Tuple[PipelineStep, ...] = (
+    PipelineStep("score_current_meal_llm",
+                 lambda ctx: score_current_meal_llm.invoke({"nutrition": ctx["nutrition"]}),
+                 lambda ctx: score_current_meal_llm.ainvoke({"nutrition": ctx["nutrition"]})),
+    PipelineStep("load_recent_meals",
+                 lambda ctx: load_recent_meals.invoke({}),
+                 lambda ctx: load_recent_meals.ainvoke({})),
+    PipelineStep("score_weekly_adjusted",
+                 lambda ctx: score_weekly_adjusted.invoke(_trend_input(ctx)),
+                 lambda ctx: score_weekly_adjusted.ainvoke(_trend_input(ctx)),
+                 requires=("load_recent_meals",)),
+    PipelineStep("recommend_next_meal",
+                 lambda ctx: recommend_next_meal.invoke(_recommend_input(ctx)),
+                 lambda ctx: recommend_next_meal.ainvoke(_recommend_input(ctx)),
+                 requires=("load_recent_meals",)),
+    PipelineStep("save_meal", _save,
+                 requires=("score_current_meal_llm", "score_weekly_adjusted", "recommend_next_meal")),
+)
+
+
+def _check_graph(steps: Sequence[PipelineStep]) -> None:
+    """Reject duplicate names, unknown dependencies and cycles"""
+    names = [step.name for step in steps]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate pipeline step names: {names}")
+    done: set = set()
+    pending = list(steps)
+    while pending:
+        ready = [step for step in pending if set(step.requires) <= done]
+        if not ready:
+            raise ValueError(f"Unknown or cyclic step dependencies: {[step.name for step in pending]}")
+        done.update(step.name for step in ready)
+        pending = [step for step in pending if step.name not in done]
+
+
+class MealPipeline:
+    """Deterministic meal analysis (the tool order AGENT_SYSTEM_PROMPT describes, executed in code)"""
+
+    # Steps that depend only on the image bytes (reusable when the same image is re-submitted)
+    IMAGE_STEPS = ("detect_dishes_and_portions", "check_and_refine_portions",
+                   "add_nutrition_to_dishes", "compute_meal_nutrition")
+
+    def __init__(self, post_compute_steps: Sequence[PipelineStep] = DEFAULT_POST_COMPUTE_STEPS,
+                 result_step: str = "save_meal", checkpoints: Optional[CheckpointStore] = None,
+                 on_event: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Args:
+            post_compute_steps: Step graph run after compute_meal_nutrition (add, replace or drop steps)
+            result_step: Step whose output is returned as the meal
+            checkpoints: Step result store (the process-wide SQLite store by default)
+            on_event: Called with {"event", "step", "elapsed_ms", "data"} as each step finishes
+                      (from worker threads too; see STEP_EVENTS)
+        """
+        _check_graph(post_compute_steps)
+        self.post_compute_steps = tuple(post_compute_steps)
+        self.result_step = result_step
+        self.checkpoints = checkpoints if checkpoints is not None else get_checkpoint_store()
+        self.on_event = on_event
+        self.steps: List[Dict[str, Any]] = []
+        self._started_at = 0.0
+        self._scopes: Dict[str, Optional[str]] = {}
+
+    def _record(self, name: str, started_at: float) -> None:
+        """Record a step's duration and start offset (concurrent steps overlap)"""
+        duration = time.perf_counter() - started_at
+        self.steps.append({
+            "step": name,
+            "started_ms": round((started_at - self._started_at) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2)
+        })
+        get_metrics().step_seconds.observe(duration, step=name)
+
+    def _timed(self, name: str, fn: Callable[[], Any]) -> Any:
+        """Run one step and record its duration"""
+        started_at = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            self._record(name, started_at)
+
+    async def _atimed(self, name: str, fn: Callable[[], Any]) -> Any:
+        """Async version of _timed (fn returns an awaitable)"""
+        started_at = time.perf_counter()
+        try:
+            return await fn()
+        finally:
+            self._record(name, started_at)
+
+    def _start(self, image_path: str) -> None:
+        self.steps = []
+        self._started_at = time.perf_counter()
+        request_id = get_request_id()
+        self._scopes = {
+            "request": request_scope_key(request_id) if request_id else None,
+            "image": image_scope_key(image_path) if image_exists(image_path) else None
+        }
+
+    def _step_scopes(self, name: str) -> List[str]:
+        scopes = [self._scopes.get("request")]
+        if name in self.IMAGE_STEPS:
+            scopes.append(self._scopes.get("image"))
+        return [scope for scope in scopes if scope]
+
+    def _restore(self, name: str, upstream: Any = None) -> Optional[Any]:
+        """Checkpointed result of a step (this request first, then the same image), or None"""
+        key = step_key(name, upstream)
+        for scope in self._step_scopes(name):
+            result = self.checkpoints.get(scope, key)
+            if result is not None:
+                self.steps.append({"step": name, "started_ms": round((time.perf_counter() - self._started_at) * 1000, 2),
+                                   "duration_ms": 0.0, "resumed": True})
+                get_metrics().step_resumed.inc(step=name)
+                return result
+        return None
+
+    def _checkpoint(self, name: str, result: Any, upstream: Any = None) -> Any:
+        if not is_failed_result(result):
+            key = step_key(name, upstream)
+            for scope in self._step_scopes(name):
+                self.checkpoints.put(scope, key, result)
+        return result
+
+    def _emit(self, event: str, step: str, data: Dict[str, Any]) -> None:
+        if self.on_event is not None:
+            self.on_event({"event": event, "step": step,
+                           "elapsed_ms": round((time.perf_counter() - self._started_at) * 1000, 2), "data": data})
+
+    def _finished(self, name: str, result: Any) -> Any:
+        """Report a finished step to the listener"""
+        if self.on_event is not None and name in STEP_EVENTS:
+            event, build = STEP_EVENTS[name]
+            self._emit(event, name, build(result))
+        return result
+
+    def _step(self, name: str, fn: Callable[[], Any], upstream: Any = None) -> Any:
+        """
+        Run a step unless it already completed (checkpointed), recording its duration.
+        `upstream` is the step's input: a checkpoint only restores when that input is unchanged.
+        """
+        restored = self._restore(name, upstream)
+        if restored is not None:
+            return self._finished(name, restored)
+        return self._finished(name, self._checkpoint(name, self._timed(name, fn), upstream))
+
+    async def _astep(self, name: str, fn: Callable[[], Any], upstream: Any = None) -> Any:
+        """Async version of _step"""
+        restored = self._restore(name, upstream)
+        if restored is not None:
+            return self._finished(name, restored)
+        return self._finished(name, self._checkpoint(name, await self._atimed(name, fn), upstream))
+
+    def _on_dish(self, dish: Dict[str, Any]) -> None:
+        self._emit("dish_detected", "detect_dishes_and_portions", _dish_view(dish, "estimated_weight_g", "portion_level"))
+
+    def _detect(self, image_path: str) -> str:
+        """Vision step; with a listener, dishes are reported while the model is still generating"""
+        if self.on_event is None:
+            return detect_dishes_and_portions.invoke({"image_path": image_path})
+        return detect_dishes_progressively(image_path, self._on_dish)
+
+    async def _adetect(self, image_path: str) -> str:
+        """Async version of _detect"""
+        if self.on_event is None:
+            return await detect_dishes_and_portions.ainvoke({"image_path": image_path})
+        return await adetect_dishes_progressively(image_path, self._on_dish)
+
+    def _context(self, image_path: str, meal_type: str, compute_json: str) -> Dict[str, Any]:
+        compute_result = json.loads(compute_json)
+        if compute_result.get("error"):
+            raise ValueError(compute_result["error"])
+        compute_result["image_path"] = image_path  # a result reused by image content may name an older upload
+        return {
+            "image_path": image_path,
+            "meal_type": meal_type,
+            "compute_result": compute_result,
+            "nutrition": compute_result["meal_nutrition_total"]
+        }
+
+    def _result(self, ctx: Dict[str, Any]) -> Dict[str, Any]:
+        meal = ctx.get(self.result_step)
+        return {
+            "mode": "pipeline",
+            "meal": meal,
+            "meal_id": meal.get("meal_id") if isinstance(meal, dict) else None,
+            "steps": self.steps,
+            "total_ms": round((time.perf_counter() - self._started_at) * 1000, 2)
+        }
+
+    def _graph_upstream(self, step: PipelineStep, ctx: Dict[str, Any]) -> Any:
+        """
+        Checkpoint input of a post-compute step: the computed meal, except for the result step,
+        which stays keyed on the request alone so a retried request never saves twice
+        """
+        return None if step.name == self.result_step else ctx.get("compute_result")
+
+    def _run_graph(self, ctx: Dict[str, Any]) -> None:
+        """Run the post-compute steps on a thread pool, each as soon as its dependencies are done"""
+        pending = list(self.post_compute_steps)
+        running: Dict[Future, PipelineStep] = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(pending)), thread_name_prefix="pipeline") as pool:
+            while pending or running:
+                for step in [s for s in pending if all(r in ctx for r in s.requires)]:
+                    pending.remove(step)
+                    # Each thread gets a copy of the request context (request ID, deadline, lane)
+                    step_ctx = contextvars.copy_context()
+                    running[pool.submit(step_ctx.run, self._step, step.name,
+                                        lambda step=step: step.run(ctx), self._graph_upstream(step, ctx))] = step
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        for other in running:
+                            other.cancel()
+                        raise error
+                    ctx[step.name] = future.result()
+
+    async def _arun_graph(self, ctx: Dict[str, Any]) -> None:
+        """Async version of _run_graph - one task per step, awaiting its dependencies"""
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_step(step: PipelineStep) -> None:
+            await asyncio.gather(*(tasks[name] for name in step.requires))
+            upstream = self._graph_upstream(step, ctx)
+            if step.arun is not None:
+                ctx[step.name] = await self._astep(step.name, lambda: step.arun(ctx), upstream)
+            else:
+                ctx[step.name] = await self._astep(
+                    step.name, lambda: asyncio.to_thread(step.run, ctx), upstream
+                )
+
+        # All tasks exist before any of them runs, so dependencies can be looked up by name
+        for step in self.post_compute_steps:
+            tasks[step.name] = asyncio.ensure_future(run_step(step))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+
+    def run(self, image_path: str, meal_type: str = "Lunch") -> Dict[str, Any]:
+        """
+        Analyze a meal image and save the result.
+
+        Args:
+            image_path: Image file path
+            meal_type: Meal type (Breakfast/Lunch/Dinner/Snack)
+
+        Returns:
+            {"mode": "pipeline", "meal": saved meal record, "meal_id", "steps": [{"step", "started_ms", "duration_ms"}, ...],
+             "total_ms": end-to-end duration}
+        """
+        self._start(image_path)
+        vision_result = self._step("detect_dishes_and_portions", lambda: self._detect(image_path))
+        portion_result = self._step("check_and_refine_portions",
+                                    lambda: check_and_refine_portions.invoke({"vision_result": vision_result}),
+                                    vision_result)
+        nutrition_result = self._step("add_nutrition_to_dishes",
+                                      lambda: add_nutrition_to_dishes.invoke({"portion_result": portion_result}),
+                                      portion_result)
+        compute_json = self._step("compute_meal_nutrition",
+                                  lambda: compute_meal_nutrition.invoke({"portion_result": nutrition_result}),
+                                  nutrition_result)
+        ctx = self._context(image_path, meal_type, compute_json)
+        self._run_graph(ctx)
+        return self._result(ctx)
+
+    async def arun(self, image_path: str, meal_type: str = "Lunch") -> Dict[str, Any]:
+        """Async version of run - tools run on their native async implementations"""
+        self._start(image_path)
+        vision_result = await self._astep("detect_dishes_and_portions", lambda: self._adetect(image_path))
+        portion_result = await self._astep("check_and_refine_portions",
+                                           lambda: check_and_refine_portions.ainvoke({"vision_result": vision_result}),
+                                           vision_result)
+        nutrition_result = await self._astep("add_nutrition_to_dishes",
+                                             lambda: add_nutrition_to_dishes.ainvoke({"portion_result": portion_result}),
+                                             portion_result)
+        compute_json = await self._astep("compute_meal_nutrition",
+                                         lambda: compute_meal_nutrition.ainvoke({"portion_result": nutrition_result}),
+                                         nutrition_result)
+        ctx = self._context(image_path, meal_type, compute_json)
+        await self._arun_graph(ctx)
+        return self._result(ctx)
@@ -75,6 +75,19 @@ class RecommendationInput(BaseModel):
     recent_history: Dict[str, Any] = Field(..., description="Recent history data")
 
 
+class RecommendationOption(BaseModel):
+    """One recommended next-meal option"""
+    title: str = Field(..., description="Option title")
+    recommended_dishes: List[str] = Field(..., description="Recommended dishes")
+    reason: str = Field(..., description="Recommendation reason")
+
+
+class RecommendationOutput(BaseModel):
+    """Next meal recommendation output"""
+    options: List[RecommendationOption] = Field(..., description="Recommended options")
+    overall_reason: str = Field(..., description="Overall reason")
+
+
 class SaveMealInput(BaseModel):
     """Save meal tool input"""
     meal: Dict[str, Any] = Field(..., description="Complete meal data")
@@ -1,27 +1,30 @@
 """
 工具包初始化文件
+工具在首次访问时才导入（导入tools.db_tools等子模块不会加载全部工具及其依赖）
 """
-from .vision_tools import detect_dishes_and_portions
-from .portion_tools import check_and_refine_portions
-from .nutrition_tools import query_nutrition_per_100g
-from .compute_tools import compute_meal_nutrition, score_current_meal
-from .db_tools import load_recent_meals, save_meal, get_daily_summary
-from .recommendation_tools import (
-    score_current_meal_llm,
-    score_weekly_adjusted,
-    recommend_next_meal
-)
+import importlib
 
-__all__ = [
-    "detect_dishes_and_portions",
-    "check_and_refine_portions",
-    "query_nutrition_per_100g",
-    "compute_meal_nutrition",
-    "score_current_meal",
-    "load_recent_meals",
-    "save_meal",
-    "get_daily_summary",
-    "score_current_meal_llm",
-    "score_weekly_adjusted",
-    "recommend_next_meal",
-]
+# 导出名 -> 所在子模块
+_EXPORTS = {
+    "detect_dishes_and_portions": "vision_tools",
+    "check_and_refine_portions": "portion_tools",
+    "query_nutrition_per_100g": "nutrition_tools",
+    "compute_meal_nutrition": "compute_tools",
+    "score_current_meal": "compute_tools",
+    "load_recent_meals": "db_tools",
+    "save_meal": "db_tools",
+    "get_daily_summary": "db_tools",
+    "score_current_meal_llm": "recommendation_tools",
+    "score_weekly_adjusted": "recommendation_tools",
+    "recommend_next_meal": "recommendation_tools",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,155 @@
+"""
+Artifact Store - Per-request tool results addressed by short artifact:// handles
+In agent mode a tool stores its full JSON result here and returns only the handle (plus a
+small summary), so the agent LLM never has to copy dish lists back into the next tool call.
+"""
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from config.settings import ARTIFACT_MAX_REQUESTS
+from llm.context import get_request_id, request_scope
+
+
+SCHEME = "artifact://"
+
+_enabled: ContextVar[bool] = ContextVar("artifact_handles", default=False)
+
+
+class ArtifactStore:
+    """In-memory results grouped by request ID; least recently used requests are evicted"""
+
+    def __init__(self, max_requests: int = ARTIFACT_MAX_REQUESTS):
+        self.max_requests = max_requests
+        self._lock = threading.Lock()
+        self._requests: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+
+    def put(self, request_id: str, kind: str, content: str) -> str:
+        """Store a JSON string and return its handle"""
+        with self._lock:
+            artifacts = self._requests.setdefault(request_id, {})
+            artifacts[kind] = content
+            self._requests.move_to_end(request_id)
+            while len(self._requests) > self.max_requests:
+                self._requests.popitem(last=False)
+        return f"{SCHEME}{request_id}/{kind}"
+
+    def get(self, handle: str) -> str:
+        """
+        Look up a handle.
+
+        Raises:
+            KeyError: Unknown or evicted handle
+        """
+        request_id, _, kind = handle[len(SCHEME):].partition("/")
+        with self._lock:
+            try:
+                return self._requests[request_id][kind]
+            except KeyError:
+                raise KeyError(f"Unknown or expired artifact: {handle}") from None
+
+    def release(self, request_id: str) -> None:
+        """Drop every artifact of a finished request"""
+        with self._lock:
+            self._requests.pop(request_id, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._requests)
+
+
+_store = ArtifactStore()
+
+
+def get_artifact_store() -> ArtifactStore:
+    return _store
+
+
+@contextmanager
+def artifact_handles(request_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Make tools inside the block return handles; the request's artifacts are dropped on exit.
+
+    Yields:
+        The request ID the handles belong to
+    """
+    with request_scope(request_id or get_request_id()) as scoped_id:
+        token = _enabled.set(True)
+        try:
+            yield scoped_id
+        finally:
+            _enabled.reset(token)
+            _store.release(scoped_id)
+
+
+def publish_artifact(kind: str, content: str) -> str:
+    """
+    Return a tool result the way the caller wants it.
+
+    Outside artifact_handles() (pipeline, tests) the JSON string is returned unchanged. Inside it,
+    the result is stored and replaced by {"artifact": handle, "dish_count": n, ...}; error results
+    are passed through so the agent can see what went wrong.
+    """
+    request_id = get_request_id()
+    if not _enabled.get() or request_id is None:
+        return content
+    data = json.loads(content)
+    if not isinstance(data, dict) or data.get("error"):
+        return content
+    summary: Dict[str, Any] = {"artifact": _store.put(request_id, kind, content)}
+    if "dishes" in data:
+        summary["dish_count"] = len(data["dishes"])
+    if "meal_nutrition_total" in data:
+        summary["meal_nutrition_total"] = data["meal_nutrition_total"]
+    return json.dumps(summary, ensure_ascii=False)
+
+
+def is_artifact_handle(value: Any) -> bool:
+    """Whether a value is a bare artifact:// handle string"""
+    return isinstance(value, str) and value.strip().startswith(SCHEME)
+
+
+def _handle_of(value: Any) -> Optional[str]:
+    """The handle a tool argument refers to (bare handle or a copied summary object), if any"""
+    if isinstance(value, dict):
+        value = value.get("artifact")
+    if not isinstance(value, str):
+        return None
+    if is_artifact_handle(value):
+        return value.strip()
+    value = value.strip()
+    if value.startswith("{") and SCHEME in value:
+        try:
+            return _handle_of(json.loads(value))
+        except json.JSONDecodeError:
+            return None
+    return None
+
+
+def resolve_artifact(value: Any) -> Any:
+    """
+    Turn a tool argument back into the full JSON string if it refers to an artifact.
+    Anything else (plain JSON, dicts) is returned unchanged.
+    """
+    handle = _handle_of(value)
+    return _store.get(handle) if handle else value
+
+
+def expand_artifacts(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Merge artifacts referenced by a record's fields into the record.
+    e.g. {"compute_result": "artifact://req_1/compute", "scores": {...}} → {"dishes": [...], ..., "scores": {...}}
+    Fields set explicitly on the record win over the artifact's.
+    """
+    merged: Dict[str, Any] = {}
+    rest: Dict[str, Any] = {}
+    for key, value in data.items():
+        handle = _handle_of(value)
+        if handle:
+            merged.update(json.loads(_store.get(handle)))
+        else:
+            rest[key] = value
+    return {**merged, **rest}
@@ -2,9 +2,11 @@
 ComputeTool - Calculate total meal nutrition
 """
 import json
-from langchain.tools import tool
+from langchain_core.tools import tool
 from typing import List, Dict, Any
 
+from tools.artifacts import publish_artifact, resolve_artifact
+
 
 @tool
 def compute_meal_nutrition(portion_result: str) -> str:
@@ -12,14 +14,16 @@ def compute_meal_nutrition(portion_result: str) -> str:
     Calculate total nutrition for the meal.
     
     Args:
-        portion_result: Portion verification result JSON string, containing {"dishes": [...], "image_path": "..."}
+        portion_result: Portion verification result JSON string, containing {"dishes": [...], "image_path": "..."},
+                        or its artifact:// handle
     
     Returns:
         JSON string format: {"dishes": [...], "meal_nutrition_total": {...}, "image_path": "..."}
+        (in agent mode an artifact:// handle to it, with meal_nutrition_total alongside)
     """
     # Parse JSON string
     try:
-        portion_data = json.loads(portion_result)
+        portion_data = json.loads(resolve_artifact(portion_result))
     except json.JSONDecodeError as e:
         print(f"⚠️  Unable to parse portion_result: {str(e)}")
         return json.dumps({"dishes": [], "meal_nutrition_total": {}, "error": "JSON parsing failed"}, ensure_ascii=False)
@@ -113,8 +117,7 @@ def compute_meal_nutrition(portion_result: str) -> str:
         "meal_nutrition_total": meal_total,
         "image_path": image_path
     }
-    return json.dumps(result, ensure_ascii=False)
-    return json.dumps(result, ensure_ascii=False)
+    return publish_artifact("compute", json.dumps(result, ensure_ascii=False))
 
 
 @tool  
@@ -3,11 +3,59 @@ DatabaseTools - JSON database read/write tools
 """
 import json
 import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
-from langchain.tools import tool
-from typing import Dict, Any, List, Optional
+from langchain_core.tools import tool
+from typing import Dict, Any, Iterator, List, Optional
 
 from config.settings import DB_PATH, RECENT_DAYS
+from metrics import get_metrics
+from tools.artifacts import expand_artifacts, is_artifact_handle, resolve_artifact
+
+try:
+    import fcntl
+except ImportError:  # Windows: 仅进程内加锁
+    fcntl = None
+
+
+_db_lock = threading.Lock()
+
+# 当前请求保存的餐食记录（agent模式下由调用方取回，无需重新读取数据库）
+_saved_meals: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("saved_meals", default=None)
+
+
+@contextmanager
+def _db_write_lock() -> Iterator[None]:
+    """
+    数据库读-改-写的互斥锁：进程内用线程锁，跨进程（多个uvicorn worker、CLI与服务同时运行）
+    用旁路锁文件DB_PATH.lock上的fcntl.flock
+    """
+    with _db_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        with open(DB_PATH + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def recording_saved_meals() -> Iterator[List[Dict[str, Any]]]:
+    """收集此代码块内（含工具线程）save_meal_record保存的记录"""
+    saved: List[Dict[str, Any]] = []
+    token = _saved_meals.set(saved)
+    try:
+        yield saved
+    finally:
+        _saved_meals.reset(token)
 
 
 def _load_json() -> Dict[str, Any]:
@@ -47,13 +95,16 @@ def _load_json() -> Dict[str, Any]:
 
 def _save_json(data: Dict[str, Any]) -> None:
     """Save JSON database"""
+    temp_path = None
     try:
         # 确保目录存在
-        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
         
         # 先写入临时文件，成功后再替换原文件（避免写入失败导致数据丢失）
-        temp_path = DB_PATH + ".tmp"
-        with open(temp_path, "w", encoding="utf-8") as f:
+        # 临时文件名唯一，多个进程同时写入时互不覆盖
+        fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(DB_PATH) + ".", suffix=".tmp",
+                                         dir=os.path.dirname(DB_PATH) or ".")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
         
         # 原子性替换文件
@@ -63,12 +114,121 @@ def _save_json(data: Dict[str, Any]) -> None:
         import traceback
         traceback.print_exc()
         # 清理临时文件
-        temp_path = DB_PATH + ".tmp"
-        if os.path.exists(temp_path):
+        if temp_path is not None and os.path.exists(temp_path):
             os.remove(temp_path)
         raise  # 抛出异常，让调用者知道保存失败
 
 
+# 只读视图缓存：文件版本（inode、修改时间、大小）不变时直接复用，不重新解析JSON
+_view_lock = threading.Lock()
+_view: Optional[Dict[str, Any]] = None
+
+_EMPTY_SUMMARY = {
+    "total_calories": 0,
+    "total_protein": 0,
+    "total_fat": 0,
+    "total_carbs": 0,
+    "total_sodium": 0,
+    "daily_score": 0
+}
+
+
+def load_db_view() -> Dict[str, Any]:
+    """
+    数据库的只读缓存视图（按日期索引），供HTTP查询接口使用。
+    
+    返回:
+        {"version": 文件版本字符串, "modified": 最后修改时间戳, "dates": 按日期排序的日期列表,
+         "by_date": {日期: 当天记录}}；数据库不存在时为空视图
+        视图在线程间共享，调用方不得修改其内容
+    """
+    global _view
+    try:
+        f = open(DB_PATH, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return {"version": "empty", "modified": 0.0, "dates": [], "by_date": {}}
+    with f:
+        # 从已打开的文件取版本：写入是整文件原子替换，版本与读到的内容一致
+        stat = os.fstat(f.fileno())
+        key = (DB_PATH, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with _view_lock:
+            if _view is not None and _view["key"] == key:
+                return _view
+        content = f.read().strip()
+    try:
+        db = json.loads(content) if content else {}
+    except json.JSONDecodeError as e:
+        print(f"⚠️  Database JSON format error: {str(e)}")
+        db = {}
+    by_date = {day["date"]: day for day in db.get("days", [])}
+    view = {
+        "key": key,
+        "version": f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}",
+        "modified": stat.st_mtime,
+        "dates": sorted(by_date),
+        "by_date": by_date
+    }
+    with _view_lock:
+        _view = view
+    return view
+
+
+def list_days(view: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """有记录的每一天：日期、餐数和每日汇总（按日期升序）"""
+    return [
+        {"date": date, "meals": len(view["by_date"][date].get("meals", [])),
+         "daily_summary": view["by_date"][date].get("daily_summary", _EMPTY_SUMMARY)}
+        for date in view["dates"]
+    ]
+
+
+def day_detail(view: Dict[str, Any], date: str) -> Optional[Dict[str, Any]]:
+    """某一天的汇总和各餐概要（不含菜品明细），没有记录时返回None"""
+    day = view["by_date"].get(date)
+    if day is None:
+        return None
+    return {
+        "date": date,
+        "daily_summary": day.get("daily_summary", _EMPTY_SUMMARY),
+        "meals": [
+            {
+                "meal_id": meal.get("meal_id"),
+                "meal_type": meal.get("meal_type"),
+                "timestamp": meal.get("timestamp"),
+                "meal_nutrition_total": meal.get("meal_nutrition_total") or meal.get("nutrition_total", {}),
+                "scores": meal.get("scores", {})
+            }
+            for meal in day.get("meals", [])
+        ]
+    }
+
+
+def nutrition_trend(view: Dict[str, Any], days: int, today: Optional[str] = None) -> Dict[str, Any]:
+    """
+    最近N天（含今天）每日汇总的序列及按有记录天数的平均值。
+    
+    参数:
+        view: load_db_view()的结果
+        days: 天数
+        today: 今天的日期(YYYY-MM-DD)，默认为当前日期
+    
+    返回:
+        {"days", "from", "to", "days_logged", "series": [每天的汇总], "daily_average": {...}}
+    """
+    end = datetime.strptime(today, "%Y-%m-%d").date() if today else datetime.now().date()
+    start = (end - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    end = end.strftime("%Y-%m-%d")
+    series = [
+        {"date": day["date"], "meals": day["meals"], **day["daily_summary"]}
+        for day in list_days(view) if start <= day["date"] <= end
+    ]
+    average = {}
+    if series:
+        for key in _EMPTY_SUMMARY:
+            average[key] = round(sum(day.get(key, 0) for day in series) / len(series), 2)
+    return {"days": days, "from": start, "to": end, "days_logged": len(series), "series": series,
+            "daily_average": average}
+
 @tool
 def load_recent_meals(days: int = RECENT_DAYS) -> Dict[str, Any]:
     """
@@ -124,13 +284,148 @@ def load_recent_meals(days: int = RECENT_DAYS) -> Dict[str, Any]:
     }
 
 
+def save_meal_record(meal_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    将餐食记录写入当天，更新每日汇总并保存数据库。
+    
+    参数:
+        meal_dict: 餐食数据(必须包含dishes和meal_nutrition_total)
+    
+    返回:
+        实际保存的餐食记录(已补充meal_id和timestamp)
+    """
+    return save_meal_records([meal_dict])[0]
+
+
+def save_meal_records(meal_dicts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    一次读写数据库保存多条餐食记录（批量分析的分组提交）。
+    
+    参数:
+        meal_dicts: 餐食数据列表(每条必须包含dishes和meal_nutrition_total)
+    
+    返回:
+        实际保存的餐食记录(按输入顺序，已补充meal_id和timestamp)
+    """
+    if not meal_dicts:
+        return []
+    for meal_dict in meal_dicts:
+        _check_meal(meal_dict)
+    
+    # 并发写入（分析工作线程、其他worker进程）串行执行，避免读-改-写互相覆盖
+    started_at = time.perf_counter()
+    with _db_write_lock():
+        db = _load_json()
+        print(f"[DEBUG save_meal] 数据库加载成功，当前有 {len(db.get('days', []))} 天记录")
+        
+        for meal_dict in meal_dicts:
+            day_index = _append_meal(db, meal_dict)
+        
+        # 保存数据库
+        _save_json(db)
+    # 写入延迟（含等待锁的时间）
+    get_metrics().save_seconds.observe(time.perf_counter() - started_at)
+    print(f"[DEBUG save_meal] ✅ 数据库保存成功")
+    print(f"[DEBUG save_meal]   文件路径: {DB_PATH}")
+    print(f"[DEBUG save_meal]   当前天数: {len(db['days'])}")
+    print(f"[DEBUG save_meal]   今日餐数: {len(db['days'][day_index]['meals'])}")
+    
+    recorder = _saved_meals.get()
+    if recorder is not None:
+        recorder.extend(meal_dicts)
+    return meal_dicts
+
+
+def _check_meal(meal_dict: Dict[str, Any]) -> None:
+    """保存前的必填字段检查"""
+    # 🔍 严格检查：必须有dishes
+    if "dishes" not in meal_dict or not meal_dict["dishes"]:
+        error_msg = "❌ save_meal: 缺少dishes字段或为空"
+        print(error_msg)
+        raise ValueError(error_msg)
+    
+    # 🔍 严格检查：必须有meal_nutrition_total
+    if "meal_nutrition_total" not in meal_dict:
+        error_msg = "❌ save_meal: 缺少meal_nutrition_total字段"
+        print(error_msg)
+        raise ValueError(error_msg)
+
+
+def _append_meal(db: Dict[str, Any], meal_dict: Dict[str, Any]) -> int:
+    """把一条餐食加入当天记录并更新每日汇总，返回当天在days中的下标"""
+    # 获取当前日期
+    today = datetime.now().strftime("%Y-%m-%d")
+    
+    # 查找今天的记录
+    day_index = None
+    for i, day in enumerate(db.get("days", [])):
+        if day["date"] == today:
+            day_index = i
+            break
+    
+    # 如果今天的记录不存在，创建新的
+    if day_index is None:
+        new_day = {
+            "date": today,
+            "daily_summary": {
+                "total_calories": 0,
+                "total_protein": 0,
+                "total_fat": 0,
+                "total_carbs": 0,
+                "total_sodium": 0,
+                "daily_score": 0
+            },
+            "meals": []
+        }
+        db["days"].append(new_day)
+        day_index = len(db["days"]) - 1
+    
+    # 添加meal_id和timestamp(如果没有)
+    if "meal_id" not in meal_dict:
+        meal_count = len(db["days"][day_index]["meals"])
+        meal_dict["meal_id"] = f"meal_{today}_{meal_count+1}"
+    
+    if "timestamp" not in meal_dict:
+        meal_dict["timestamp"] = datetime.now().isoformat()
+    
+    # 添加餐食到今天的记录
+    db["days"][day_index]["meals"].append(meal_dict)
+    
+    # 更新每日汇总
+    daily_summary = db["days"][day_index]["daily_summary"]
+    # 兼容两种字段名：meal_nutrition_total 和 nutrition_total
+    meal_nutrition = meal_dict.get("meal_nutrition_total") or meal_dict.get("nutrition_total", {})
+    
+    daily_summary["total_calories"] += meal_nutrition.get("calories", 0)
+    daily_summary["total_protein"] += meal_nutrition.get("protein", 0)
+    daily_summary["total_fat"] += meal_nutrition.get("fat", 0)
+    daily_summary["total_carbs"] += meal_nutrition.get("carbs", 0)
+    daily_summary["total_sodium"] += meal_nutrition.get("sodium", 0)
+    
+    # 更新每日评分(取所有餐的平均分)
+    all_scores = []
+    for meal in db["days"][day_index]["meals"]:
+        if "scores" in meal and "current_meal_score" in meal["scores"]:
+            all_scores.append(meal["scores"]["current_meal_score"])
+    
+    if all_scores:
+        daily_summary["daily_score"] = round(sum(all_scores) / len(all_scores), 2)
+    
+    # 四舍五入营养值
+    for key in ["total_calories", "total_protein", "total_fat", "total_carbs", "total_sodium"]:
+        daily_summary[key] = round(daily_summary[key], 2)
+    
+    return day_index
+
+
 @tool
 def save_meal(meal_data: str) -> str:
     """
     将餐食记录保存到JSON数据库。
     
     参数:
-        meal_data: 完整的餐食数据JSON字符串，包含dishes、meal_nutrition_total等字段
+        meal_data: 完整的餐食数据JSON字符串，包含dishes、meal_nutrition_total等字段；
+                   也可以是compute结果的artifact://句柄，或在字段中引用句柄（句柄内容会合并进记录）
     
     返回:
         保存状态消息
@@ -140,98 +435,19 @@ def save_meal(meal_data: str) -> str:
         print(f"[DEBUG save_meal] 数据前200字符: {str(meal_data)[:200]}")
         
         # 解析JSON字符串
+        if is_artifact_handle(meal_data):
+            meal_data = resolve_artifact(meal_data)
         if isinstance(meal_data, str):
             meal_dict = json.loads(meal_data)
         else:
             meal_dict = meal_data
+        meal_dict = expand_artifacts(meal_dict)
         
         print(f"[DEBUG save_meal] 解析后的keys: {meal_dict.keys()}")
         
-        # 🔍 严格检查：必须有dishes
-        if "dishes" not in meal_dict or not meal_dict["dishes"]:
-            error_msg = "❌ save_meal: 缺少dishes字段或为空"
-            print(error_msg)
-            raise ValueError(error_msg)
-        
-        # 🔍 严格检查：必须有meal_nutrition_total
-        if "meal_nutrition_total" not in meal_dict:
-            error_msg = "❌ save_meal: 缺少meal_nutrition_total字段"
-            print(error_msg)
-            raise ValueError(error_msg)
-        
-        db = _load_json()
-        print(f"[DEBUG save_meal] 数据库加载成功，当前有 {len(db.get('days', []))} 天记录")
-        
-        # 获取当前日期
+        saved = save_meal_record(meal_dict)
         today = datetime.now().strftime("%Y-%m-%d")
-        
-        # 查找今天的记录
-        day_index = None
-        for i, day in enumerate(db.get("days", [])):
-            if day["date"] == today:
-                day_index = i
-                break
-        
-        # 如果今天的记录不存在，创建新的
-        if day_index is None:
-            new_day = {
-                "date": today,
-                "daily_summary": {
-                    "total_calories": 0,
-                    "total_protein": 0,
-                    "total_fat": 0,
-                    "total_carbs": 0,
-                    "total_sodium": 0,
-                    "daily_score": 0
-                },
-                "meals": []
-            }
-            db["days"].append(new_day)
-            day_index = len(db["days"]) - 1
-        
-        # 添加meal_id和timestamp(如果没有)
-        if "meal_id" not in meal_dict:
-            meal_count = len(db["days"][day_index]["meals"])
-            meal_dict["meal_id"] = f"meal_{today}_{meal_count+1}"
-        
-        if "timestamp" not in meal_dict:
-            meal_dict["timestamp"] = datetime.now().isoformat()
-        
-        # 添加餐食到今天的记录
-        db["days"][day_index]["meals"].append(meal_dict)
-        
-        # 更新每日汇总
-        daily_summary = db["days"][day_index]["daily_summary"]
-        # 兼容两种字段名：meal_nutrition_total 和 nutrition_total
-        meal_nutrition = meal_dict.get("meal_nutrition_total") or meal_dict.get("nutrition_total", {})
-        
-        daily_summary["total_calories"] += meal_nutrition.get("calories", 0)
-        daily_summary["total_protein"] += meal_nutrition.get("protein", 0)
-        daily_summary["total_fat"] += meal_nutrition.get("fat", 0)
-        daily_summary["total_carbs"] += meal_nutrition.get("carbs", 0)
-        daily_summary["total_sodium"] += meal_nutrition.get("sodium", 0)
-        
-        # 更新每日评分(取所有餐的平均分)
-        all_scores = []
-        for meal in db["days"][day_index]["meals"]:
-            if "scores" in meal and "current_meal_score" in meal["scores"]:
-                all_scores.append(meal["scores"]["current_meal_score"])
-        
-        if all_scores:
-            daily_summary["daily_score"] = round(sum(all_scores) / len(all_scores), 2)
-        
-        # 四舍五入营养值
-        for key in ["total_calories", "total_protein", "total_fat", "total_carbs", "total_sodium"]:
-            daily_summary[key] = round(daily_summary[key], 2)
-        
-        # 保存数据库
-        _save_json(db)
-        print(f"[DEBUG save_meal] ✅ 数据库保存成功")
-        print(f"[DEBUG save_meal]   文件路径: {DB_PATH}")
-        print(f"[DEBUG save_meal]   当前天数: {len(db['days'])}")
-        print(f"[DEBUG save_meal]   今日餐数: {len(db['days'][day_index]['meals'])}")
-        
-        return f"成功保存餐食记录到 {today}，餐食ID: {meal_dict['meal_id']}"
+        return f"成功保存餐食记录到 {today}，餐食ID: {saved['meal_id']}"
     
     except Exception as e:
         error_msg = f"❌ 保存餐食失败: {str(e)}"
@@ -239,8 +455,6 @@ def save_meal(meal_data: str) -> str:
         import traceback
         traceback.print_exc()
         raise
-        print(error_msg)
-        return error_msg
 
 
 @tool
@@ -257,11 +471,10 @@ def get_daily_summary(date: Optional[str] = None) -> Dict[str, Any]:
     if date is None:
         date = datetime.now().strftime("%Y-%m-%d")
     
-    db = _load_json()
-    
-    for day in db.get("days", []):
-        if day["date"] == date:
-            return day["daily_summary"]
+    # 从缓存视图按日期查找（数据库未变化时不重新解析）
+    day = load_db_view()["by_date"].get(date)
+    if day is not None:
+        return dict(day["daily_summary"])
     
     # 如果没找到，返回空汇总
     return {
@@ -0,0 +1,74 @@
+"""
+Uploaded Images - Upload bytes handed to the analysis without a temp-file round trip
+An upload is registered for the duration of its analysis and addressed by an image:// handle
+that goes wherever an image path goes (pipeline, agent query, vision tool, checkpoint key).
+Uploads above IMAGE_SPILL_BYTES are written to a temp file instead and the path is used.
+"""
+import os
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from config.settings import IMAGE_SPILL_BYTES
+
+
+SCHEME = "image://"
+
+_images: Dict[str, bytes] = {}
+_lock = threading.Lock()
+
+
+def is_image_handle(value: str) -> bool:
+    return isinstance(value, str) and value.startswith(SCHEME)
+
+
+@contextmanager
+def uploaded_image(data: bytes, filename: str = "upload.jpg") -> Iterator[str]:
+    """
+    Make upload bytes readable by the analysis while the block runs.
+
+    Args:
+        data: Image bytes
+        filename: Original file name (kept at the end of the handle / as the temp file suffix)
+
+    Yields:
+        image://<id>/<filename> handle, or a temp file path for uploads above IMAGE_SPILL_BYTES
+    """
+    if len(data) > IMAGE_SPILL_BYTES:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as tmp:
+            tmp.write(data)
+        try:
+            yield tmp.name
+        finally:
+            os.remove(tmp.name)
+        return
+
+    handle = f"{SCHEME}{uuid.uuid4().hex}/{os.path.basename(filename)}"
+    with _lock:
+        _images[handle] = data
+    try:
+        yield handle
+    finally:
+        with _lock:
+            _images.pop(handle, None)
+
+
+def read_image(image_path: str) -> bytes:
+    """Bytes of an image:// handle or an image file"""
+    if is_image_handle(image_path):
+        with _lock:
+            data = _images.get(image_path)
+        if data is None:
+            raise FileNotFoundError(f"Image is no longer available: {image_path}")
+        return data
+    with open(image_path, "rb") as f:
+        return f.read()
+
+
+def image_exists(image_path: str) -> bool:
+    if is_image_handle(image_path):
+        with _lock:
+            return image_path in _images
+    return os.path.isfile(image_path)
@@ -5,21 +5,12 @@ Combines fixed rules (cold start) and LLM intelligent analysis (learn user sched
 import json
 from datetime import datetime
 from typing import Dict, Any, Optional, List
-from openai import OpenAI
-from langchain.tools import tool
+from langchain_core.tools import tool
 
 from config.settings import (
-    DASHSCOPE_API_KEY,
-    QWEN_BASE_URL,
     QWEN_TEXT_MODEL
 )
-
-
-# Initialize OpenAI client (compatible with Qwen API)
-client = OpenAI(
-    api_key=DASHSCOPE_API_KEY,
-    base_url=QWEN_BASE_URL
-)
+from llm.calls import chat_completion, achat_completion
 
 
 @tool
@@ -58,6 +49,19 @@ def infer_meal_type(timestamp: Optional[str] = None, recent_meals: Optional[list
         return _infer_with_rules(current_hour, today_str, recent_meals)
 
 
+async def _ainfer_meal_type(timestamp: Optional[str] = None, recent_meals: Optional[list] = None) -> str:
+    """Async implementation of infer_meal_type (used by ainvoke)"""
+    dt = datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+    today_str = dt.strftime("%Y-%m-%d")
+    
+    if recent_meals and len(recent_meals) >= 3:
+        return await _ainfer_with_llm(dt.strftime("%H:%M"), today_str, recent_meals)
+    return _infer_with_rules(dt.hour, today_str, recent_meals)
+
+
+infer_meal_type.coroutine = _ainfer_meal_type
+
+
 def _infer_with_rules(hour: int, today: str, recent_meals: Optional[list]) -> str:
     """
     Cold start: Determine meal type using fixed time rules
@@ -97,9 +101,9 @@ def _infer_with_rules(hour: int, today: str, recent_meals: Optional[list]) -> st
     return base_type
 
 
-def _infer_with_llm(current_time: str, today: str, recent_meals: List[Dict]) -> str:
+def _build_meal_type_messages(current_time: str, today: str, recent_meals: List[Dict]) -> List[Dict[str, Any]]:
     """
-    Use LLM to analyze user eating habits and intelligently infer meal type
+    Build the meal-type inference request messages
     """
     # Prompt for analyzing meal habits
     prompt = f"""
@@ -143,59 +147,79 @@ If the user's history shows:
 
 If user ate lunch at 12:00 and current time is 16:00:
 → Output: Afternoon Tea
-"""    
+"""
+    return [
+        {
+            "role": "system",
+            "content": "You are a professional daily-routine analysis expert who can accurately determine the meal type based on historical data."
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+
+def _match_meal_type(content: str, current_time: str, today: str, recent_meals: List[Dict]) -> str:
+    """
+    Map the model's answer onto a known meal type (falls back to rules)
+    """
+    meal_type = content.strip()
+    
+    valid_types = [
+        "Breakfast",
+        "Lunch",
+        "Dinner",
+        "Midnight Snack",
+        "Snack",
+        "Afternoon Tea",
+        "Brunch",
+        "Morning Snack",
+        "Afternoon Snack",
+        "Evening Snack"
+    ]
+
+    # Exact match
+    if meal_type in valid_types:
+        print(f"✅ LLM Inference: {current_time} -> {meal_type}")
+        return meal_type
+    
+    # Partial match
+    for vtype in valid_types:
+        if vtype in meal_type:
+            print(f"✅ LLM Inference: {current_time} -> {vtype} (extracted from '{meal_type}')")
+            return vtype
+    
+    # Fallback
+    print(f"⚠️ LLM returned unknown meal type '{meal_type}', falling back to rule-based")
+    hour = int(current_time.split(":")[0])
+    return _infer_with_rules(hour, today, recent_meals)
+
+
+def _infer_with_llm(current_time: str, today: str, recent_meals: List[Dict]) -> str:
+    """
+    Use LLM to analyze user eating habits and intelligently infer meal type
+    """
+    messages = _build_meal_type_messages(current_time, today, recent_meals)
     try:
         # Call Qwen model
-        response = client.chat.completions.create(
-            model=QWEN_TEXT_MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a professional daily-routine analysis expert who can accurately determine the meal type based on historical data."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.3,
-        )
-        
-        content = response.choices[0].message.content
-        
-        if not content:
-            raise ValueError("Model returned empty content")
-        
-        meal_type = content.strip()
-        
-        valid_types = [
-            "Breakfast",
-            "Lunch",
-            "Dinner",
-            "Midnight Snack",
-            "Snack",
-            "Afternoon Tea",
-            "Brunch",
-            "Morning Snack",
-            "Afternoon Snack",
-            "Evening Snack"
-        ]
-
-        # Exact match
-        if meal_type in valid_types:
-            print(f"✅ LLM Inference: {current_time} -> {meal_type}")
-            return meal_type
-        
-        # Partial match
-        for vtype in valid_types:
-            if vtype in meal_type:
-                print(f"✅ LLM Inference: {current_time} -> {vtype} (extracted from '{meal_type}')")
-                return vtype
-        
-        # Fallback
-        print(f"⚠️ LLM returned unknown meal type '{meal_type}', falling back to rule-based")
+        content = chat_completion("infer_meal_type", QWEN_TEXT_MODEL, messages, temperature=0.3)
+        return _match_meal_type(content, current_time, today, recent_meals)
+    
+    except Exception as e:
+        print(f"⚠️ LLM inference failed: {str(e)}, falling back to rule-based")
         hour = int(current_time.split(":")[0])
         return _infer_with_rules(hour, today, recent_meals)
+
+
+async def _ainfer_with_llm(current_time: str, today: str, recent_meals: List[Dict]) -> str:
+    """
+    Async version of _infer_with_llm
+    """
+    messages = _build_meal_type_messages(current_time, today, recent_meals)
+    try:
+        content = await achat_completion("infer_meal_type", QWEN_TEXT_MODEL, messages, temperature=0.3)
+        return _match_meal_type(content, current_time, today, recent_meals)
     
     except Exception as e:
         print(f"⚠️ LLM inference failed: {str(e)}, falling back to rule-based")
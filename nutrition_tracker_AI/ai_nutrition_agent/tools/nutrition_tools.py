@@ -2,38 +2,22 @@
 NutritionTool - Online query dish nutrition data
 Use Qwen-Plus + web search to get real-time accurate nutrition information
 """
+import asyncio
 import json
-from openai import OpenAI
-from langchain.tools import tool
-from typing import Dict, Any, Optional
+from langchain_core.tools import tool
+from typing import Dict, Any, List, Optional, Tuple
 
 from config.settings import (
-    DASHSCOPE_API_KEY,
-    QWEN_BASE_URL,
     QWEN_TEXT_MODEL
 )
+from llm.calls import chat_completion, achat_completion
+from llm.json_extract import extract_json
+from tools.artifacts import publish_artifact, resolve_artifact
+from schemas.tool_schema import NutritionQueryOutput
 
 
-# Initialize OpenAI client (compatible with Qwen API)
-client = OpenAI(
-    api_key=DASHSCOPE_API_KEY,
-    base_url=QWEN_BASE_URL
-)
-
-
-@tool
-def query_nutrition_per_100g(dish_name: str) -> Dict[str, float]:
-    """
-    Query nutrition per 100g of a dish online. Use Qwen-Plus model combined with web search to get the most accurate nutrition data.
-    
-    Args:
-        dish_name: Dish name
-    
-    Returns:
-        Nutrition dictionary containing: calories, protein, fat, carbs, sodium
-    """
-    print(f"[DEBUG nutrition] Querying dish: {dish_name}")
-    
+def _build_nutrition_messages(dish_name: str) -> List[Dict[str, Any]]:
+    """Build the nutrition query request messages"""
     # Build query prompt
     prompt = f"""Please search for the nutritional components per 100g of "{dish_name}".
 
@@ -56,43 +40,73 @@ Notes:
 - Only output JSON, no explanation
 """
     
+    return [
+        {
+            "role": "system",
+            "content": "You are a professional nutrition data assistant. You can search the web and return accurate nutrition information in JSON format."
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+
+def _parse_nutrition_response(content: str) -> Dict[str, float]:
+    """Parse and validate the nutrition JSON returned by the model"""
+    nutrition_data = extract_json(content, NutritionQueryOutput)
+    if not isinstance(nutrition_data, dict):
+        raise ValueError("Expected a JSON object of nutrition values")
+    return nutrition_data
+
+
+@tool
+def query_nutrition_per_100g(dish_name: str) -> Dict[str, float]:
+    """
+    Query nutrition per 100g of a dish online. Use Qwen-Plus model combined with web search to get the most accurate nutrition data.
+    
+    Args:
+        dish_name: Dish name
+    
+    Returns:
+        Nutrition dictionary containing: calories, protein, fat, carbs, sodium
+    """
+    print(f"[DEBUG nutrition] Querying dish: {dish_name}")
+    
+    content = None
     try:
         # Call Qwen-Plus model (supports web search)
-        response = client.chat.completions.create(
-            model=QWEN_TEXT_MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a professional nutrition data assistant. You can search the web and return accurate nutrition information in JSON format."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.1,
+        content = chat_completion(
+            "query_nutrition_per_100g", QWEN_TEXT_MODEL, _build_nutrition_messages(dish_name), temperature=0.1,
+            response_schema=NutritionQueryOutput
         )
+        nutrition_data = _parse_nutrition_response(content)
         
-        content = response.choices[0].message.content
-        
-        if not content:
-            raise ValueError("Model returned empty content")
-        
-        json_str = content.strip()
-        
-        # Handle possible markdown code blocks
-        if "```json" in json_str:
-            json_str = json_str.split("```json")[1].split("```")[0].strip()
-        elif "```" in json_str:
-            json_str = json_str.split("```")[1].split("```")[0].strip()
+        print(f"✅ Nutrition query success: {dish_name} -> {nutrition_data}")
         
-        nutrition_data = json.loads(json_str)
+        return nutrition_data
         
-        required_fields = ["calories", "protein", "fat", "carbs", "sodium"]
-        for field in required_fields:
-            if field not in nutrition_data:
-                raise ValueError(f"Missing required field: {field}")
-            nutrition_data[field] = float(nutrition_data[field])
+    except json.JSONDecodeError as e:
+        print(f"❌ JSON parse failed: {str(e)}")
+        print(f"Raw content: {content}")
+        return _get_fallback_nutrition(dish_name)
+    
+    except Exception as e:
+        print(f"❌ Nutrition query error: {str(e)}")
+        return _get_fallback_nutrition(dish_name)
+
+
+async def _aquery_nutrition_per_100g(dish_name: str) -> Dict[str, float]:
+    """Async implementation of query_nutrition_per_100g (used by ainvoke)"""
+    print(f"[DEBUG nutrition] Querying dish: {dish_name}")
+    
+    content = None
+    try:
+        content = await achat_completion(
+            "query_nutrition_per_100g", QWEN_TEXT_MODEL, _build_nutrition_messages(dish_name), temperature=0.1,
+            response_schema=NutritionQueryOutput
+        )
+        nutrition_data = _parse_nutrition_response(content)
         
         print(f"✅ Nutrition query success: {dish_name} -> {nutrition_data}")
         
@@ -108,6 +122,9 @@ Notes:
         return _get_fallback_nutrition(dish_name)
 
 
+query_nutrition_per_100g.coroutine = _aquery_nutrition_per_100g
+
+
 def _get_fallback_nutrition(dish_name: str) -> Dict[str, float]:
     """
     Return estimated values when online query fails
@@ -165,19 +182,19 @@ def _get_fallback_nutrition(dish_name: str) -> Dict[str, float]:
         }
 
 
-@tool
-def add_nutrition_to_dishes(portion_result: str) -> str:
-    """
-    Add nutrition data to dish list. Must be called before compute!
+def _parse_portion_result(portion_result: str) -> Tuple[List[Dict[str, Any]], str, Optional[str]]:
     """
-    print("[DEBUG add_nutrition] Starting nutrition lookup")
+    Parse the portion result JSON string.
     
+    Returns:
+        (dishes, image_path, error_json) - error_json is set when the tool should return early
+    """
     try:
-        portion_data = json.loads(portion_result)
+        portion_data = json.loads(resolve_artifact(portion_result))
     except json.JSONDecodeError as e:
         error_msg = f"❌ add_nutrition: Failed to parse portion_result - {str(e)}"
         print(error_msg)
-        return json.dumps({"dishes": [], "image_path": "", "error": error_msg}, ensure_ascii=False)
+        return [], "", json.dumps({"dishes": [], "image_path": "", "error": error_msg}, ensure_ascii=False)
     
     dishes = portion_data.get("dishes", [])
     image_path = portion_data.get("image_path", "")
@@ -185,7 +202,22 @@ def add_nutrition_to_dishes(portion_result: str) -> str:
     if not dishes:
         error_msg = "❌ add_nutrition: dishes list is empty"
         print(error_msg)
-        return json.dumps({"dishes": [], "image_path": image_path, "error": error_msg}, ensure_ascii=False)
+        return [], image_path, json.dumps({"dishes": [], "image_path": image_path, "error": error_msg}, ensure_ascii=False)
+    
+    return dishes, image_path, None
+
+
+@tool
+def add_nutrition_to_dishes(portion_result: str) -> str:
+    """
+    Add nutrition data to dish list. Must be called before compute!
+    portion_result may be the JSON string or its artifact:// handle.
+    """
+    print("[DEBUG add_nutrition] Starting nutrition lookup")
+    
+    dishes, image_path, error_json = _parse_portion_result(portion_result)
+    if error_json:
+        return error_json
     
     print(f"[DEBUG add_nutrition] {len(dishes)} dishes need nutrition lookup")
     
@@ -213,5 +245,39 @@ def add_nutrition_to_dishes(portion_result: str) -> str:
     }
     
     print(f"[DEBUG add_nutrition] ✅ All dishes updated with nutrition")
-    return json.dumps(result, ensure_ascii=False)
+    return publish_artifact("nutrition", json.dumps(result, ensure_ascii=False))
+
+
+async def _aadd_nutrition_to_dishes(portion_result: str) -> str:
+    """Async implementation of add_nutrition_to_dishes - queries all dishes concurrently"""
+    print("[DEBUG add_nutrition] Starting nutrition lookup")
+    
+    dishes, image_path, error_json = _parse_portion_result(portion_result)
+    if error_json:
+        return error_json
+    
+    print(f"[DEBUG add_nutrition] {len(dishes)} dishes need nutrition lookup")
+    
+    dish_names = [dish.get("name", "Unknown dish") for dish in dishes]
+    results = await asyncio.gather(
+        *(query_nutrition_per_100g.ainvoke({"dish_name": name}) for name in dish_names),
+        return_exceptions=True
+    )
+    
+    for dish, dish_name, nutrition in zip(dishes, dish_names, results):
+        if isinstance(nutrition, BaseException):
+            print(f"[DEBUG add_nutrition]   ⚠️  Query failed: {str(nutrition)}")
+            nutrition = _get_fallback_nutrition(dish_name)
+            print(f"[DEBUG add_nutrition]   Using fallback: {nutrition}")
+        dish["nutrition_per_100g"] = nutrition
+    
+    result = {
+        "dishes": dishes,
+        "image_path": image_path
+    }
+    
+    print(f"[DEBUG add_nutrition] ✅ All dishes updated with nutrition")
+    return publish_artifact("nutrition", json.dumps(result, ensure_ascii=False))
+
 
+add_nutrition_to_dishes.coroutine = _aadd_nutrition_to_dishes
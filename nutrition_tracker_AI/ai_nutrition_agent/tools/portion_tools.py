@@ -3,42 +3,117 @@ PortionTool - Use Qwen-Plus to verify and refine dish portions
 """
 import json
 import os
-from openai import OpenAI
-from langchain.tools import tool
-from typing import List, Dict, Any
+from langchain_core.tools import tool
+from typing import List, Dict, Any, Optional, Tuple
 
 from config.settings import (
-    DASHSCOPE_API_KEY,
-    QWEN_BASE_URL,
     QWEN_TEXT_MODEL,
     PROMPTS_DIR
 )
+from llm.calls import chat_completion, achat_completion
+from llm.json_extract import extract_json
+from tools.artifacts import publish_artifact, resolve_artifact
+from schemas.tool_schema import PortionCheckOutput
 
 
-# Initialize OpenAI client
-client = OpenAI(
-    api_key=DASHSCOPE_API_KEY,
-    base_url=QWEN_BASE_URL
-)
+def _build_portion_messages(dishes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Build the portion verification request messages"""
+    # Read prompt
+    prompt_path = os.path.join(PROMPTS_DIR, "portion_prompt.txt")
+    with open(prompt_path, "r", encoding="utf-8") as f:
+        system_prompt = f.read()
+    
+    # Prepare input data
+    input_data = []
+    for dish in dishes:
+        input_data.append({
+            "dish_id": dish.get("dish_id"),
+            "name": dish.get("name"),
+            "category": dish.get("category"),
+            "estimated_weight_g": dish.get("estimated_weight_g")
+        })
+    
+    return [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": json.dumps(input_data, ensure_ascii=False, indent=2)
+        }
+    ]
 
 
-@tool
-def check_and_refine_portions(vision_result: str) -> str:
-    """
-    Check if dish portion estimates are reasonable, re-estimate if unreasonable.
+def _merge_portion_response(content: str, dishes: List[Dict[str, Any]], image_path: str) -> str:
+    """Merge the model's verification results into the dish list"""
+    verification_results = extract_json(content, PortionCheckOutput)
     
-    Args:
-        vision_result: Vision recognition result JSON string, containing {"dishes": [...], "image_path": "..."}
+    # 🔧 Fix: If LLM returns a single dict instead of list, convert to list
+    if isinstance(verification_results, dict) and "dish_id" in verification_results:
+        verification_results = [verification_results]
+    
+    # Merge verification results into original dish data
+    result_dishes = []
+    for dish in dishes:
+        dish_id = dish.get("dish_id")
+        
+        # Find corresponding verification result
+        verification = next(
+            (v for v in verification_results if isinstance(v, dict) and v.get("dish_id") == dish_id),
+            None
+        )
+        
+        if verification:
+            dish["final_weight_g"] = verification.get("final_weight_g", dish.get("estimated_weight_g"))
+            dish["is_reasonable"] = verification.get("is_reasonable", True)
+            dish["verification_reason"] = verification.get("reason", "")
+        else:
+            # If no verification result, use original estimate
+            dish["final_weight_g"] = dish.get("estimated_weight_g")
+            dish["is_reasonable"] = True
+            dish["verification_reason"] = "Not verified"
+        
+        result_dishes.append(dish)
+    
+    print(f"✅ Portion verification complete, total {len(result_dishes)} dishes")
+    result = {
+        "dishes": result_dishes,
+        "image_path": image_path
+    }
+    return json.dumps(result, ensure_ascii=False)
+
+
+def _portion_fallback(dishes: List[Dict[str, Any]], image_path: str, e: Exception) -> str:
+    """Return original data (add default final_weight_g)"""
+    print(f"Portion verification error: {str(e)}")
+    for dish in dishes:
+        if "final_weight_g" not in dish:
+            dish["final_weight_g"] = dish.get("estimated_weight_g", 200)
+            dish["is_reasonable"] = True
+            dish["verification_reason"] = "Verification failed, using initial estimate"
+    
+    result = {
+        "dishes": dishes,
+        "image_path": image_path,
+        "error": str(e)
+    }
+    return json.dumps(result, ensure_ascii=False)
+
+
+def _parse_vision_result(vision_result: str) -> Tuple[List[Dict[str, Any]], str, Optional[str]]:
+    """
+    Parse the vision result JSON string.
     
     Returns:
-        JSON string format: {"dishes": [...], "image_path": "..."}
+        (dishes, image_path, error_json) - error_json is set when the tool should return early
     """
     # Parse JSON string
     try:
-        vision_data = json.loads(vision_result)
+        vision_data = json.loads(resolve_artifact(vision_result))
     except json.JSONDecodeError as e:
         print(f"⚠️  Unable to parse vision_result: {str(e)}")
-        return json.dumps({"dishes": [], "image_path": "", "error": "JSON parsing failed"}, ensure_ascii=False)
+        return [], "", json.dumps({"dishes": [], "image_path": "", "error": "JSON parsing failed"}, ensure_ascii=False)
     
     # Extract dish list and image path
     dishes = vision_data.get("dishes", [])
@@ -47,104 +122,57 @@ def check_and_refine_portions(vision_result: str) -> str:
     # Verify list is not empty
     if not dishes:
         print(f"⚠️  dishes list is empty")
-        return json.dumps({"dishes": [], "image_path": image_path, "error": "Dish list is empty"}, ensure_ascii=False)
+        return [], image_path, json.dumps({"dishes": [], "image_path": image_path, "error": "Dish list is empty"}, ensure_ascii=False)
     
-    # Read prompt
-    prompt_path = os.path.join(PROMPTS_DIR, "portion_prompt.txt")
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        system_prompt = f.read()
+    return dishes, image_path, None
+
+
+@tool
+def check_and_refine_portions(vision_result: str) -> str:
+    """
+    Check if dish portion estimates are reasonable, re-estimate if unreasonable.
     
-    # Prepare input data
-    input_data = []
-    for dish in dishes:
-        input_data.append({
-            "dish_id": dish.get("dish_id"),
-            "name": dish.get("name"),
-            "category": dish.get("category"),
-            "estimated_weight_g": dish.get("estimated_weight_g")
-        })
+    Args:
+        vision_result: Vision recognition result JSON string, containing {"dishes": [...], "image_path": "..."},
+                       or its artifact:// handle
+    
+    Returns:
+        JSON string format: {"dishes": [...], "image_path": "..."} (in agent mode an artifact:// handle to it)
+    """
+    dishes, image_path, error_json = _parse_vision_result(vision_result)
+    if error_json:
+        return error_json
+    
+    messages = _build_portion_messages(dishes)
     
     try:
         # Call Qwen-Plus for verification
-        response = client.chat.completions.create(
-            model=QWEN_TEXT_MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": json.dumps(input_data, ensure_ascii=False, indent=2)
-                }
-            ],
-            temperature=0.2
-        )
-        
-        # Parse response
-        content = response.choices[0].message.content
-        if not content:
-            raise ValueError("Model returned empty content")
-        
-        # Extract JSON
-        if "```json" in content:
-            json_str = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            json_str = content.split("```")[1].split("```")[0].strip()
-        else:
-            json_str = content.strip()
-        
-        verification_results = json.loads(json_str)
-        
-        # 🔧 Fix: If LLM returns a single dict instead of list, convert to list
-        if isinstance(verification_results, dict) and "dish_id" in verification_results:
-            verification_results = [verification_results]
-        
-        # Merge verification results into original dish data
-        result_dishes = []
-        for dish in dishes:
-            dish_id = dish.get("dish_id")
-            
-            # Find corresponding verification result
-            verification = next(
-                (v for v in verification_results if isinstance(v, dict) and v.get("dish_id") == dish_id),
-                None
-            )
-            
-            if verification:
-                dish["final_weight_g"] = verification.get("final_weight_g", dish.get("estimated_weight_g"))
-                dish["is_reasonable"] = verification.get("is_reasonable", True)
-                dish["verification_reason"] = verification.get("reason", "")
-            else:
-                # If no verification result, use original estimate
-                dish["final_weight_g"] = dish.get("estimated_weight_g")
-                dish["is_reasonable"] = True
-                dish["verification_reason"] = "Not verified"
-            
-            result_dishes.append(dish)
-        
-        print(f"✅ Portion verification complete, total {len(result_dishes)} dishes")
-        result = {
-            "dishes": result_dishes,
-            "image_path": image_path
-        }
-        return json.dumps(result, ensure_ascii=False)
+        content = chat_completion("check_and_refine_portions", QWEN_TEXT_MODEL, messages, temperature=0.2,
+                                  response_schema=PortionCheckOutput, response_is_list=True)
+        return publish_artifact("portion", _merge_portion_response(content, dishes, image_path))
     
     except Exception as e:
-        print(f"Portion verification error: {str(e)}")
-        # Return original data (add default final_weight_g)
-        for dish in dishes:
-            if "final_weight_g" not in dish:
-                dish["final_weight_g"] = dish.get("estimated_weight_g", 200)
-                dish["is_reasonable"] = True
-                dish["verification_reason"] = "Verification failed, using initial estimate"
-        
-        result = {
-            "dishes": dishes,
-            "image_path": image_path,
-            "error": str(e)
-        }
-        return json.dumps(result, ensure_ascii=False)
+        return _portion_fallback(dishes, image_path, e)
+
+
+async def _acheck_and_refine_portions(vision_result: str) -> str:
+    """Async implementation of check_and_refine_portions (used by ainvoke)"""
+    dishes, image_path, error_json = _parse_vision_result(vision_result)
+    if error_json:
+        return error_json
+    
+    messages = _build_portion_messages(dishes)
+    
+    try:
+        content = await achat_completion("check_and_refine_portions", QWEN_TEXT_MODEL, messages, temperature=0.2,
+                                         response_schema=PortionCheckOutput, response_is_list=True)
+        return publish_artifact("portion", _merge_portion_response(content, dishes, image_path))
+    
+    except Exception as e:
+        return _portion_fallback(dishes, image_path, e)
+
+
+check_and_refine_portions.coroutine = _acheck_and_refine_portions
 
 
 if __name__ == "__main__":
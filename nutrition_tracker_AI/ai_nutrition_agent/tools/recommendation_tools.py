@@ -3,23 +3,97 @@ RecommendationTools - Use Qwen-Plus to provide next meal recommendations and tre
 """
 import json
 import os
-from openai import OpenAI
-from langchain.tools import tool
-from typing import Dict, Any
+from langchain_core.tools import tool
+from pydantic import BaseModel
+from typing import Dict, Any, List, Type
 
 from config.settings import (
-    DASHSCOPE_API_KEY,
-    QWEN_BASE_URL,
     QWEN_TEXT_MODEL,
     PROMPTS_DIR
 )
+from llm.calls import chat_completion, achat_completion
+from llm.json_extract import extract_json
+from schemas.tool_schema import ScoreOutput, RecommendationOutput
 
 
-# Initialize OpenAI client
-client = OpenAI(
-    api_key=DASHSCOPE_API_KEY,
-    base_url=QWEN_BASE_URL
-)
+def _load_prompt(filename: str) -> str:
+    """读取提示词文件"""
+    prompt_path = os.path.join(PROMPTS_DIR, filename)
+    with open(prompt_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _parse_json_content(content: str, schema: Type[BaseModel]) -> Dict[str, Any]:
+    """从模型返回内容中提取JSON并按schema校验"""
+    data = extract_json(content, schema)
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    return data
+
+
+def _build_score_messages(nutrition: Dict[str, float]) -> List[Dict[str, Any]]:
+    """构建本餐评分请求消息"""
+    return [
+        {"role": "system", "content": _load_prompt("score_prompt.txt")},
+        {"role": "user", "content": json.dumps(nutrition, ensure_ascii=False, indent=2)}
+    ]
+
+
+def _score_fallback(e: Exception) -> Dict[str, Any]:
+    print(f"本餐评分错误: {str(e)}")
+    return {
+        "score": 70,
+        "advice": "评分系统暂时不可用",
+        "error": str(e)
+    }
+
+
+def _build_trend_messages(current_meal: Dict[str, Any], weekly_trend: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """构建趋势评分请求消息"""
+    input_data = {
+        "current_meal": current_meal,
+        "weekly_trend": weekly_trend
+    }
+    return [
+        {"role": "system", "content": _load_prompt("trend_prompt.txt")},
+        {"role": "user", "content": json.dumps(input_data, ensure_ascii=False, indent=2)}
+    ]
+
+
+def _trend_fallback(e: Exception) -> Dict[str, Any]:
+    print(f"趋势评分错误: {str(e)}")
+    return {
+        "score": 70,
+        "advice": "趋势分析暂时不可用",
+        "error": str(e)
+    }
+
+
+def _build_recommend_messages(current_nutrition: Dict[str, Any], recent_history: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """构建下一餐推荐请求消息"""
+    input_data = {
+        "current_meal": current_nutrition,
+        "weekly_trend": recent_history.get("weekly_trend", {})
+    }
+    return [
+        {"role": "system", "content": _load_prompt("nextmeal_prompt.txt")},
+        {"role": "user", "content": json.dumps(input_data, ensure_ascii=False, indent=2)}
+    ]
+
+
+def _recommend_fallback(e: Exception) -> Dict[str, Any]:
+    print(f"推荐生成错误: {str(e)}")
+    return {
+        "options": [
+            {
+                "title": "均衡餐",
+                "recommended_dishes": ["清蒸鱼", "西兰花", "糙米饭"],
+                "reason": "推荐系统暂时不可用，提供默认建议"
+            }
+        ],
+        "overall_reason": "建议选择清淡均衡的食物",
+        "error": str(e)
+    }
 
 
 @tool
@@ -33,42 +107,31 @@ def score_current_meal_llm(nutrition: Dict[str, float]) -> Dict[str, Any]:
     Returns:
         Contains score and advice
     """
-    # Read prompt
-    prompt_path = os.path.join(PROMPTS_DIR, "score_prompt.txt")
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        system_prompt = f.read()
+    messages = _build_score_messages(nutrition)
+    
+    try:
+        content = chat_completion("score_current_meal_llm", QWEN_TEXT_MODEL, messages, temperature=0.3,
+                                  response_schema=ScoreOutput)
+        return _parse_json_content(content, ScoreOutput)
+    
+    except Exception as e:
+        return _score_fallback(e)
+
+
+async def _ascore_current_meal_llm(nutrition: Dict[str, float]) -> Dict[str, Any]:
+    """score_current_meal_llm 的异步实现（供 ainvoke 使用）"""
+    messages = _build_score_messages(nutrition)
     
     try:
-        response = client.chat.completions.create(
-            model=QWEN_TEXT_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": json.dumps(nutrition, ensure_ascii=False, indent=2)}
-            ],
-            temperature=0.3
-        )
-        
-        content = response.choices[0].message.content
-        if not content:
-            raise ValueError("模型返回内容为空")
-        
-        # 提取JSON
-        if "```json" in content:
-            json_str = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            json_str = content.split("```")[1].split("```")[0].strip()
-        else:
-            json_str = content.strip()
-        
-        result = json.loads(json_str)
-        return result
+        content = await achat_completion("score_current_meal_llm", QWEN_TEXT_MODEL, messages, temperature=0.3,
+                                         response_schema=ScoreOutput)
+        return _parse_json_content(content, ScoreOutput)
     
     except Exception as e:
-        print(f"本餐评分错误: {str(e)}")
-        return {
-            "score": 70,
-            "advice": "评分系统暂时不可用"
-        }
+        return _score_fallback(e)
+
+
+score_current_meal_llm.coroutine = _ascore_current_meal_llm
 
 
 @tool
@@ -83,47 +146,31 @@ def score_weekly_adjusted(current_meal: Dict[str, Any], weekly_trend: Dict[str,
     返回:
         包含score和advice
     """
-    # 读取提示词
-    prompt_path = os.path.join(PROMPTS_DIR, "trend_prompt.txt")
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        system_prompt = f.read()
+    messages = _build_trend_messages(current_meal, weekly_trend)
     
-    input_data = {
-        "current_meal": current_meal,
-        "weekly_trend": weekly_trend
-    }
+    try:
+        content = chat_completion("score_weekly_adjusted", QWEN_TEXT_MODEL, messages, temperature=0.3,
+                                  response_schema=ScoreOutput)
+        return _parse_json_content(content, ScoreOutput)
+    
+    except Exception as e:
+        return _trend_fallback(e)
+
+
+async def _ascore_weekly_adjusted(current_meal: Dict[str, Any], weekly_trend: Dict[str, Any]) -> Dict[str, Any]:
+    """score_weekly_adjusted 的异步实现（供 ainvoke 使用）"""
+    messages = _build_trend_messages(current_meal, weekly_trend)
     
     try:
-        response = client.chat.completions.create(
-            model=QWEN_TEXT_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": json.dumps(input_data, ensure_ascii=False, indent=2)}
-            ],
-            temperature=0.3
-        )
-        
-        content = response.choices[0].message.content
-        if not content:
-            raise ValueError("模型返回内容为空")
-        
-        # 提取JSON
-        if "```json" in content:
-            json_str = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            json_str = content.split("```")[1].split("```")[0].strip()
-        else:
-            json_str = content.strip()
-        
-        result = json.loads(json_str)
-        return result
+        content = await achat_completion("score_weekly_adjusted", QWEN_TEXT_MODEL, messages, temperature=0.3,
+                                         response_schema=ScoreOutput)
+        return _parse_json_content(content, ScoreOutput)
     
     except Exception as e:
-        print(f"趋势评分错误: {str(e)}")
-        return {
-            "score": 70,
-            "advice": "趋势分析暂时不可用"
-        }
+        return _trend_fallback(e)
+
+
+score_weekly_adjusted.coroutine = _ascore_weekly_adjusted
 
 
 @tool
@@ -138,53 +185,31 @@ def recommend_next_meal(current_nutrition: Dict[str, Any], recent_history: Dict[
     返回:
         包含options(推荐列表)和overall_reason
     """
-    # 读取提示词
-    prompt_path = os.path.join(PROMPTS_DIR, "nextmeal_prompt.txt")
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        system_prompt = f.read()
+    messages = _build_recommend_messages(current_nutrition, recent_history)
     
-    input_data = {
-        "current_meal": current_nutrition,
-        "weekly_trend": recent_history.get("weekly_trend", {})
-    }
+    try:
+        content = chat_completion("recommend_next_meal", QWEN_TEXT_MODEL, messages, temperature=0.5,
+                                  response_schema=RecommendationOutput)
+        return _parse_json_content(content, RecommendationOutput)
+    
+    except Exception as e:
+        return _recommend_fallback(e)
+
+
+async def _arecommend_next_meal(current_nutrition: Dict[str, Any], recent_history: Dict[str, Any]) -> Dict[str, Any]:
+    """recommend_next_meal 的异步实现（供 ainvoke 使用）"""
+    messages = _build_recommend_messages(current_nutrition, recent_history)
     
     try:
-        response = client.chat.completions.create(
-            model=QWEN_TEXT_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": json.dumps(input_data, ensure_ascii=False, indent=2)}
-            ],
-            temperature=0.5
-        )
-        
-        content = response.choices[0].message.content
-        if not content:
-            raise ValueError("模型返回内容为空")
-        
-        # 提取JSON
-        if "```json" in content:
-            json_str = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            json_str = content.split("```")[1].split("```")[0].strip()
-        else:
-            json_str = content.strip()
-        
-        result = json.loads(json_str)
-        return result
+        content = await achat_completion("recommend_next_meal", QWEN_TEXT_MODEL, messages, temperature=0.5,
+                                         response_schema=RecommendationOutput)
+        return _parse_json_content(content, RecommendationOutput)
     
     except Exception as e:
-        print(f"推荐生成错误: {str(e)}")
-        return {
-            "options": [
-                {
-                    "title": "均衡餐",
-                    "recommended_dishes": ["清蒸鱼", "西兰花", "糙米饭"],
-                    "reason": "推荐系统暂时不可用，提供默认建议"
-                }
-            ],
-            "overall_reason": "建议选择清淡均衡的食物"
-        }
+        return _recommend_fallback(e)
+
+
+recommend_next_meal.coroutine = _arecommend_next_meal
 
 
 if __name__ == "__main__":
@@ -1,27 +1,99 @@
 """
 VisionTool - Use Qwen-VL to recognize dishes and portions in images
 """
+import asyncio
 import json
 import os
 import base64
-from openai import OpenAI
-from langchain.tools import tool
-from typing import List, Dict, Any
+from langchain_core.tools import tool
+from typing import AsyncIterator, Callable, Iterator, List, Dict, Any
 
 from config.settings import (
-    DASHSCOPE_API_KEY,
-    QWEN_BASE_URL,
     QWEN_VL_MODEL,
     PROMPTS_DIR
 )
-from schemas.tool_schema import VisionInput
+from llm.calls import chat_completion, achat_completion, stream_chat_completion, astream_chat_completion
+from llm.json_extract import extract_json, iter_json_items, aiter_json_items
+from tools.artifacts import publish_artifact
+from tools.images import read_image
+from schemas.tool_schema import VisionInput, DishDetectionOutput
 
 
-# Initialize OpenAI client (compatible with Qwen API)
-client = OpenAI(
-    api_key=DASHSCOPE_API_KEY,
-    base_url=QWEN_BASE_URL
-)
+def _build_vision_messages(image_path: str) -> List[Dict[str, Any]]:
+    """Build the Qwen-VL request messages (prompt + base64 image)"""
+    # Read prompt
+    prompt_path = os.path.join(PROMPTS_DIR, "vision_prompt.txt")
+    with open(prompt_path, "r", encoding="utf-8") as f:
+        system_prompt = f.read()
+    
+    # Read image (upload bytes stay in memory, see tools/images.py) and perform base64 encoding
+    image_data = read_image(image_path)
+    # Correct base64 encoding
+    image_base64 = base64.b64encode(image_data).decode('utf-8')
+    
+    return [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{image_base64}"
+                    }
+                },
+                {
+                    "type": "text",
+                    "text": "Please identify all dishes in the image and output JSON."
+                }
+            ]
+        }
+    ]
+
+
+def _parse_vision_response(content: str, image_path: str) -> str:
+    """Parse model output into the tool's JSON string result"""
+    dishes = extract_json(content, DishDetectionOutput)
+    if not isinstance(dishes, list):
+        raise ValueError("Expected a JSON array of dishes")
+    
+    # Add dish_id for each dish
+    for i, dish in enumerate(dishes):
+        dish["dish_id"] = f"dish_{i+1}"
+    return _vision_result(dishes, image_path)
+
+
+def _vision_result(dishes: List[Dict[str, Any]], image_path: str) -> str:
+    """Tool result for a recognized dish list (JSON string format)"""
+    # Return JSON string format
+    result = {
+        "dishes": dishes,
+        "image_path": image_path
+    }
+    return json.dumps(result, ensure_ascii=False)
+
+
+def _vision_fallback(image_path: str, e: Exception) -> str:
+    """Default result when recognition fails (JSON string format)"""
+    print(f"Vision recognition error: {str(e)}")
+    result = {
+        "dishes": [
+            {
+                "dish_id": "dish_1",
+                "name": "Unrecognized dish",
+                "category": "Unknown",
+                "estimated_weight_g": 200,
+                "portion_level": "medium",
+                "reason": f"Recognition failed: {str(e)}"
+            }
+        ],
+        "image_path": image_path,
+        "error": str(e)
+    }
+    return json.dumps(result, ensure_ascii=False)
 
 
 @tool
@@ -34,95 +106,99 @@ def detect_dishes_and_portions(image_path: str) -> str:
     
     Returns:
         JSON string format: {"dishes": [...], "image_path": "..."}
+        (in agent mode an artifact:// handle to it)
         Each dish contains: dish_id, name, category, estimated_weight_g, portion_level, reason
     """
-    # Read prompt
-    prompt_path = os.path.join(PROMPTS_DIR, "vision_prompt.txt")
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        system_prompt = f.read()
-    
-    # Read image and perform base64 encoding
-    with open(image_path, "rb") as img_file:
-        image_data = img_file.read()
-        # Correct base64 encoding
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
+    messages = _build_vision_messages(image_path)
     
     try:
         # Call Qwen-VL model
-        response = client.chat.completions.create(
-            model=QWEN_VL_MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": "Please identify all dishes in the image and output JSON."
-                        }
-                    ]
-                }
-            ],
-            temperature=0.3
-        )
-        
-        # Parse response
-        content = response.choices[0].message.content
-        if not content:
-            raise ValueError("Model returned empty content")
-        
-        # Try to extract JSON
-        if "```json" in content:
-            json_str = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            json_str = content.split("```")[1].split("```")[0].strip()
-        else:
-            json_str = content.strip()
-        
-        dishes = json.loads(json_str)
-        
-        # Add dish_id for each dish
-        for i, dish in enumerate(dishes):
-            dish["dish_id"] = f"dish_{i+1}"
-            
-        with open("output.json", "w", encoding="utf-8") as f:
-            json.dump(dishes, f, ensure_ascii=False, indent=2)
-
-        
-        # Return JSON string format
-        result = {
-            "dishes": dishes,
-            "image_path": image_path
-        }
-        return json.dumps(result, ensure_ascii=False)
+        content = chat_completion("detect_dishes_and_portions", QWEN_VL_MODEL, messages, temperature=0.3,
+                                  response_schema=DishDetectionOutput, response_is_list=True)
+        return publish_artifact("vision", _parse_vision_response(content, image_path))
     
     except Exception as e:
-        print(f"Vision recognition error: {str(e)}")
-        # Return default result (JSON string format)
-        result = {
-            "dishes": [
-                {
-                    "dish_id": "dish_1",
-                    "name": "Unrecognized dish",
-                    "category": "Unknown",
-                    "estimated_weight_g": 200,
-                    "portion_level": "medium",
-                    "reason": f"Recognition failed: {str(e)}"
-                }
-            ],
-            "image_path": image_path,
-            "error": str(e)
-        }
-        return json.dumps(result, ensure_ascii=False)
+        return _vision_fallback(image_path, e)
+
+
+async def _adetect_dishes_and_portions(image_path: str) -> str:
+    """Async implementation of detect_dishes_and_portions (used by ainvoke)"""
+    messages = await asyncio.to_thread(_build_vision_messages, image_path)
+    
+    try:
+        content = await achat_completion("detect_dishes_and_portions", QWEN_VL_MODEL, messages, temperature=0.3,
+                                         response_schema=DishDetectionOutput, response_is_list=True)
+        return publish_artifact("vision", _parse_vision_response(content, image_path))
+    
+    except Exception as e:
+        return _vision_fallback(image_path, e)
+
+
+detect_dishes_and_portions.coroutine = _adetect_dishes_and_portions
+
+
+async def astream_detected_dishes(image_path: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream recognized dishes one by one while Qwen-VL is still generating,
+    so per-dish work (portion check, nutrition lookup) can start early.
+    Errors propagate; callers fall back to detect_dishes_and_portions.
+    
+    Yields:
+        Dish dicts with dish_id assigned in output order
+    """
+    messages = await asyncio.to_thread(_build_vision_messages, image_path)
+    chunks = astream_chat_completion("detect_dishes_and_portions", QWEN_VL_MODEL, messages, temperature=0.3)
+    index = 0
+    async for dish in aiter_json_items(chunks, DishDetectionOutput):
+        index += 1
+        dish["dish_id"] = f"dish_{index}"
+        yield dish
+
+
+def stream_detected_dishes(image_path: str) -> Iterator[Dict[str, Any]]:
+    """Sync version of astream_detected_dishes"""
+    messages = _build_vision_messages(image_path)
+    chunks = stream_chat_completion("detect_dishes_and_portions", QWEN_VL_MODEL, messages, temperature=0.3)
+    for index, dish in enumerate(iter_json_items(chunks, DishDetectionOutput), start=1):
+        dish["dish_id"] = f"dish_{index}"
+        yield dish
+
+
+def detect_dishes_progressively(image_path: str, on_dish: Callable[[Dict[str, Any]], None]) -> str:
+    """
+    detect_dishes_and_portions that calls on_dish(dish) for each dish as soon as Qwen-VL has
+    generated it. If streaming fails or finds nothing, falls back to the regular call
+    (dishes already announced are superseded by its result).
+    
+    Returns:
+        Same JSON string as detect_dishes_and_portions
+    """
+    dishes = []
+    try:
+        for dish in stream_detected_dishes(image_path):
+            dishes.append(dish)
+            on_dish(dish)
+    except Exception as e:
+        print(f"Vision streaming error, retrying without streaming: {str(e)}")
+        dishes = []
+    if not dishes:
+        return detect_dishes_and_portions.invoke({"image_path": image_path})
+    return publish_artifact("vision", _vision_result(dishes, image_path))
+
+
+async def adetect_dishes_progressively(image_path: str, on_dish: Callable[[Dict[str, Any]], None]) -> str:
+    """Async version of detect_dishes_progressively"""
+    dishes = []
+    try:
+        async for dish in astream_detected_dishes(image_path):
+            dishes.append(dish)
+            on_dish(dish)
+    except Exception as e:
+        print(f"Vision streaming error, retrying without streaming: {str(e)}")
+        dishes = []
+    if not dishes:
+        return await detect_dishes_and_portions.ainvoke({"image_path": image_path})
+    return publish_artifact("vision", _vision_result(dishes, image_path))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Import-time benchmark - Cold-start cost of the entry points
+Every module is imported in a fresh interpreter (median of several runs is reported) together
+with the heavy third-party packages the import pulled in.
+
+    python benchmark_imports.py                      # default entry points, 5 runs each
+    python benchmark_imports.py --runs 10 agent main
+    python -X importtime -c "import agent_server"    # per-module breakdown of one entry point
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Import-path names are the repo's own: project root and ai_nutrition_agent/ are both on sys.path
+ENTRY_POINTS = ("config.settings", "tools.db_tools", "pipeline", "agent", "main", "agent_server")
+HEAVY_PACKAGES = ("langgraph", "langchain", "langchain_community", "langchain_openai", "openai", "httpx", "fastapi")
+
+_PROBE = """
+import importlib, json, os, sys, time
+sys.path.insert(0, {root!r})
+sys.path.insert(0, os.path.join({root!r}, "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "benchmark-key")
+started_at = time.perf_counter()
+importlib.import_module({module!r})
+elapsed_ms = (time.perf_counter() - started_at) * 1000
+print(json.dumps({{"ms": elapsed_ms, "loaded": [p for p in {heavy!r} if p in sys.modules]}}))
+"""
+
+
+def import_profile(module: str) -> Dict[str, Any]:
+    """
+    Import one module in a fresh interpreter.
+
+    Returns:
+        {"ms": import time, "loaded": heavy packages now in sys.modules}
+    """
+    code = _PROBE.format(root=ROOT, module=module, heavy=HEAVY_PACKAGES)
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def benchmark(modules: List[str], runs: int) -> List[Dict[str, Any]]:
+    """Median / min import time of each module over `runs` cold starts"""
+    results = []
+    for module in modules:
+        profiles = [import_profile(module) for _ in range(runs)]
+        times = [profile["ms"] for profile in profiles]
+        results.append({
+            "module": module,
+            "median_ms": round(statistics.median(times), 1),
+            "min_ms": round(min(times), 1),
+            "loaded": profiles[-1]["loaded"]
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import time of the entry points")
+    parser.add_argument("modules", nargs="*", default=list(ENTRY_POINTS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print raw JSON results")
+    args = parser.parse_args()
+
+    results = benchmark(args.modules, args.runs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'module':<18} {'median':>9} {'min':>9}  heavy packages loaded")
+    for result in results:
+        print(f"{result['module']:<18} {result['median_ms']:>7.0f}ms {result['min_ms']:>7.0f}ms  "
+              f"{', '.join(result['loaded']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Local stand-in for the DashScope/Qwen OpenAI-compatible API
+Serves /chat/completions with canned or fixture-driven responses per prompt type,
+configurable latency, injected errors/429s and token usage, for offline benchmarking.
+
+Run:
+    uvicorn fake_qwen_server:app --port 8001
+and start the pipeline with LLM_BACKEND=fake.
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake Qwen API")
+
+
+# Runtime configuration (env defaults, adjustable via POST /_fake/config during a run)
+CONFIG: Dict[str, Any] = {
+    "latency_dist": os.getenv("FAKE_LLM_LATENCY_DIST", "lognormal"),  # fixed / uniform / normal / lognormal
+    "latency_ms": float(os.getenv("FAKE_LLM_LATENCY_MS", "300")),
+    "latency_jitter_ms": float(os.getenv("FAKE_LLM_LATENCY_JITTER_MS", "150")),
+    "latency_by_type": {},  # e.g. {"vision": 2000} overrides latency_ms per prompt type
+    "error_rate": float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+    "rate_limit_rate": float(os.getenv("FAKE_LLM_RATE_LIMIT_RATE", "0")),
+    "retry_after_s": int(os.getenv("FAKE_LLM_RETRY_AFTER_S", "1")),
+    "image_tokens": int(os.getenv("FAKE_LLM_IMAGE_TOKENS", "1024")),
+    # response_format types accepted; others get a 400 like an endpoint without structured output
+    "response_formats": [m for m in os.getenv("FAKE_LLM_RESPONSE_FORMATS", "json_schema,json_object").split(",") if m],
+}
+
+_rng = random.Random(int(os.getenv("FAKE_LLM_SEED", "0")) or None)
+_stats_lock = threading.Lock()
+STATS: Dict[str, int] = {}
+
+
+# Canned responses per prompt type (overridable with a FAKE_LLM_FIXTURES JSON file)
+DEFAULT_RESPONSES: Dict[str, Any] = {
+    "vision": [
+        {"name": "White Rice", "category": "Staple", "estimated_weight_g": 180,
+         "portion_level": "medium", "reason": "One standard bowl"},
+        {"name": "Kung Pao Chicken", "category": "Meat", "estimated_weight_g": 160,
+         "portion_level": "medium", "reason": "Covers a third of the plate"},
+        {"name": "Stir-fried Broccoli", "category": "Vegetable", "estimated_weight_g": 120,
+         "portion_level": "small", "reason": "Small side portion"}
+    ],
+    "nutrition": {"calories": 150.0, "protein": 8.0, "fat": 6.0, "carbs": 15.0, "sodium": 300.0},
+    "score": {"score": 78, "advice": "Balanced meal; sodium slightly high."},
+    "trend": {"score": 74, "advice": "Weekly sodium is above target; favour lighter dishes."},
+    "next_meal": {
+        "options": [
+            {"title": "Light protein", "recommended_dishes": ["Steamed fish", "Spinach", "Brown rice"],
+             "reason": "Lower sodium, keeps protein up"}
+        ],
+        "overall_reason": "Balance today's sodium with a lighter next meal"
+    },
+    "meal_type": "Lunch",
+    "agent": "Analysis complete. All dishes were identified, scored and saved.",
+    "default": "OK"
+}
+
+
+def _load_fixtures() -> Dict[str, Any]:
+    """Merge fixture overrides; {"round_robin": [...]} values rotate between responses"""
+    responses = dict(DEFAULT_RESPONSES)
+    path = os.getenv("FAKE_LLM_FIXTURES")
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            responses.update(json.load(f))
+    return responses
+
+
+FIXTURES = _load_fixtures()
+_round_robin: Dict[str, Any] = {}
+
+
+def _text_of(message: Dict[str, Any]) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content)
+
+
+def classify_prompt(body: Dict[str, Any]) -> str:
+    """Work out which tool sent the request from its prompt"""
+    messages = body.get("messages", [])
+    if body.get("tools"):
+        return "agent"
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list) and any(
+            isinstance(part, dict) and part.get("type") == "image_url" for part in content
+        ):
+            return "vision"
+
+    text = " ".join(_text_of(m) for m in messages)
+    markers = [
+        ("food weight estimation verification", "portion"),
+        ("nutritional components per 100g", "nutrition"),
+        ("long-term nutrition trend", "trend"),
+        ("professional nutrition consultant", "next_meal"),
+        ("professional nutritionist", "score"),
+        ("meal-type analysis", "meal_type"),
+    ]
+    for marker, prompt_type in markers:
+        if marker in text:
+            return prompt_type
+    return "default"
+
+
+def _portion_response(body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Echo the submitted dishes back as reasonable"""
+    try:
+        dishes = json.loads(_text_of(body["messages"][-1]))
+    except (ValueError, KeyError, IndexError):
+        dishes = []
+    return [
+        {
+            "dish_id": dish.get("dish_id"),
+            "is_reasonable": True,
+            "reason": "Typical single serving",
+            "final_weight_g": dish.get("estimated_weight_g") or 150
+        }
+        for dish in dishes if isinstance(dish, dict)
+    ]
+
+
+def build_content(prompt_type: str, body: Dict[str, Any]) -> str:
+    """Pick the response text for a prompt type (bare JSON when a response_format was requested)"""
+    if prompt_type == "portion" and "portion" not in FIXTURES:
+        value: Any = _portion_response(body)
+    else:
+        value = FIXTURES.get(prompt_type, FIXTURES["default"])
+        if isinstance(value, dict) and value.get("round_robin"):
+            cycle = _round_robin.setdefault(prompt_type, itertools.cycle(value["round_robin"]))
+            value = next(cycle)
+    if isinstance(value, str):
+        return value
+    response_format = (body.get("response_format") or {}).get("type")
+    if response_format == "json_schema":
+        # Array answers are wrapped in {"items": [...]} because schemas must have an object root
+        return json.dumps({"items": value} if isinstance(value, list) else value, ensure_ascii=False)
+    if response_format == "json_object":
+        return json.dumps(value, ensure_ascii=False)
+    return "```json\n" + json.dumps(value, ensure_ascii=False, indent=2) + "\n```"
+
+
+def count_tokens(body: Dict[str, Any], completion: str) -> Dict[str, int]:
+    """Rough token counts (~4 characters per token, fixed cost per image)"""
+    prompt_tokens = 0
+    for message in body.get("messages", []):
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and part.get("type") == "image_url":
+                    prompt_tokens += CONFIG["image_tokens"]
+                elif isinstance(part, dict):
+                    prompt_tokens += max(1, len(part.get("text", "")) // 4)
+        else:
+            prompt_tokens += max(1, len(str(content)) // 4)
+    completion_tokens = max(1, len(completion) // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+def sample_latency(prompt_type: str) -> float:
+    """Draw one latency (seconds) from the configured distribution"""
+    mean = float(CONFIG["latency_by_type"].get(prompt_type, CONFIG["latency_ms"]))
+    jitter = float(CONFIG["latency_jitter_ms"])
+    dist = CONFIG["latency_dist"]
+    if dist == "fixed":
+        value = mean
+    elif dist == "uniform":
+        value = _rng.uniform(mean - jitter, mean + jitter)
+    elif dist == "normal":
+        value = _rng.gauss(mean, jitter)
+    else:
+        # lognormal with the requested mean; jitter/mean sets the spread (long tail)
+        sigma = (jitter / mean) if mean > 0 else 0.0
+        value = mean * _rng.lognormvariate(-sigma * sigma / 2, sigma)
+    return max(0.0, value) / 1000
+
+
+def _count(key: str) -> None:
+    with _stats_lock:
+        STATS[key] = STATS.get(key, 0) + 1
+
+
+def _completion_payload(model: str, content: str, usage: Dict[str, int]) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-fake-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }
+        ],
+        "usage": usage
+    }
+
+
+def _stream_chunks(model: str, content: str, usage: Dict[str, int], chunk_size: int = 24):
+    completion_id = f"chatcmpl-fake-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    for i in range(0, len(content), chunk_size):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": content[i:i + chunk_size]}, "finish_reason": None}]
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+    final = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        "usage": usage
+    }
+    yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/chat/completions")
+@app.post("/compatible-mode/v1/chat/completions")
+async def chat_completions(request: Request):
+    """OpenAI-compatible chat completions"""
+    body = await request.json()
+    prompt_type = classify_prompt(body)
+    _count(f"requests.{prompt_type}")
+
+    await asyncio.sleep(sample_latency(prompt_type))
+
+    roll = _rng.random()
+    if roll < CONFIG["rate_limit_rate"]:
+        _count("injected.429")
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(CONFIG["retry_after_s"])},
+            content={"error": {"message": "Injected rate limit", "type": "rate_limit_error", "code": "Throttling"}}
+        )
+    if roll < CONFIG["rate_limit_rate"] + CONFIG["error_rate"]:
+        _count("injected.500")
+        return JSONResponse(
+            status_code=500,
+            content={"error": {"message": "Injected upstream error", "type": "server_error"}}
+        )
+
+    response_format = (body.get("response_format") or {}).get("type")
+    if response_format and response_format != "text" and response_format not in CONFIG["response_formats"]:
+        _count("rejected.response_format")
+        return JSONResponse(
+            status_code=400,
+            content={"error": {"message": f"response_format {response_format} is not supported by this model",
+                               "type": "invalid_request_error"}}
+        )
+
+    model = body.get("model", "qwen-plus")
+    content = build_content(prompt_type, body)
+    usage = count_tokens(body, content)
+
+    if body.get("stream"):
+        return StreamingResponse(_stream_chunks(model, content, usage), media_type="text/event-stream")
+    return _completion_payload(model, content, usage)
+
+
+@app.get("/_fake/stats")
+async def fake_stats():
+    """Request counts per prompt type and injected failures"""
+    with _stats_lock:
+        return dict(STATS)
+
+
+@app.post("/_fake/config")
+async def fake_config(request: Request):
+    """Update latency/error settings while a load test is running"""
+    updates = await request.json()
+    for key, value in updates.items():
+        if key in CONFIG:
+            CONFIG[key] = value
+    return CONFIG
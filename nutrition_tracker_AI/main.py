@@ -5,14 +5,26 @@ Based on LangChain 1.0 + LangGraph + Alibaba Qwen
 """
 import os
 import sys
+import time
 from datetime import datetime
 
 # Add project root to path
 sys.path.insert(0, os.path.dirname(__file__))
+# Package-internal modules (llm/, tools/) are imported by top-level name inside the package;
+# import shared state (request context, usage tracker) the same way so there is one copy of it
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "ai_nutrition_agent"))
 
-from ai_nutrition_agent.agent import NutritionAgent
-from ai_nutrition_agent.tools.meal_type_tools import infer_meal_type
-from ai_nutrition_agent.tools.db_tools import load_recent_meals
+from typing import Any, Callable, Dict, Optional
+
+from tools.meal_type_tools import infer_meal_type
+from tools.db_tools import load_recent_meals
+from tools.images import image_exists
+from agent_pool import get_agent_pool
+from config.settings import ANALYSIS_DEADLINE
+from llm.context import request_scope
+from llm.resilience import deadline_scope
+from llm.usage import get_usage_tracker
+from metrics import get_metrics
 
 
 def print_header():
@@ -39,20 +51,70 @@ def print_error(message):
     print(f"❌ {message}")
 
 
-def analyze_meal_from_image(image_path: str, meal_type: str = "") -> dict:
-    """Fully automated meal image analysis"""
-    print_header()
+def print_usage(summary: dict):
+    """Print per-step token/latency/cost breakdown of one request"""
+    total = summary["total"]
+    print(f"📈 Model usage: {total['calls']} calls, {total['total_tokens']} tokens, "
+          f"cost ≈ {total['cost']:.4f} CNY")
+    for tool_name, bucket in summary["by_tool"].items():
+        print(f"   {tool_name:<28} calls={bucket['calls']:<3} "
+              f"tokens={bucket['prompt_tokens']}+{bucket['completion_tokens']:<6} "
+              f"latency={bucket['latency_ms_total']:.0f}ms retries={bucket['retries']} cached={bucket['cached']}")
 
-    # Initialize Agent
-    print_progress("Initializing Agent...")
-    try:
-        agent = NutritionAgent()
-        print_success("Agent initialized successfully!")
-        print()
-    except Exception as e:
-        print_error(f"Initialization failed: {str(e)}")
-        return {}
-    
+
+def print_meal_report(result: dict):
+    """Print the saved meal and step timings of a pipeline run"""
+    meal = result["meal"]
+    total = meal.get("meal_nutrition_total", {})
+    print("📋 Analysis Report:")
+    print("-"*70)
+    print(f"🍽️  {meal.get('meal_type')} ({meal.get('meal_id')})")
+    for dish in meal.get("dishes", []):
+        print(f"   • {dish.get('name')}: {dish.get('final_weight_g')}g, "
+              f"{dish.get('nutrition_total', {}).get('calories', 0):.0f} kcal")
+    print(f"🔥 Total: {total.get('calories', 0)} kcal, protein {total.get('protein', 0)}g, "
+          f"fat {total.get('fat', 0)}g, carbs {total.get('carbs', 0)}g, sodium {total.get('sodium', 0)}mg")
+    scores, advice = meal.get("scores", {}), meal.get("advice", {})
+    print(f"⭐ Meal score: {scores.get('current_meal_score')} - {advice.get('current_meal_advice')}")
+    print(f"📈 Weekly-adjusted score: {scores.get('week_adjusted_score')} - {advice.get('week_adjusted_advice')}")
+    for option in meal.get("next_meal_recommendation", {}).get("options", []):
+        print(f"💡 {option.get('title')}: {', '.join(option.get('recommended_dishes', []))}")
+    print("-"*70)
+    print("⏱️  Steps: " + ", ".join(f"{s['step']} {s['duration_ms']:.0f}ms" for s in result.get("steps", [])))
+    if "total_ms" in result:
+        print(f"⏱️  End-to-end: {result['total_ms']:.0f}ms (post-compute steps run concurrently)")
+
+
+def analyze_meal_from_image(image_path: str, meal_type: str = "", request_id: Optional[str] = None,
+                            on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> dict:
+    """Fully automated meal image analysis (on_event receives pipeline step events as they happen)"""
+    with request_scope(request_id) as request_id, deadline_scope(ANALYSIS_DEADLINE):
+        print_header()
+
+        # Take a prebuilt Agent from the process-wide pool
+        print_progress("Acquiring Agent...")
+        pool = get_agent_pool()
+        try:
+            agent = pool.acquire()
+            print_success("Agent ready!")
+            print()
+        except Exception as e:
+            print_error(f"Initialization failed: {str(e)}")
+            return {}
+
+        started_at = time.perf_counter()
+        try:
+            result = _analyze_meal_from_image(agent, image_path, meal_type, on_event)
+        finally:
+            pool.release(agent)
+            get_metrics().analysis_seconds.observe(time.perf_counter() - started_at)
+        print_usage(get_usage_tracker().request_summary(request_id))
+        return result
+
+
+def _analyze_meal_from_image(agent, image_path: str, meal_type: str = "",
+                             on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> dict:
+    """Analysis body of analyze_meal_from_image (runs inside a request scope with a leased agent)"""
     # Input image path
     print("📸 Please enter meal image path:")
     print("   Tip: You can drag image to terminal or paste full path")
@@ -63,7 +125,7 @@ def analyze_meal_from_image(image_path: str, meal_type: str = "") -> dict:
         print_error("No image path provided")
         return {}
     
-    if not os.path.exists(image_path):
+    if not image_exists(image_path):
         print_error(f"Image does not exist: {image_path}")
         return {}
     
@@ -128,7 +190,7 @@ def analyze_meal_from_image(image_path: str, meal_type: str = "") -> dict:
     
     # Execute analysis
     try:
-        result = agent.analyze_meal(image_path, meal_type)
+        result = agent.analyze_meal(image_path, meal_type, on_event=on_event)
         
         # Calculate duration
         end_time = datetime.now()
@@ -141,7 +203,9 @@ def analyze_meal_from_image(image_path: str, meal_type: str = "") -> dict:
         print()
         
         # Extract and display results
-        if "messages" in result:
+        if "meal" in result:
+            print_meal_report(result)
+        elif "messages" in result:
             messages = result["messages"]
             if messages:
                 final_message = messages[-1]
@@ -183,8 +247,8 @@ def quick_query_history():
     
     print_progress("Initializing Agent...")
     try:
-        agent = NutritionAgent()
-        print_success("Agent initialized successfully!")
+        get_agent_pool().warm_up()  # no-op once the pool is built
+        print_success("Agent ready!")
         print()
     except Exception as e:
         print_error(f"Initialization failed: {str(e)}")
@@ -198,7 +262,8 @@ def quick_query_history():
     print()
     
     try:
-        result = agent.query_history(days)
+        with get_agent_pool().lease() as agent:
+            result = agent.query_history(days)
         
         print("="*70)
         print(f"📈 Recent {days} Days of Diet Records".center(70))
@@ -244,12 +309,13 @@ def main_menu():
         print_header()
         print_progress("Initializing Agent...")
         try:
-            agent = NutritionAgent()
-            print_success("Agent initialized successfully!")
+            get_agent_pool().warm_up()
+            print_success("Agent ready!")
             print()
             print_progress("Generating recommendations...")
             print()
-            result = agent.get_recommendation()
+            with get_agent_pool().lease() as agent:
+                result = agent.get_recommendation()
             
             print("="*70)
             print("💡 Next Meal Recommendation".center(70))
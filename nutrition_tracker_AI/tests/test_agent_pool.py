@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+测试进程级Agent池：启动时构建一次，并发请求复用
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+import pytest
+
+from agent import NutritionAgent
+from agent_pool import AgentPool
+
+
+class _Factory:
+    def __init__(self):
+        self.built = 0
+
+    def __call__(self):
+        self.built += 1
+        return object()
+
+
+def test_warm_up_builds_once():
+    """warm_up构建全部实例，重复调用和租借都不会再构建"""
+    factory = _Factory()
+    pool = AgentPool(size=3, factory=factory).warm_up().warm_up()
+    for _ in range(5):
+        with pool.lease():
+            pass
+    assert factory.built == 3
+    assert pool.stats() == {"size": 3, "built": 3, "idle": 3, "leases": 5}
+
+
+def test_concurrent_leases_never_share_an_agent():
+    """并发请求各自持有不同实例，池满时等待"""
+    pool = AgentPool(size=2, factory=_Factory())
+    in_use, overlaps = set(), []
+    lock = threading.Lock()
+
+    def worker():
+        with pool.lease() as agent:
+            with lock:
+                overlaps.append(id(agent) in in_use)
+                in_use.add(id(agent))
+            time.sleep(0.02)
+            with lock:
+                in_use.discard(id(agent))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not any(overlaps)
+    assert pool.stats()["built"] == 2
+
+
+def test_acquire_timeout_and_async_lease():
+    """池耗尽时超时报错；异步租借可用"""
+    pool = AgentPool(size=1, factory=_Factory())
+    agent = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.01)
+    pool.release(agent)
+
+    async def use():
+        async with pool.alease() as leased:
+            return leased
+    assert asyncio.run(use()) is agent
+
+
+def test_cancelled_async_lease_returns_the_agent():
+    """等待实例时被取消的异步租借：工作线程随后拿到的实例归还到池中，池不会永久变小"""
+    pool = AgentPool(size=1, factory=_Factory())
+    agent = pool.acquire()
+
+    async def cancel_waiting_lease():
+        async def use():
+            async with pool.alease(timeout=5):
+                pass
+        task = asyncio.ensure_future(use())
+        await asyncio.sleep(0.05)  # the acquire thread is now waiting for the busy agent
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        pool.release(agent)  # the abandoned acquire thread takes it...
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if pool.stats()["idle"] == 1:
+                break
+    asyncio.run(cancel_waiting_lease())
+    assert pool.stats()["idle"] == 1  # ...and gives it back
+    assert pool.acquire(timeout=0.1) is agent
+
+
+def test_failed_build_does_not_use_a_slot():
+    """构建失败不占用池容量"""
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError("DASHSCOPE_API_KEY is not configured")
+        return object()
+    pool = AgentPool(size=1, factory=flaky)
+    with pytest.raises(ValueError):
+        pool.acquire()
+    assert pool.acquire() is not None
+
+
+def test_real_agent_is_reused():
+    """真实NutritionAgent只构建一次"""
+    pool = AgentPool(size=1).warm_up()
+    with pool.lease() as first:
+        assert isinstance(first, NutritionAgent)
+    with pool.lease() as second:
+        assert second is first
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+测试agent_server：上传立即入队返回job_id，分析由后台工作线程执行，事件循环保持响应
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+import pytest
+from fastapi.testclient import TestClient
+
+import agent_server
+from agent_pool import AgentPool
+from job_queue import JobEventLog, JobQueue
+from tools import db_tools
+
+
+def _slow_analysis(seconds):
+    def process(job):
+        time.sleep(seconds)
+        return [{"name": job["payload"]["filename"], "request_id": job["id"], "bytes": len(job["image"])}]
+    return process
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """Returns a factory: server(handler, workers) -> TestClient with job workers running"""
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    events = JobEventLog()
+    monkeypatch.setattr(agent_server, "get_job_queue", lambda: queue)
+    monkeypatch.setattr(agent_server, "get_job_events", lambda: events)
+    monkeypatch.setattr(agent_server, "get_agent_pool", lambda: AgentPool(size=1, factory=object))
+    clients = []
+
+    def start(handler, workers=2):
+        monkeypatch.setattr(agent_server, "_process_job", handler)
+        monkeypatch.setattr(agent_server, "JOB_WORKERS", workers)
+        client = TestClient(agent_server.app)
+        client.__enter__()
+        clients.append(client)
+        return client
+    yield start
+    for client in clients:
+        client.__exit__(None, None, None)
+
+
+def _upload(client, name="meal.jpg", headers=None):
+    return client.post("/analyze", headers=headers or {}, files={"file": (name, b"fake-jpeg", "image/jpeg")})
+
+
+def _wait(client, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+
+def test_upload_returns_job_id_immediately(server):
+    """上传不等待分析完成：立即返回202和job_id，轮询得到结果"""
+    client = server(_slow_analysis(0.5))
+    started_at = time.perf_counter()
+    response = _upload(client)
+    assert time.perf_counter() - started_at < 0.3
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert response.headers["X-Request-ID"] == job_id
+    assert response.headers["Location"] == f"/jobs/{job_id}"
+
+    job = _wait(client, job_id)
+    assert job["status"] == "done"
+    assert job["result"] == [{"name": "meal.jpg", "request_id": job_id, "bytes": len(b"fake-jpeg")}]
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_workers_bound_concurrency_and_health_stays_responsive(server):
+    """工作线程数限制并发；分析进行中健康检查立即返回"""
+    client = server(_slow_analysis(0.3), workers=2)
+    job_ids = [_upload(client, f"meal{i}.jpg").json()["job_id"] for i in range(3)]
+    time.sleep(0.1)
+    started_at = time.perf_counter()
+    health = client.get("/health").json()
+    assert time.perf_counter() - started_at < 0.2
+    assert health["analyses_in_flight"] == 2
+    assert health["jobs"]["queued"] == 1
+    assert all(_wait(client, job_id)["status"] == "done" for job_id in job_ids)
+
+
+def test_failed_job_is_retried_with_its_request_id(server):
+    """失败的任务以原X-Request-ID重新提交后再次执行；非法ID被拒绝"""
+    attempts = []
+
+    def flaky(job):
+        attempts.append(job["id"])
+        if len(attempts) == 1:
+            raise RuntimeError("upstream down")
+        return [{"name": "ok"}]
+
+    client = server(flaky)
+    job = _wait(client, _upload(client, headers={"X-Request-ID": "req_retry_1"}).json()["job_id"])
+    assert job["status"] == "failed" and job["error"] == "upstream down"
+
+    response = _upload(client, headers={"X-Request-ID": "req_retry_1"})
+    assert response.json()["job_id"] == "req_retry_1"
+    assert _wait(client, "req_retry_1")["result"] == [{"name": "ok"}]
+    assert attempts == ["req_retry_1", "req_retry_1"]
+    assert _upload(client, headers={"X-Request-ID": "bad id!"}).status_code == 400
+
+
+def test_over_limit_uploads_are_rejected_with_retry_after(server):
+    """超过队列深度返回503、超过单用户并发返回429，均带Retry-After且不执行分析"""
+    release, ran = threading.Event(), []
+
+    def blocked(job):
+        ran.append(job["id"])
+        release.wait(5)
+        return []
+
+    client = server(blocked, workers=1)
+    queue = agent_server.get_job_queue()
+    queue.max_queued, queue.max_active_per_user = 2, 2
+    try:
+        alice = {"X-User-ID": "alice@example.com"}
+        assert _upload(client, headers=alice).status_code == 202
+        deadline = time.monotonic() + 5
+        while not ran and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert _upload(client, headers=alice).status_code == 202
+        busy = _upload(client, headers=alice)  # one running, one queued
+        assert busy.status_code == 429 and int(busy.headers["Retry-After"]) >= 1
+
+        assert _upload(client, headers={"X-User-ID": "bob@example.com"}).status_code == 202
+        full = _upload(client)  # two queued
+        assert full.status_code == 503 and int(full.headers["Retry-After"]) >= 1
+        assert queue.counts()["queued"] == 2
+        assert client.get("/health").json()["limits"] == {"max_queued": 2, "max_active_per_user": 2}
+    finally:
+        release.set()
+    assert len(ran) <= 3
+
+
+def test_metrics_report_queue_depth_and_in_flight(server):
+    """/metrics以Prometheus文本格式输出队列深度、进行中的分析和各类延迟直方图"""
+    release = threading.Event()
+    client = server(lambda job: release.wait(5), workers=1)
+    try:
+        for _ in range(3):
+            _upload(client)
+        deadline = time.monotonic() + 5
+        while agent_server.get_job_queue().counts()["running"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        response = client.get("/metrics")
+    finally:
+        release.set()
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert 'nutrition_jobs{status="queued"} 2' in lines
+    assert "nutrition_analyses_in_flight 1" in lines
+    assert "# TYPE nutrition_pipeline_step_duration_seconds histogram" in lines
+    assert "# TYPE nutrition_db_save_duration_seconds histogram" in lines
+    assert any(line.startswith("nutrition_llm_cache_hit_ratio ") for line in lines)
+
+
+def _read_events(client, job_id, headers=None):
+    """(SSE id, event) for each event of a job's stream"""
+    received = []
+    with client.stream("GET", f"/jobs/{job_id}/events", headers=headers or {}) as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        seq = None
+        for line in response.iter_lines():
+            if line.startswith("id: "):
+                seq = int(line[4:])
+            elif line.startswith("data: "):
+                received.append((seq, json.loads(line[6:])))
+                seq = None
+    return received
+
+
+def test_job_events_stream_in_step_order(server):
+    """SSE按步骤完成顺序推送事件并以done结束；断线后按Last-Event-ID续传"""
+    def staged(job):
+        events = agent_server.get_job_events()
+        events.publish(job["id"], {"event": "dishes_detected", "data": {"dishes": [{"name": "Rice"}]}})
+        time.sleep(0.4)
+        events.publish(job["id"], {"event": "saved", "data": {"meal_id": "meal_1"}})
+        return [{"name": "Rice"}]
+
+    client = server(staged)
+    job_id = _upload(client).json()["job_id"]
+    received = _read_events(client, job_id)
+    assert [event["event"] for _, event in received] == ["started", "dishes_detected", "saved", "done"]
+    assert received[-1][1]["data"]["result"] == [{"name": "Rice"}]
+
+    replay = _read_events(client, job_id, headers={"Last-Event-ID": str(received[1][0])})
+    assert [event["event"] for _, event in replay] == ["saved", "done"]
+    assert client.get("/jobs/unknown/events").status_code == 404
+
+
+def test_finished_job_without_events_reports_stored_status(server, monkeypatch):
+    """事件已不在内存中（如服务重启后）时，流直接给出任务的最终状态"""
+    client = server(_slow_analysis(0))
+    job_id = _upload(client).json()["job_id"]
+    assert _wait(client, job_id)["status"] == "done"
+    monkeypatch.setattr(agent_server, "get_job_events", lambda: JobEventLog())
+    received = _read_events(client, job_id)
+    assert [event["event"] for _, event in received] == ["done"]
+    assert received[0][1]["data"]["result"][0]["request_id"] == job_id
+
+
+def test_event_stream_forwards_each_event_when_published(server):
+    """事件发布后立即推送，不等待任务结束"""
+    server(_slow_analysis(0))
+    events = agent_server.get_job_events()
+
+    def worker():
+        events.publish("job_live", {"event": "dishes_detected", "data": {}})
+        time.sleep(0.4)
+        events.publish("job_live", {"event": "done", "data": {"result": []}})
+
+    async def consume():
+        started_at = time.perf_counter()
+        threading.Thread(target=worker).start()
+        return [(time.perf_counter() - started_at, chunk)
+                async for chunk in agent_server._job_event_stream("job_live", 0)]
+
+    received = asyncio.run(consume())
+    assert len(received) == 2
+    assert received[0][0] < 0.1 and "event: dishes_detected" in received[0][1]
+    assert received[1][0] >= 0.4 and received[1][1].startswith("id: 2\n")
+
+
+def test_response_is_built_from_the_runs_own_meal(monkeypatch):
+    """结果来自本次运行保存的餐食（按meal_id对应），不重新读取数据库"""
+    def analyze(image_path, meal_type, request_id=None, on_event=None):
+        dish = {"name": f"dish of {request_id}",
+                "nutrition_total": {"calories": 100, "carbs": 10, "protein": 5, "fat": 2}}
+        return {"meal": {"meal_id": f"meal_{request_id}", "dishes": [dish]}, "meal_id": f"meal_{request_id}"}
+
+    monkeypatch.setattr(agent_server, "analyze_meal_from_image", analyze)
+    assert agent_server._analyze_image(b"img", "meal.jpg", "Lunch", "req_a") == {
+        "meal_id": "meal_req_a",
+        "dishes": [{"name": "dish of req_a", "calories": 100, "carbs": 10, "protein": 5, "fats": 2}]
+    }
+
+    monkeypatch.setattr(agent_server, "analyze_meal_from_image", lambda *args, **kwargs: {"error": "vision down"})
+    with pytest.raises(RuntimeError, match="vision down"):
+        agent_server._analyze_image(b"img", "meal.jpg", "Lunch", "req_b")
+
+
+def test_batch_upload_runs_as_one_job(server, monkeypatch):
+    """批量上传作为一个任务执行：图片按上传顺序拆分，逐张返回结果或错误"""
+    from tools.images import read_image
+
+    def fake_batch(images, request_id, on_event=None):
+        results = []
+        for image_path, meal_type in images:
+            data = read_image(image_path)
+            if data == b"broken":
+                results.append({"error": "vision down"})
+                continue
+            dish = {"name": data.decode(), "nutrition_total": {"calories": 1, "carbs": 2, "protein": 3, "fat": 4}}
+            results.append({"meal": {"meal_id": f"meal_{len(results)}", "dishes": [dish]}})
+        return results
+
+    monkeypatch.setattr(agent_server, "analyze_batch", fake_batch)
+    client = server(agent_server._process_job)
+    files = [("files", (f"plate{i}.jpg", content, "image/jpeg")) for i, content in enumerate([b"rice", b"broken", b"soup"])]
+    response = client.post("/analyze/batch", files=files)
+    assert response.status_code == 202 and response.json()["images"] == 3
+    job = _wait(client, response.json()["job_id"])
+    assert job["status"] == "done"
+    assert [r.get("meal_id") or r["error"] for r in job["result"]["results"]] == ["meal_0", "vision down", "meal_2"]
+    assert job["result"]["results"][2]["dishes"][0]["name"] == "soup"
+
+    monkeypatch.setattr(agent_server, "BATCH_MAX_IMAGES", 2)
+    assert client.post("/analyze/batch", files=files).status_code == 400
+
+
+def _day(date, calories, meal_ids):
+    return {"date": date,
+            "daily_summary": {"total_calories": calories, "total_protein": 30, "total_fat": 20, "total_carbs": 90,
+                              "total_sodium": 800, "daily_score": 80},
+            "meals": [{"meal_id": meal_id, "meal_type": "Lunch", "timestamp": f"{date}T12:00:00",
+                       "meal_nutrition_total": {"calories": calories}, "scores": {"current_meal_score": 80},
+                       "dishes": [{"name": "rice"}]} for meal_id in meal_ids]}
+
+
+def test_history_endpoints_revalidate_with_etag(server, tmp_path, monkeypatch):
+    """历史查询接口读取缓存视图；ETag/Last-Modified不变时返回304，数据库写入后返回新数据"""
+    today = datetime.now().date()
+    old, recent = str(today - timedelta(days=10)), str(today - timedelta(days=1))
+    db_path = tmp_path / "meals.json"
+    db_path.write_text(json.dumps({"user_id": "u", "days": [_day(old, 1500, ["m1"]), _day(recent, 2000, ["m2", "m3"])]}))
+    monkeypatch.setattr(db_tools, "DB_PATH", str(db_path))
+    client = server(_slow_analysis(0))
+
+    response = client.get("/days")
+    assert response.status_code == 200
+    assert [(day["date"], day["meals"]) for day in response.json()["days"]] == [(old, 1), (recent, 2)]
+    etag, modified = response.headers["ETag"], response.headers["Last-Modified"]
+    assert client.get("/days", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/days", headers={"If-Modified-Since": modified}).status_code == 304
+    assert db_tools.load_db_view() is db_tools.load_db_view()  # unchanged file: not parsed again
+
+    summary = client.get(f"/days/{recent}/summary").json()
+    assert [meal["meal_id"] for meal in summary["meals"]] == ["m2", "m3"]
+    assert "dishes" not in summary["meals"][0] and summary["daily_summary"]["total_calories"] == 2000
+    assert client.get(f"/days/{today}/summary").status_code == 404
+    assert client.get("/days/yesterday/summary").status_code == 400
+
+    trend = client.get("/trend", params={"days": 7})
+    assert [day["date"] for day in trend.json()["series"]] == [recent]
+    assert trend.json()["daily_average"]["total_calories"] == 2000
+    assert client.get("/trend", params={"days": 30}).json()["daily_average"]["total_calories"] == 1750
+    assert client.get("/trend", params={"days": 7}, headers={"If-None-Match": trend.headers["ETag"]}).status_code == 304
+    assert client.get("/trend", params={"days": 0}).status_code == 422
+
+    db_tools.save_meal_records([{"meal_type": "Dinner", "dishes": [{"name": "soup"}],
+                                 "meal_nutrition_total": {"calories": 300}}])
+    response = client.get("/days", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+    assert response.json()["days"][-1]["date"] == str(today)
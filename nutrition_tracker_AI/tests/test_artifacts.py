@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试工具结果句柄（artifact://）：agent模式下工具之间只传递短句柄
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+import pytest
+
+from tools import artifacts, db_tools
+from tools.artifacts import ArtifactStore, artifact_handles, expand_artifacts, publish_artifact, resolve_artifact
+from tools.compute_tools import compute_meal_nutrition
+
+NUTRITION = {"calories": 150, "protein": 5, "fat": 2, "carbs": 30, "sodium": 100}
+
+
+def _dishes(count):
+    return {
+        "image_path": "/tmp/meal.jpg",
+        "dishes": [
+            {"dish_id": f"dish_{i}", "name": f"Dish {i}", "final_weight_g": 100, "nutrition_per_100g": NUTRITION,
+             "reason": "a long explanation of the estimate " * 5}
+            for i in range(count)
+        ]
+    }
+
+
+def test_publish_outside_scope_returns_json():
+    """流水线/非agent调用保持原有JSON输出"""
+    content = json.dumps(_dishes(2))
+    assert publish_artifact("portion", content) == content
+    assert resolve_artifact(content) == content
+
+
+def test_handles_stay_small_as_dishes_grow():
+    """句柄大小与菜品数量无关，并能还原完整结果"""
+    sizes = []
+    with artifact_handles("req_test") as request_id:
+        for count in (1, 20):
+            content = json.dumps(_dishes(count))
+            summary = publish_artifact("portion", content)
+            assert json.loads(summary)["artifact"] == f"artifact://{request_id}/portion"
+            assert resolve_artifact(summary) == content
+            assert resolve_artifact(json.loads(summary)["artifact"]) == content
+            sizes.append(len(summary))
+    assert sizes[1] - sizes[0] <= 1  # only dish_count grows
+    with pytest.raises(KeyError):
+        resolve_artifact("artifact://req_test/portion")  # released when the scope ends
+
+
+def test_errors_pass_through():
+    """错误结果直接返回给agent"""
+    error = json.dumps({"dishes": [], "error": "Dish list is empty"})
+    with artifact_handles():
+        assert publish_artifact("portion", error) == error
+
+
+def test_compute_and_save_by_handle(tmp_path, monkeypatch):
+    """compute与save_meal直接接收句柄；记录字段覆盖句柄内容"""
+    monkeypatch.setattr(db_tools, "DB_PATH", str(tmp_path / "meals.json"))
+    with artifact_handles():
+        nutrition = publish_artifact("nutrition", json.dumps(_dishes(3)))
+        summary = json.loads(compute_meal_nutrition.invoke({"portion_result": nutrition}))
+        assert summary["dish_count"] == 3
+        assert summary["meal_nutrition_total"]["calories"] == 450
+        record = expand_artifacts({"compute_result": summary["artifact"], "meal_type": "Dinner"})
+        assert record["meal_type"] == "Dinner" and len(record["dishes"]) == 3
+        with db_tools.recording_saved_meals() as recorded:
+            message = db_tools.save_meal.invoke({"meal_data": json.dumps({**summary, "meal_type": "Dinner"})})
+    assert "meal_" in message
+    with open(db_tools.DB_PATH, encoding="utf-8") as f:
+        saved = json.load(f)["days"][-1]["meals"][-1]
+    assert saved["meal_type"] == "Dinner"
+    assert len(saved["dishes"]) == 3
+    # agent mode reports the saved record from the run itself
+    assert [meal["meal_id"] for meal in recorded] == [saved["meal_id"]]
+
+
+def test_store_evicts_oldest_request():
+    """存储按请求数量上限淘汰最早的请求"""
+    store = ArtifactStore(max_requests=2)
+    first = store.put("req_1", "vision", "{}")
+    store.put("req_2", "vision", "{}")
+    store.put("req_3", "vision", "{}")
+    assert len(store) == 2
+    with pytest.raises(KeyError):
+        store.get(first)
+
+
+@pytest.mark.parametrize("enabled", ["true", "false"])
+def test_system_prompt_mentions_handles_only_when_enabled(enabled):
+    """关闭AGENT_ARTIFACT_HANDLES时，系统提示词不再提及artifact://句柄"""
+    code = "from config.settings import AGENT_SYSTEM_PROMPT; print('artifact://' in AGENT_SYSTEM_PROMPT)"
+    env = dict(os.environ, AGENT_ARTIFACT_HANDLES=enabled)
+    output = subprocess.run([sys.executable, "-c", code], cwd=os.path.join(ROOT, "ai_nutrition_agent"), env=env,
+                            capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == str(enabled == "true")
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+测试工具的异步实现（ainvoke），不调用真实API
+"""
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+from tools import nutrition_tools, portion_tools, recommendation_tools, meal_type_tools
+
+
+def test_portion_ainvoke(monkeypatch):
+    """异步份量校验合并模型结果"""
+    async def fake_achat(tool_name, model, messages, temperature, **kwargs):
+        assert tool_name == "check_and_refine_portions"
+        return '```json\n[{"dish_id": "dish_1", "is_reasonable": false, "reason": "too small", "final_weight_g": 180}]\n```'
+
+    monkeypatch.setattr(portion_tools, "achat_completion", fake_achat)
+    vision_result = json.dumps({
+        "dishes": [{"dish_id": "dish_1", "name": "白米饭", "category": "主食", "estimated_weight_g": 20}],
+        "image_path": "/test/image.png"
+    }, ensure_ascii=False)
+
+    result = json.loads(asyncio.run(
+        portion_tools.check_and_refine_portions.ainvoke({"vision_result": vision_result})
+    ))
+    assert result["dishes"][0]["final_weight_g"] == 180
+    assert result["dishes"][0]["is_reasonable"] is False
+
+
+def test_add_nutrition_runs_concurrently(monkeypatch):
+    """异步营养查询并发执行"""
+    in_flight = 0
+    peak = 0
+
+    async def fake_achat(tool_name, model, messages, temperature, **kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return '{"calories": 100, "protein": 5, "fat": 3, "carbs": 12, "sodium": 80}'
+
+    monkeypatch.setattr(nutrition_tools, "achat_completion", fake_achat)
+    portion_result = json.dumps({
+        "dishes": [{"dish_id": f"dish_{i}", "name": f"菜{i}", "final_weight_g": 100} for i in range(4)],
+        "image_path": ""
+    }, ensure_ascii=False)
+
+    result = json.loads(asyncio.run(
+        nutrition_tools.add_nutrition_to_dishes.ainvoke({"portion_result": portion_result})
+    ))
+    assert peak == 4
+    assert all(d["nutrition_per_100g"]["calories"] == 100.0 for d in result["dishes"])
+
+
+def test_score_ainvoke_fallback(monkeypatch):
+    """异步评分失败时返回原有默认值"""
+    async def failing_achat(*args, **kwargs):
+        raise TimeoutError("upstream timeout")
+
+    monkeypatch.setattr(recommendation_tools, "achat_completion", failing_achat)
+    result = asyncio.run(recommendation_tools.score_current_meal_llm.ainvoke({"nutrition": {"calories": 500.0}}))
+    assert result["score"] == 70
+
+
+def test_meal_type_ainvoke(monkeypatch):
+    """有足够历史时异步调用LLM推断餐次"""
+    async def fake_achat(*args, **kwargs):
+        return "Brunch"
+
+    monkeypatch.setattr(meal_type_tools, "achat_completion", fake_achat)
+    history = [{"date": f"2025-12-0{i}", "meals": []} for i in range(5, 8)]
+    result = asyncio.run(meal_type_tools.infer_meal_type.ainvoke({
+        "timestamp": "2025-12-08T11:15:00",
+        "recent_meals": history
+    }))
+    assert result == "Brunch"
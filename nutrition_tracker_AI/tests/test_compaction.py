@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+测试agent上下文压缩：已被消费的大型工具结果在后续编排调用中被摘要
+"""
+import json
+import os
+import sys
+from typing import Any, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import tool
+from langgraph.prebuilt import create_react_agent
+
+import compaction
+from compaction import compact_messages, compaction_hook, message_tokens, summarize_tool_result
+
+
+def _history(days: int) -> str:
+    meal = {"meal_type": "Lunch", "dishes": [{"name": f"Dish {i}", "nutrition_total": {"calories": 100}}
+                                             for i in range(4)]}
+    return json.dumps({
+        "recent_days": [{"date": f"2025-01-{d + 1:02d}", "meals": [meal] * 3} for d in range(days)],
+        "total_meals": days * 3,
+        "weekly_trend": {"calories_avg": 650.0, "protein_avg": 25.0},
+        "days_included": days
+    })
+
+
+def _conversation(history: str) -> List[Any]:
+    call = {"name": "load_recent_meals", "args": {"days": 7}, "id": "call_1", "type": "tool_call"}
+    return [
+        HumanMessage("Analyze my week"),
+        AIMessage("", tool_calls=[call]),
+        ToolMessage(history, tool_call_id="call_1"),
+        AIMessage("", tool_calls=[{**call, "id": "call_2"}]),
+        ToolMessage(history, tool_call_id="call_2"),
+    ]
+
+
+def test_summary_keeps_trend_and_drops_dishes():
+    """JSON摘要保留趋势统计，菜品列表只保留数量"""
+    summary = summarize_tool_result(_history(7), max_tokens=100)
+    assert "calories_avg" in summary and "650.0" in summary
+    assert "<7 items omitted>" in summary
+    assert "Dish 0" not in summary
+    assert summarize_tool_result("short") == "short"
+
+
+def test_only_consumed_results_are_compacted():
+    """仅压缩已被后续AI消息消费的工具结果；最新结果完整保留"""
+    messages = _conversation(_history(7))
+    compacted = compact_messages(messages, budget=500, max_tool_tokens=100)
+    assert compacted[2].content.startswith("[compacted tool result")
+    assert compacted[2].tool_call_id == "call_1"
+    assert compacted[4] is messages[4]
+    assert messages[2].content == _history(7)  # the state's messages are not modified
+
+
+def test_under_budget_is_untouched():
+    """未超预算时原样返回"""
+    messages = _conversation(_history(1))
+    assert compact_messages(messages, budget=10**6) is messages
+
+
+def test_context_stays_flat_as_history_grows():
+    """历史越长，压缩后的上下文规模基本不变"""
+    sizes = []
+    for days in (7, 30):
+        compacted = compact_messages(_conversation(_history(days)) + [AIMessage("done")], budget=500,
+                                     max_tool_tokens=100)
+        sizes.append(sum(message_tokens(m) for m in compacted))
+    assert abs(sizes[1] - sizes[0]) < 10
+
+
+class _ScriptedModel(BaseChatModel):
+    """Calls load_recent_meals once, then answers; records what each call was sent"""
+    seen: List[List[Any]] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.seen.append(list(messages))
+        if len(self.seen) == 1:
+            message = AIMessage("", tool_calls=[{"name": "load_recent_meals", "args": {}, "id": "call_1"}])
+        elif len(self.seen) == 2:
+            message = AIMessage("", tool_calls=[{"name": "load_recent_meals", "args": {}, "id": "call_2"}])
+        else:
+            message = AIMessage("Your week looks balanced.")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def test_agent_graph_uses_compacted_context(monkeypatch):
+    """agent图在后续编排调用中发送压缩后的历史，最终状态保留完整消息"""
+    monkeypatch.setattr(compaction, "AGENT_CONTEXT_TOKEN_BUDGET", 1000)
+    monkeypatch.setattr(compaction, "AGENT_TOOL_RESULT_MAX_TOKENS", 100)
+
+    @tool
+    def load_recent_meals() -> str:
+        """Load recent meals"""
+        return _history(30)
+
+    model = _ScriptedModel(seen=[])
+    graph = create_react_agent(model=model, tools=[load_recent_meals], pre_model_hook=compaction_hook)
+    result = graph.invoke({"messages": [("user", "How was my week?")]})
+
+    third_call = model.seen[2]
+    tool_messages = [m for m in third_call if isinstance(m, ToolMessage)]
+    assert tool_messages[0].content.startswith("[compacted tool result")
+    assert len(tool_messages[1].content) == len(_history(30))  # latest result not yet consumed by a reply
+    assert [m.content for m in result["messages"] if isinstance(m, ToolMessage)] == [_history(30)] * 2
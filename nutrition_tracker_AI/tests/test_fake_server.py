@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+测试本地假Qwen服务：按提示词类型返回、错误注入与token统计
+"""
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "ai_nutrition_agent"))
+
+import pytest
+from fastapi.testclient import TestClient
+from openai import OpenAI, RateLimitError
+
+import fake_qwen_server
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "latency_dist", "fixed")
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "latency_ms", 0)
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "error_rate", 0)
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "rate_limit_rate", 0)
+    return TestClient(fake_qwen_server.app)
+
+
+def _openai(client):
+    return OpenAI(api_key="fake-key", base_url="http://testserver/compatible-mode/v1",
+                  http_client=client, max_retries=0)
+
+
+def test_portion_echoes_dishes(client):
+    """份量校验按输入dish_id返回"""
+    dishes = [{"dish_id": "dish_1", "name": "米饭", "estimated_weight_g": 210}]
+    response = _openai(client).chat.completions.create(
+        model="qwen-plus",
+        messages=[
+            {"role": "system", "content": "You are an expert in food weight estimation verification."},
+            {"role": "user", "content": json.dumps(dishes, ensure_ascii=False)}
+        ]
+    )
+    content = response.choices[0].message.content
+    assert '"dish_id": "dish_1"' in content
+    assert '"final_weight_g": 210' in content
+    assert response.usage.prompt_tokens > 0 and response.usage.completion_tokens > 0
+
+
+def test_vision_prompt_type(client):
+    """带图片的请求识别为vision"""
+    body = {"messages": [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:,"}}]}]}
+    assert fake_qwen_server.classify_prompt(body) == "vision"
+    usage = fake_qwen_server.count_tokens(body, "[]")
+    assert usage["prompt_tokens"] == fake_qwen_server.CONFIG["image_tokens"]
+
+
+def test_rate_limit_injection(client, monkeypatch):
+    """注入429并带Retry-After"""
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "rate_limit_rate", 1.0)
+    raw = client.post("/chat/completions", json={"model": "qwen-plus", "messages": []})
+    assert raw.status_code == 429
+    assert raw.headers["Retry-After"] == str(fake_qwen_server.CONFIG["retry_after_s"])
+    with pytest.raises(RateLimitError):
+        _openai(client).chat.completions.create(model="qwen-plus", messages=[{"role": "user", "content": "hi"}])
+
+
+def test_latency_distributions(monkeypatch):
+    """各种延迟分布均返回非负秒数"""
+    for dist in ("fixed", "uniform", "normal", "lognormal"):
+        monkeypatch.setitem(fake_qwen_server.CONFIG, "latency_dist", dist)
+        assert all(fake_qwen_server.sample_latency("score") >= 0 for _ in range(20))
+
+
+def test_stream_response(client):
+    """流式返回可拼接出完整内容"""
+    stream = _openai(client).chat.completions.create(
+        model="qwen-plus",
+        messages=[{"role": "system", "content": "You are a professional nutritionist."}],
+        stream=True
+    )
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+    assert '"score": 78' in text
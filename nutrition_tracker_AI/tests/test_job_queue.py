@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+测试持久化任务队列：提交/领取/完成、租约过期恢复、最大尝试次数、重启后继续、准入控制
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+import pytest
+
+from job_queue import JobQueue, JobWorkers, QueueFull, UserBusy
+
+
+def test_submit_claim_complete(tmp_path):
+    """按提交顺序领取；完成后保存结果并丢弃图片"""
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    first = queue.submit({"meal_type": "Lunch"}, b"img1")
+    second = queue.submit({"meal_type": "Dinner"}, b"img2", job_id="req_2")
+    assert second == "req_2"
+    assert queue.get(first)["status"] == "queued"
+
+    job = queue.claim()
+    assert job == {"id": first, "payload": {"meal_type": "Lunch"}, "image": b"img1", "attempt": 1,
+                   "lease": job["lease"]}
+    assert queue.get(first)["status"] == "running"
+    assert queue.complete(first, job["lease"], [{"name": "rice"}])
+    done = queue.get(first)
+    assert done["status"] == "done" and done["result"] == [{"name": "rice"}] and done["finished_at"]
+
+    assert queue.claim()["id"] == "req_2"
+    assert queue.claim() is None
+    assert queue.counts() == {"queued": 0, "running": 1, "done": 1, "failed": 0}
+
+
+def test_expired_lease_is_reclaimed_until_max_attempts(tmp_path):
+    """工作线程中断后租约过期，任务被重新领取；超过最大尝试次数则标记失败"""
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=0.05, max_attempts=2)
+    job_id = queue.submit({}, b"img")
+    assert queue.claim()["attempt"] == 1
+    assert queue.claim() is None  # lease still held
+    time.sleep(0.1)
+    assert queue.claim()["attempt"] == 2
+    time.sleep(0.1)
+    assert queue.claim() is None
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and "2 attempts" in job["error"]
+
+
+def test_worker_that_lost_its_lease_cannot_finish_the_job(tmp_path):
+    """租约过期后任务被其他工作线程领取：原工作线程的结果被丢弃，不覆盖新的结果或状态"""
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=0.05)
+    job_id = queue.submit({}, b"img")
+    slow = queue.claim()
+    time.sleep(0.1)
+    fast = queue.claim()
+    assert fast["id"] == job_id and fast["lease"] != slow["lease"]
+
+    assert not queue.complete(job_id, slow["lease"], "stale")
+    assert not queue.fail(job_id, slow["lease"], "timed out")
+    assert queue.get(job_id)["status"] == "running"
+    assert queue.complete(job_id, fast["lease"], "fresh")
+    assert not queue.fail(job_id, fast["lease"], "late error")  # finished jobs stay finished
+    assert queue.get(job_id)["result"] == "fresh"
+
+
+def test_heartbeat_keeps_a_slow_job_from_running_twice(tmp_path):
+    """运行中的任务定期续租：超过初始租约的慢任务不会被其他工作线程重新领取"""
+    path = str(tmp_path / "jobs.sqlite3")
+    queue = JobQueue(path, lease_seconds=0.1)
+    job_id = queue.submit({})
+    runs = []
+
+    def slow(job):
+        runs.append(job["attempt"])
+        time.sleep(0.4)
+        return "ok"
+    workers = JobWorkers(queue, slow, count=1, poll_interval=0.02, heartbeat_interval=0.02).start()
+    other = JobQueue(path, lease_seconds=0.1)
+    try:
+        deadline = time.monotonic() + 5
+        while not runs and time.monotonic() < deadline:
+            time.sleep(0.01)
+        while queue.get(job_id)["status"] != "done" and time.monotonic() < deadline:
+            assert other.claim() is None  # the lease never lapses while the job runs
+            time.sleep(0.02)
+    finally:
+        workers.stop(timeout=2)
+    assert runs == [1] and queue.get(job_id)["result"] == "ok"
+
+
+def test_job_lease_can_be_longer_than_the_default(tmp_path):
+    """批量任务按图片数申请更长的租约"""
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=0.05)
+    queue.submit({}, job_id="batch", lease_seconds=10)
+    job = queue.claim()
+    time.sleep(0.1)
+    assert queue.claim() is None
+    assert queue.renew("batch", job["lease"]) and not queue.renew("batch", "someone-else")
+
+
+def test_jobs_survive_restart_and_workers_drain_them(tmp_path):
+    """进程重启后未完成的任务仍在队列中，由新的工作线程执行"""
+    path = str(tmp_path / "jobs.sqlite3")
+    job_ids = [JobQueue(path).submit({"n": i}) for i in range(3)]
+
+    queue = JobQueue(path)
+    workers = JobWorkers(queue, lambda job: job["payload"]["n"] * 10, count=2, poll_interval=0.05).start()
+    try:
+        deadline = time.monotonic() + 5
+        while queue.counts()["done"] < 3 and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        workers.stop(timeout=2)
+    assert [queue.get(job_id)["result"] for job_id in job_ids] == [0, 10, 20]
+
+
+def test_admission_limits_queue_depth_and_per_user_jobs(tmp_path):
+    """队列已满或用户未完成任务达到上限时立即拒绝，并给出Retry-After；重复提交同一任务不受限制"""
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), max_queued=3, max_active_per_user=2, workers=1)
+    queue.submit({}, job_id="a1", user="alice")
+    queue.submit({}, job_id="a2", user="alice")
+    with pytest.raises(UserBusy) as busy:
+        queue.submit({}, user="alice")
+    assert busy.value.status_code == 429 and busy.value.retry_after == 30
+    assert queue.submit({}, job_id="a1", user="alice") == "a1"  # already queued: no-op, not rejected
+
+    queue.submit({}, job_id="b1", user="bob")
+    with pytest.raises(QueueFull) as full:
+        queue.submit({}, user="carol")
+    assert full.value.status_code == 503 and full.value.retry_after >= 1
+    assert queue.counts()["queued"] == 3
+
+    # A finished job frees its user's slot and the queue position; Retry-After follows job durations
+    job = queue.claim()
+    queue.complete(job["id"], job["lease"], None)
+    queue.submit({}, job_id="a3", user="alice")
+    with pytest.raises(QueueFull) as full:
+        queue.submit({})
+    assert full.value.retry_after == 1  # the finished job took well under a second
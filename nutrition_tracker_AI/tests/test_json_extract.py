@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试共享JSON提取器与流式增量解析
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+import pytest
+from fastapi.testclient import TestClient
+from openai import OpenAI
+from pydantic import ValidationError
+
+import fake_qwen_server
+from llm import calls as llm_calls
+from llm import cache as llm_cache
+from llm.json_extract import extract_json, JSONStreamParser, iter_json_items
+from schemas.tool_schema import DishDetectionOutput, ScoreOutput
+
+DISH = '{"name": "Rice", "category": "Staple", "estimated_weight_g": 180, "portion_level": "medium", "reason": "bowl"}'
+
+
+@pytest.mark.parametrize("content", [
+    '{"score": 80, "advice": "ok"}',
+    'Here is the result:\n```json\n{"score": 80, "advice": "ok"}\n```\nHope this helps!',
+    'Note [1]: see below.\n{"score": 80, "advice": "use {braces} \\"carefully\\""}\ntrailing }',
+    '```\nplain fence\n```\n```json\n{"score": 80, "advice": "ok"}\n```',
+])
+def test_extracts_first_balanced_value(content):
+    """前言、尾随文字、多个代码块都能处理"""
+    assert extract_json(content, ScoreOutput)["score"] == 80
+
+
+@pytest.mark.parametrize("content", [
+    'Sure { the answer: {"score": 80, "advice": "ok"}',
+    '[ {"score": 80, "advice": "ok"} } trailing',
+    '{not json} then {"score": 80, "advice": "ok"}',
+])
+def test_recovers_values_inside_unclosed_or_invalid_brackets(content):
+    """未闭合或错配的括号内的完整值仍能找到"""
+    assert extract_json(content, ScoreOutput)["score"] == 80
+
+
+def test_noisy_output_is_scanned_in_one_pass():
+    """大量不平衡括号的长文本线性扫描，不会逐字符重新扫描"""
+    answer = '{"score": 80, "advice": "ok"}'
+    for noise in ("{[" * 20000, "{ x ] " * 20000, "[" + "{a} " * 20000):
+        started_at = time.perf_counter()
+        assert extract_json(noise + answer, ScoreOutput)["score"] == 80
+        assert time.perf_counter() - started_at < 1
+
+
+def test_schema_validation_keeps_extra_keys():
+    """校验通过时保留额外字段，不通过时抛错"""
+    dishes = extract_json(f'[{DISH}]', DishDetectionOutput)
+    assert dishes[0]["estimated_weight_g"] == 180.0
+    assert extract_json(f'{{"items": [{DISH}]}}', DishDetectionOutput) == dishes  # json_schema array wrapper
+    assert extract_json('{"score": 80, "advice": "ok", "note": "x"}', ScoreOutput)["note"] == "x"
+    with pytest.raises(ValidationError):
+        extract_json('{"score": 180, "advice": "ok"}', ScoreOutput)
+    with pytest.raises(ValueError):
+        extract_json("no json here")
+
+
+def test_stream_parser_emits_items_early():
+    """数组元素闭合即输出，无需等待整个流"""
+    text = f'Sure!\n```json\n[{DISH}, {DISH.replace("Rice", "Soup")}]\n```'
+    parser = JSONStreamParser(DishDetectionOutput)
+    first_close = text.index("}") + 1
+    assert parser.feed(text[:first_close - 1]) == []
+    items = parser.feed(text[first_close - 1:first_close + 3])
+    assert [item["name"] for item in items] == ["Rice"]
+    assert [item["name"] for item in parser.feed(text[first_close + 3:])] == ["Soup"]
+    assert len(parser.close()) == 2
+
+
+def test_iter_json_items_skips_prose_brackets():
+    """散文中的方括号不会干扰解析"""
+    chunks = ["See [", "ref]. ", f"[{DISH[:20]}", f"{DISH[20:]}]"]
+    assert [item["name"] for item in iter_json_items(chunks, DishDetectionOutput)] == ["Rice"]
+
+
+def test_stream_chat_completion_against_fake_server(tmp_path, monkeypatch):
+    """流式调用拼接出完整内容并记录缓存"""
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "latency_ms", 0)
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "latency_dist", "fixed")
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "error_rate", 0)
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "rate_limit_rate", 0)
+    client = OpenAI(api_key="fake-key", base_url="http://testserver/compatible-mode/v1",
+                    http_client=TestClient(fake_qwen_server.app), max_retries=0)
+    cache = llm_cache.ResponseCache(str(tmp_path), ttl_by_tool={"score_current_meal_llm": 60})
+    monkeypatch.setattr(llm_calls, "get_client", lambda: client)
+    monkeypatch.setattr(llm_calls, "get_response_cache", lambda: cache)
+
+    messages = [{"role": "system", "content": "You are a professional nutritionist."}]
+    chunks = list(llm_calls.stream_chat_completion("score_current_meal_llm", "qwen-plus", messages, temperature=0.3))
+    assert len(chunks) > 1
+    assert extract_json("".join(chunks), ScoreOutput)["score"] == 78
+    assert cache.stats()["memory_entries"] == 1
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+测试LLM响应缓存：内存LRU、磁盘后端、TTL与绕过开关
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+from llm import cache as llm_cache
+from llm import calls as llm_calls
+
+MESSAGES = [{"role": "user", "content": "{\"calories\": 500}"}]
+
+
+def _fake_client(counter):
+    def create(**kwargs):
+        counter.append(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='{"score": 80, "advice": "ok"}'))])
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_key_is_content_addressed():
+    """相同输入得到相同key，温度或版本变化则不同"""
+    key = llm_cache.make_cache_key("qwen-plus", "v1", MESSAGES, 0.3)
+    assert key == llm_cache.make_cache_key("qwen-plus", "v1", list(MESSAGES), 0.3)
+    assert key != llm_cache.make_cache_key("qwen-plus", "v1", MESSAGES, 0.5)
+    assert key != llm_cache.make_cache_key("qwen-plus", "v2", MESSAGES, 0.3)
+
+
+def test_disk_backend_and_lru(tmp_path):
+    """内存淘汰后仍可从磁盘读取"""
+    cache = llm_cache.ResponseCache(str(tmp_path), max_memory_entries=1, ttl_by_tool={"t": 60})
+    cache.set("a" * 64, "first", "t")
+    cache.set("b" * 64, "second", "t")
+    assert len(cache._memory) == 1
+    assert cache.get("a" * 64, "t") == "first"
+    assert cache.stats()["hits"] == 1
+
+
+def test_ttl_expiry(tmp_path):
+    """超过TTL视为未命中"""
+    cache = llm_cache.ResponseCache(str(tmp_path), ttl_by_tool={"t": 0})
+    cache.set("c" * 64, "stale", "t")
+    cache._memory["c" * 64] = (0.0, "stale")
+    assert cache.get("c" * 64, "t") is None
+
+
+def test_call_path_serves_from_cache(tmp_path, monkeypatch):
+    """共享调用路径命中缓存时不再请求上游"""
+    calls = []
+    cache = llm_cache.ResponseCache(str(tmp_path), ttl_by_tool={"score_current_meal_llm": 60})
+    monkeypatch.setattr(llm_calls, "get_response_cache", lambda: cache)
+    monkeypatch.setattr(llm_calls, "get_client", lambda: _fake_client(calls))
+
+    for _ in range(3):
+        content = llm_calls.chat_completion("score_current_meal_llm", "qwen-plus", MESSAGES, temperature=0.3)
+    assert content == '{"score": 80, "advice": "ok"}'
+    assert len(calls) == 1
+
+    # 未配置TTL的工具不缓存
+    llm_calls.chat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5)
+    llm_calls.chat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5)
+    assert len(calls) == 3
+
+
+def test_bypass_flags(tmp_path, monkeypatch):
+    """单次调用、上下文与工具级绕过"""
+    calls = []
+    cache = llm_cache.ResponseCache(str(tmp_path), ttl_by_tool={"t": 60}, bypass_tools={"u"})
+    monkeypatch.setattr(llm_calls, "get_response_cache", lambda: cache)
+    monkeypatch.setattr(llm_calls, "get_client", lambda: _fake_client(calls))
+
+    llm_calls.chat_completion("t", "m", MESSAGES, temperature=0.1)
+    llm_calls.chat_completion("t", "m", MESSAGES, temperature=0.1, use_cache=False)
+    with llm_cache.cache_bypass():
+        llm_calls.chat_completion("t", "m", MESSAGES, temperature=0.1)
+    assert len(calls) == 3
+    assert not cache.is_cacheable("u")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+测试共享LLM客户端：所有工具与Agent复用同一个连接池
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+from llm import client as llm_client
+
+
+def test_client_is_shared():
+    """多次获取返回同一个客户端与连接池"""
+    llm_client.close_clients()
+    first = llm_client.get_client()
+    second = llm_client.get_client()
+    assert first is second
+    assert first._client is llm_client.get_http_client()
+
+
+def test_pool_limits_and_timeouts():
+    """连接池与超时来自配置"""
+    llm_client.close_clients()
+    timeout = llm_client._build_timeout()
+    assert timeout.connect == llm_client.LLM_CONNECT_TIMEOUT
+    assert timeout.read == llm_client.LLM_READ_TIMEOUT
+    limits = llm_client._build_limits()
+    assert limits.max_connections == llm_client.LLM_MAX_CONNECTIONS
+    assert limits.keepalive_expiry == llm_client.LLM_KEEPALIVE_EXPIRY
+
+
+def test_chat_model_reuses_pool():
+    """Agent的模型与工具共用HTTP连接池"""
+    llm_client.close_clients()
+    model = llm_client.get_chat_model()
+    assert model.root_client._client is llm_client.get_http_client()
+
+
+def test_close_clients_resets():
+    """关闭后重新获取会创建新的客户端"""
+    first = llm_client.get_client()
+    llm_client.close_clients()
+    assert llm_client.get_client() is not first
+
+
+if __name__ == "__main__":
+    test_client_is_shared()
+    test_pool_limits_and_timeouts()
+    test_chat_model_reuses_pool()
+    test_close_clients_resets()
+    print("✅ 共享客户端测试通过！")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+测试Prometheus指标：直方图/计数器的文本格式、模型调用按模型计数
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+from llm.usage import CallRecord, get_usage_tracker
+from metrics import Counter, Histogram, Metrics, get_metrics, render_samples
+
+
+def test_histogram_renders_cumulative_buckets():
+    """直方图按le累计计数，并输出sum和count"""
+    histogram = Histogram("step_seconds", "Step duration", buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(seconds, step="vision")
+    histogram.observe(0.01, step="save")
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP step_seconds Step duration", "# TYPE step_seconds histogram"]
+    assert 'step_seconds_bucket{step="vision",le="0.1"} 1' in lines
+    assert 'step_seconds_bucket{step="vision",le="1.0"} 3' in lines
+    assert 'step_seconds_bucket{step="vision",le="+Inf"} 4' in lines
+    assert 'step_seconds_sum{step="vision"} 4.25' in lines
+    assert 'step_seconds_count{step="vision"} 4' in lines
+    assert 'step_seconds_count{step="save"} 1' in lines
+
+
+def test_counter_and_samples_escape_labels():
+    """标签值中的引号和换行被转义"""
+    counter = Counter("calls_total", "Calls")
+    counter.inc(model='qwen"vl')
+    counter.inc(2, model='qwen"vl')
+    assert counter.render()[-1] == 'calls_total{model="qwen\\"vl"} 3'
+    assert render_samples("depth", "Queue depth", [({"status": "queued"}, 4)]) == [
+        "# HELP depth Queue depth", "# TYPE depth gauge", 'depth{status="queued"} 4'
+    ]
+
+
+def test_model_calls_are_counted_per_model():
+    """usage跟踪器记录的每次调用都计入调用数、错误数、缓存命中"""
+    metrics = Metrics()
+    metrics.record_call(CallRecord(tool="vision", model="qwen-vl-max", latency_ms=1200))
+    metrics.record_call(CallRecord(tool="vision", model="qwen-vl-max", error="APITimeoutError: timeout"))
+    metrics.record_call(CallRecord(tool="nutrition", model="qwen-plus", cached=True))
+    assert metrics.model_calls.value(model="qwen-vl-max", tool="vision") == 2
+    assert metrics.model_errors.value(model="qwen-vl-max", tool="vision") == 1
+    assert metrics.model_cached.value(model="qwen-plus", tool="nutrition") == 1
+    assert metrics.model_seconds.count(model="qwen-vl-max") == 2
+    assert metrics.model_seconds.count(model="qwen-plus") == 0  # cache hits are not upstream latency
+
+    before = get_metrics().model_calls.value(model="test-model", tool="test")
+    get_usage_tracker().record(CallRecord(tool="test", model="test-model"))
+    assert get_metrics().model_calls.value(model="test-model", tool="test") == before + 1
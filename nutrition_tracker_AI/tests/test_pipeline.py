@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+测试确定性分析流水线（不经过ReAct编排），上游使用本地假Qwen服务
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from openai import AsyncOpenAI, OpenAI
+
+import fake_qwen_server
+from llm import calls as llm_calls
+from llm import cache as llm_cache
+from llm.rate_limit import RateLimiter
+from tools import db_tools
+import pipeline as pipeline_module
+from checkpoint import CheckpointStore
+from llm.context import request_scope
+from pipeline import MealPipeline, PipelineStep
+import batch as batch_module
+from batch import analyze_batch
+from tools import images
+from tools.images import image_exists, uploaded_image
+from metrics import get_metrics
+
+BASE_URL = "http://testserver/compatible-mode/v1"
+
+
+@pytest.fixture
+def fake_env(tmp_path, monkeypatch):
+    """Fake upstream, throwaway database and an image file"""
+    for key, value in (("latency_dist", "fixed"), ("latency_ms", 0), ("error_rate", 0), ("rate_limit_rate", 0)):
+        monkeypatch.setitem(fake_qwen_server.CONFIG, key, value)
+    client = OpenAI(api_key="fake-key", base_url=BASE_URL, http_client=TestClient(fake_qwen_server.app), max_retries=0)
+    monkeypatch.setattr(llm_calls, "get_client", lambda: client)
+    monkeypatch.setattr(llm_calls, "get_async_client", lambda: AsyncOpenAI(
+        api_key="fake-key", base_url=BASE_URL, max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_qwen_server.app))
+    ))
+    monkeypatch.setattr(llm_calls, "get_response_cache",
+                        lambda: llm_cache.ResponseCache(str(tmp_path / "cache"), enabled=False))
+    monkeypatch.setattr(llm_calls, "get_rate_limiter", lambda: RateLimiter(enabled=False))
+    monkeypatch.setattr(db_tools, "DB_PATH", str(tmp_path / "meals.json"))
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite3"))
+    monkeypatch.setattr(pipeline_module, "get_checkpoint_store", lambda: store)
+    image = tmp_path / "meal.jpg"
+    image.write_bytes(b"\xff\xd8\xff\xe0fake-jpeg")
+    return str(image)
+
+
+def _check(result):
+    meal = result["meal"]
+    assert meal["meal_id"].startswith("meal_")
+    assert result["meal_id"] == meal["meal_id"]
+    assert [d["name"] for d in meal["dishes"]] == ["White Rice", "Kung Pao Chicken", "Stir-fried Broccoli"]
+    assert meal["meal_nutrition_total"]["calories"] > 0
+    assert meal["scores"] == {"current_meal_score": 78, "week_adjusted_score": 74}
+    assert meal["next_meal_recommendation"]["options"][0]["title"] == "Light protein"
+    assert result["total_ms"] > 0
+    assert [s["step"] for s in result["steps"]][:4] == [
+        "detect_dishes_and_portions", "check_and_refine_portions", "add_nutrition_to_dishes", "compute_meal_nutrition"
+    ]
+
+
+def test_pipeline_run_saves_meal(fake_env):
+    """同步流水线完成全部步骤并保存完整记录"""
+    result = MealPipeline().run(fake_env, "Lunch")
+    _check(result)
+    with open(db_tools.DB_PATH, encoding="utf-8") as f:
+        saved = json.load(f)["days"][-1]["meals"][-1]
+    assert saved["meal_id"] == result["meal"]["meal_id"]
+    assert saved["meal_type"] == "Lunch"
+
+
+def test_pipeline_run_records_metrics(fake_env):
+    """每个步骤的耗时、数据库写入延迟和每次模型调用都计入指标"""
+    metrics = get_metrics()
+    steps = ("detect_dishes_and_portions", "add_nutrition_to_dishes", "score_current_meal_llm", "save_meal")
+    before = {step: metrics.step_seconds.count(step=step) for step in steps}
+    saves, calls = metrics.save_seconds.count(), metrics.model_calls.total()
+    MealPipeline().run(fake_env, "Lunch")
+    assert all(metrics.step_seconds.count(step=step) == before[step] + 1 for step in steps)
+    assert metrics.save_seconds.count() == saves + 1
+    assert metrics.model_calls.total() > calls
+    assert any(line.startswith("nutrition_pipeline_step_duration_seconds_bucket{step=\"save_meal\"")
+               for line in metrics.render())
+
+
+def test_pipeline_arun(fake_env):
+    """异步流水线结果一致"""
+    _check(asyncio.run(MealPipeline().arun(fake_env, "Dinner")))
+
+
+def test_pipeline_makes_no_orchestration_calls(fake_env):
+    """流水线模式不产生agent编排调用"""
+    fake_qwen_server.STATS.clear()
+    MealPipeline().run(fake_env, "Lunch")
+    assert "requests.agent" not in fake_qwen_server.STATS
+    assert fake_qwen_server.STATS["requests.vision"] == 1
+
+
+
+def _saved_meals():
+    with open(db_tools.DB_PATH, encoding="utf-8") as f:
+        return [meal for day in json.load(f)["days"] for meal in day["meals"]]
+
+
+def test_retry_resumes_after_failed_save(fake_env, monkeypatch):
+    """保存失败后用同一请求ID重试：从失败步骤继续，不再调用视觉模型"""
+    real_save = pipeline_module.save_meal_record
+    calls = []
+
+    def flaky_save(meal):
+        calls.append(meal)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return real_save(meal)
+
+    monkeypatch.setattr(pipeline_module, "save_meal_record", flaky_save)
+    with request_scope("req_resume"):
+        with pytest.raises(OSError):
+            MealPipeline().run(fake_env, "Lunch")
+        fake_qwen_server.STATS.clear()
+        result = MealPipeline().run(fake_env, "Lunch")
+        _check(result)
+        assert fake_qwen_server.STATS.get("requests.vision", 0) == 0
+        resumed = {s["step"] for s in result["steps"] if s.get("resumed")}
+        assert {"detect_dishes_and_portions", "compute_meal_nutrition", "recommend_next_meal"} <= resumed
+        assert "save_meal" not in resumed
+
+        # A retry after success returns the saved record instead of saving again
+        again = asyncio.run(MealPipeline().arun(fake_env, "Lunch"))
+    assert again["meal"]["meal_id"] == result["meal"]["meal_id"]
+    assert len(_saved_meals()) == 1
+
+
+def test_same_image_reuses_recognition(fake_env):
+    """同一图片再次提交时复用识别与营养结果，后续步骤照常执行"""
+    with request_scope("req_first"):
+        MealPipeline().run(fake_env, "Lunch")
+    fake_qwen_server.STATS.clear()
+    copy = os.path.join(os.path.dirname(fake_env), "upload_copy.jpg")
+    with open(fake_env, "rb") as src, open(copy, "wb") as dst:
+        dst.write(src.read())
+    with request_scope("req_second"):
+        result = MealPipeline().run(copy, "Dinner")
+    _check(result)
+    assert fake_qwen_server.STATS.get("requests.vision", 0) == 0
+    assert result["meal"]["image_path"] == copy
+    assert len(_saved_meals()) == 2
+
+
+def test_recognition_fallback_does_not_poison_later_steps(fake_env, monkeypatch):
+    """视觉识别失败（兜底结果）后重新提交：识别成功，后续步骤不复用兜底结果的检查点"""
+    from tools import vision_tools
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("vision model unavailable")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(vision_tools, "chat_completion", unavailable)
+        failed = MealPipeline().run(fake_env, "Lunch")
+    assert [d["name"] for d in failed["meal"]["dishes"]] == ["Unrecognized dish"]
+    with request_scope("req_after_fallback"):
+        _check(MealPipeline().run(fake_env, "Lunch"))
+
+
+def _sleep_step(name, seconds, requires=()):
+    def run(ctx):
+        time.sleep(seconds)
+        return name
+
+    async def arun(ctx):
+        await asyncio.sleep(seconds)
+        return name
+    return PipelineStep(name, run, arun, requires)
+
+
+def test_step_graph_runs_independent_steps_concurrently():
+    """独立步骤并发执行，总耗时接近关键路径而非各步之和"""
+    steps = [_sleep_step("a", 0.2), _sleep_step("b", 0.2), _sleep_step("c", 0.2),
+             _sleep_step("join", 0, requires=("a", "b", "c"))]
+    pipeline = MealPipeline(steps, result_step="join", checkpoints=CheckpointStore(enabled=False))
+    for runner in (lambda ctx: pipeline._run_graph(ctx), lambda ctx: asyncio.run(pipeline._arun_graph(ctx))):
+        pipeline._start("")
+        ctx = {}
+        started_at = time.perf_counter()
+        runner(ctx)
+        assert time.perf_counter() - started_at < 0.45
+        assert ctx["join"] == "join"
+        assert [s["step"] for s in pipeline.steps][-1] == "join"
+
+
+def test_step_graph_validation_and_errors():
+    """依赖缺失/循环在构造时报错；步骤异常向上传播"""
+    with pytest.raises(ValueError):
+        MealPipeline([_sleep_step("a", 0, requires=("missing",))], checkpoints=CheckpointStore(enabled=False))
+    with pytest.raises(ValueError):
+        MealPipeline([_sleep_step("a", 0, requires=("b",)), _sleep_step("b", 0, requires=("a",))],
+                     checkpoints=CheckpointStore(enabled=False))
+
+    def boom(ctx):
+        raise RuntimeError("step failed")
+    pipeline = MealPipeline([PipelineStep("boom", boom), _sleep_step("after", 0, requires=("boom",))],
+                            checkpoints=CheckpointStore(enabled=False))
+    with pytest.raises(RuntimeError):
+        pipeline._run_graph({})
+    with pytest.raises(RuntimeError):
+        asyncio.run(pipeline._arun_graph({}))
+
+
+EXPECTED_EVENTS = ["dishes_detected", "portions_refined", "nutrition", "totals"]
+
+
+def test_pipeline_reports_step_events(fake_env):
+    """监听器在每步完成时收到事件：菜品逐个先于完整识别结果到达，最后为保存"""
+    for runner in (lambda p: p.run(fake_env, "Lunch"), lambda p: asyncio.run(p.arun(fake_env, "Dinner"))):
+        events = []
+        # No checkpoints: the second run would otherwise reuse the first one's recognition
+        result = runner(MealPipeline(on_event=events.append, checkpoints=CheckpointStore(enabled=False)))
+        names = [event["event"] for event in events]
+        assert names[:3] == ["dish_detected"] * 3
+        assert events[0]["data"]["name"] == "White Rice"
+        assert names[3:7] == EXPECTED_EVENTS
+        assert {"meal_score", "week_score", "recommendation"} <= set(names[7:-1])
+        assert names[-1] == "saved"
+        assert events[-1]["data"]["meal_id"] == result["meal"]["meal_id"]
+        assert events[6]["data"]["meal_nutrition_total"] == result["meal"]["meal_nutrition_total"]
+        assert [e["elapsed_ms"] for e in events] == sorted(e["elapsed_ms"] for e in events)
+
+
+def test_resumed_steps_are_reported(fake_env):
+    """续跑时从检查点恢复的步骤同样产生事件（不再逐个播报菜品）"""
+    with request_scope("req_events"):
+        MealPipeline().run(fake_env, "Lunch")
+        events = []
+        MealPipeline(on_event=events.append).run(fake_env, "Lunch")
+    assert [event["event"] for event in events][:4] == EXPECTED_EVENTS
+
+
+def test_pipeline_analyzes_upload_bytes_in_memory(fake_env):
+    """上传字节经image://句柄直达视觉模型，不写临时文件；分析结束后句柄失效"""
+    with open(fake_env, "rb") as f:
+        data = f.read()
+    fake_qwen_server.STATS.clear()
+    with uploaded_image(data, "upload.jpg") as image_path:
+        assert image_path.startswith("image://") and image_path.endswith("/upload.jpg")
+        result = MealPipeline(checkpoints=CheckpointStore(enabled=False)).run(image_path, "Lunch")
+    _check(result)
+    assert fake_qwen_server.STATS["requests.vision"] == 1
+    assert not image_exists(image_path)
+
+
+def test_large_uploads_spill_to_a_temp_file(monkeypatch):
+    """超过阈值的上传写入临时文件，结束后删除"""
+    monkeypatch.setattr(images, "IMAGE_SPILL_BYTES", 4)
+    with uploaded_image(b"0123456789", "big.png") as image_path:
+        assert os.path.isfile(image_path) and image_path.endswith(".png")
+        assert images.read_image(image_path) == b"0123456789"
+    assert not os.path.exists(image_path)
+    with uploaded_image(b"0123", "small.png") as image_path:
+        assert images.read_image(image_path) == b"0123"
+
+
+def _copies(image, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(os.path.dirname(image), f"plate{i}.jpg")
+        with open(image, "rb") as src, open(path, "wb") as dst:
+            dst.write(src.read() + bytes([i]))  # distinct content: no recognition reuse between plates
+        paths.append(path)
+    return paths
+
+
+def test_batch_saves_all_meals_in_one_write(fake_env, monkeypatch):
+    """批量分析：结果按输入顺序返回，历史只读取一次，所有餐食一次写入数据库"""
+    monkeypatch.setattr(batch_module, "get_checkpoint_store", lambda: pipeline_module.get_checkpoint_store())
+    db_tools._load_json()  # create the database file up front
+    writes = []
+    real_save_json = db_tools._save_json
+    monkeypatch.setattr(db_tools, "_save_json", lambda data: (writes.append(data), real_save_json(data)))
+    fake_qwen_server.STATS.clear()
+    paths = _copies(fake_env, 3)
+    with request_scope("req_batch"):
+        results = analyze_batch([(path, "Lunch") for path in paths], "req_batch", concurrency=3)
+    assert [result["meal"]["image_path"] for result in results] == paths
+    assert len({result["meal_id"] for result in results}) == 3
+    assert len(writes) == 1
+    saved = _saved_meals()
+    assert [meal["meal_id"] for meal in saved] == [result["meal_id"] for result in results]
+    assert fake_qwen_server.STATS["requests.vision"] == 3
+
+    # Retrying the batch returns the saved meals without analyzing or saving again
+    fake_qwen_server.STATS.clear()
+    again = analyze_batch([(path, "Lunch") for path in paths], "req_batch")
+    assert [result["meal_id"] for result in again] == [result["meal_id"] for result in results]
+    assert fake_qwen_server.STATS.get("requests.vision", 0) == 0
+    assert len(_saved_meals()) == 3
+
+
+def _save_meals_in_process(db_path, count):
+    db_tools.DB_PATH = db_path
+    for i in range(count):
+        db_tools.save_meal_records([{"meal_type": "Snack", "dishes": [{"name": f"dish {i}"}],
+                                     "meal_nutrition_total": {"calories": 10}}])
+
+
+@pytest.mark.skipif(db_tools.fcntl is None, reason="cross-process lock needs fcntl")
+def test_concurrent_processes_do_not_lose_meals(tmp_path):
+    """多个进程（多个uvicorn worker、CLI与服务）同时写入数据库时不丢失餐食"""
+    import multiprocessing
+    db_path = str(tmp_path / "meals.json")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_save_meals_in_process, args=(db_path, 10)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+    with open(db_path, encoding="utf-8") as f:
+        assert sum(len(day["meals"]) for day in json.load(f)["days"]) == 40
+
+
+def test_batch_reports_per_image_errors(fake_env, monkeypatch):
+    """单张图片失败不影响其余图片；事件带图片序号"""
+    monkeypatch.setattr(batch_module, "get_checkpoint_store", lambda: CheckpointStore(enabled=False))
+    events = []
+    paths = _copies(fake_env, 2)
+    results = analyze_batch([(paths[0], "Lunch"), ("image://missing/x.jpg", "Lunch"), (paths[1], "")],
+                            "req_partial", on_event=events.append)
+    assert "error" not in results[0] and "error" not in results[2]
+    assert results[2]["meal"]["meal_type"]  # inferred for the batch
+    assert "no longer available" in results[1]["error"]
+    saved_events = [event for event in events if event["event"] == "saved"]
+    assert sorted(event["image"] for event in saved_events) == [0, 2]
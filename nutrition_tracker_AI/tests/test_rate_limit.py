@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+测试跨进程共享的令牌桶限流与优先级通道
+"""
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+import pytest
+
+from llm import rate_limit
+from llm.rate_limit import RateLimiter, estimate_tokens, priority_lane
+from llm.resilience import DeadlineExceeded, deadline_scope
+
+
+def _limiter(tmp_path, rps=2.0, tpm=6000.0, reserve=0.5):
+    return RateLimiter(str(tmp_path / "rl.sqlite3"), limits={}, default={"rps": rps, "tpm": tpm},
+                       batch_reserve=reserve, enabled=True)
+
+
+def test_buckets_are_shared_between_instances(tmp_path):
+    """两个实例（模拟两个进程）共用同一组令牌桶"""
+    a, b = _limiter(tmp_path), _limiter(tmp_path)
+    assert a.try_acquire("qwen-plus", 10) == 0
+    assert b.try_acquire("qwen-plus", 10) == 0
+    wait = a.try_acquire("qwen-plus", 10)
+    assert 0 < wait <= 0.5 + 1e-6
+
+
+def test_token_bucket_limits_large_requests(tmp_path):
+    """按每分钟token数限流"""
+    limiter = _limiter(tmp_path, rps=100, tpm=6000)
+    assert limiter.try_acquire("qwen-plus", 5000) == 0
+    # 1000 tokens left, 100 tokens/s refill
+    assert limiter.try_acquire("qwen-plus", 3000) == pytest.approx(20, rel=0.05)
+
+
+def test_batch_lane_leaves_reserve_for_interactive(tmp_path):
+    """批处理不能用掉为交互请求保留的额度"""
+    limiter = _limiter(tmp_path, rps=4, tpm=60000, reserve=0.5)
+    assert limiter.try_acquire("qwen-plus", 10, "batch") == 0
+    assert limiter.try_acquire("qwen-plus", 10, "batch") == 0
+    assert limiter.try_acquire("qwen-plus", 10, "batch") > 0
+    assert limiter.try_acquire("qwen-plus", 10, "interactive") == 0
+
+
+def test_settle_credits_overestimate(tmp_path):
+    """实际用量低于预估时返还token"""
+    limiter = _limiter(tmp_path, rps=100, tpm=6000)
+    limiter.try_acquire("qwen-plus", 6000)
+    limiter.settle("qwen-plus", 6000, 1000)
+    assert limiter.try_acquire("qwen-plus", 4000) == 0
+
+
+def test_acquire_waits_and_respects_deadline(tmp_path, monkeypatch):
+    """等待时间超过截止时间时直接失败"""
+    limiter = _limiter(tmp_path, rps=1, tpm=60000)
+    slept = []
+    monkeypatch.setattr(rate_limit.time, "sleep", slept.append)
+    limiter.acquire("m", 10)
+    with deadline_scope(0.01):
+        with pytest.raises(DeadlineExceeded):
+            limiter.acquire("m", 10)
+    with priority_lane("batch"):
+        assert rate_limit.get_priority_lane() == "batch"
+    assert limiter.stats()["interactive"]["acquired"] == 1
+
+
+def test_oversized_request_costs_at_most_one_bucket(tmp_path):
+    """超过桶容量的请求最多用掉整个桶，不会让余额变为负数、饿死其他调用"""
+    limiter = _limiter(tmp_path, rps=100, tpm=6000)
+    assert limiter.try_acquire("qwen-plus", 20000) == 0
+    # Empty, not 14000 in debt: the next call waits for its own 100 tokens only
+    assert limiter.try_acquire("qwen-plus", 100) == pytest.approx(1, rel=0.05)
+    limiter.settle("qwen-plus", 20000, 30000)
+    assert limiter.try_acquire("qwen-plus", 100) == pytest.approx(1, rel=0.05)
+
+
+def test_aacquire_keeps_sqlite_off_the_event_loop(tmp_path, monkeypatch):
+    """异步获取时SQLite事务在工作线程中执行，锁竞争不阻塞事件循环"""
+    limiter = _limiter(tmp_path)
+    threads = []
+    real_try_acquire = limiter.try_acquire
+
+    def try_acquire(*args):
+        threads.append(threading.current_thread())
+        return real_try_acquire(*args)
+
+    monkeypatch.setattr(limiter, "try_acquire", try_acquire)
+    asyncio.run(limiter.aacquire("qwen-plus", 10))
+    assert threads and threading.main_thread() not in threads
+
+
+def test_estimate_tokens_counts_images():
+    """图片按固定token数估算"""
+    messages = [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "x"}},
+                                              {"type": "text", "text": "a" * 40}]}]
+    assert estimate_tokens(messages, {"max_tokens": 100}) == 10 + 1024 + 100
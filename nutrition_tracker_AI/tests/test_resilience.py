@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+测试模型调用的重试、截止时间与熔断
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from llm import calls as llm_calls
+from llm import cache as llm_cache
+from llm import resilience
+from llm.context import request_scope
+from llm.usage import get_usage_tracker
+
+backoff_delay = resilience.backoff_delay
+
+
+def _status_error(status: int, headers=None):
+    request = httpx.Request("POST", "http://testserver/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    cls = openai.RateLimitError if status == 429 else openai.InternalServerError
+    return cls("upstream error", response=response, body=None)
+
+
+def _ok():
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=2)
+    )
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    resilience.reset_resilience_state()
+    monkeypatch.setattr(resilience.time, "sleep", lambda _: None)
+    monkeypatch.setattr(resilience, "backoff_delay", lambda attempt, error=None: 0.01)
+    get_usage_tracker().reset()
+    yield
+    resilience.reset_resilience_state()
+
+
+@pytest.fixture
+def upstream(tmp_path, monkeypatch):
+    """Fake client failing with the queued errors before succeeding"""
+    state = SimpleNamespace(errors=[], calls=0, timeouts=[])
+
+    def create(**kwargs):
+        state.calls += 1
+        state.timeouts.append(kwargs["timeout"])
+        if state.errors:
+            raise state.errors.pop(0)
+        return _ok()
+
+    async def acreate(**kwargs):
+        return create(**kwargs)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=acreate)))
+    monkeypatch.setattr(llm_calls, "get_client", lambda: client)
+    monkeypatch.setattr(llm_calls, "get_async_client", lambda: async_client)
+    monkeypatch.setattr(llm_calls, "get_response_cache",
+                        lambda: llm_cache.ResponseCache(str(tmp_path), enabled=False))
+    return state
+
+
+MESSAGES = [{"role": "user", "content": "x"}]
+
+
+def test_transient_errors_are_retried(upstream):
+    """429/5xx重试后成功，重试次数计入用量"""
+    upstream.errors = [_status_error(429), _status_error(503)]
+    with request_scope() as request_id:
+        assert llm_calls.chat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5) == "ok"
+    assert upstream.calls == 3
+    assert get_usage_tracker().request_summary(request_id)["total"]["retries"] == 2
+    assert resilience.get_resilience_stats()["counters"]["qwen-plus"]["retries"] == 2
+
+
+def _token_level(db_path):
+    import sqlite3
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT level FROM buckets WHERE kind = 'tokens'").fetchone()[0]
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_failed_attempts_return_their_tokens(upstream, tmp_path, monkeypatch, use_async):
+    """失败的尝试（无响应）归还预占的token：重试后桶内只扣除实际用量"""
+    from llm.rate_limit import RateLimiter
+    db_path = str(tmp_path / "rl.sqlite3")
+    limiter = RateLimiter(db_path, limits={}, default={"rps": 100, "tpm": 6000}, enabled=True)
+    monkeypatch.setattr(llm_calls, "get_rate_limiter", lambda: limiter)
+    async def no_sleep(_):
+        return None
+    monkeypatch.setattr(resilience.asyncio, "sleep", no_sleep)
+    upstream.errors = [_status_error(503), _status_error(500)]
+    if use_async:
+        asyncio.run(llm_calls.achat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5))
+    else:
+        llm_calls.chat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5)
+    assert upstream.calls == 3
+    assert _token_level(db_path) == pytest.approx(6000 - 12, abs=5)  # 12 = the successful call's usage
+
+    # A call that fails for good leaves the bucket as it found it
+    upstream.errors = [openai.BadRequestError("bad", response=httpx.Response(
+        400, request=httpx.Request("POST", "http://testserver")), body=None)]
+    before = _token_level(db_path)
+    with pytest.raises(openai.BadRequestError):
+        llm_calls.chat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5)
+    assert _token_level(db_path) == pytest.approx(before, abs=5)
+
+
+def test_non_retryable_error_raises_immediately(upstream):
+    """400类错误不重试"""
+    request = httpx.Request("POST", "http://testserver/chat/completions")
+    upstream.errors = [openai.BadRequestError("bad", response=httpx.Response(400, request=request), body=None)]
+    with pytest.raises(openai.BadRequestError):
+        llm_calls.chat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5)
+    assert upstream.calls == 1
+
+
+def test_breaker_opens_and_fails_fast(upstream, monkeypatch):
+    """连续失败后熔断，熔断期间不请求上游"""
+    monkeypatch.setattr(resilience, "get_breaker", lambda model, _b=resilience.CircuitBreaker(
+        "qwen-plus", failure_threshold=2, reset_timeout=60): _b)
+    upstream.errors = [_status_error(500) for _ in range(3)]
+    # Breaker trips on the second failure, so the third retry never reaches upstream
+    with pytest.raises(resilience.CircuitOpenError):
+        llm_calls.chat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5)
+    with pytest.raises(resilience.CircuitOpenError):
+        llm_calls.chat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5)
+    assert upstream.calls == 2
+
+
+def test_breaker_half_open_probe_closes():
+    """重置时间过后的探测调用成功则恢复"""
+    breaker = resilience.CircuitBreaker("m", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def _half_open_breaker(monkeypatch):
+    breaker = resilience.CircuitBreaker("qwen-plus", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    monkeypatch.setattr(resilience, "get_breaker", lambda model: breaker)
+    return breaker
+
+
+def test_cancelled_probe_frees_the_half_open_slot(monkeypatch):
+    """半开状态的探测调用被取消后释放探测名额，后续调用仍可探测并恢复"""
+    breaker = _half_open_breaker(monkeypatch)
+
+    async def hang(timeout):
+        await asyncio.sleep(60)
+
+    async def ok(timeout):
+        return "ok"
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(resilience.acall_with_resilience("qwen-plus", hang, resilience.Attempts()), 0.05)
+        assert breaker.state == "half_open"
+        return await resilience.acall_with_resilience("qwen-plus", ok, resilience.Attempts())
+    assert asyncio.run(scenario()) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_non_retryable_error_leaves_breaker_state(monkeypatch):
+    """不可重试的错误（如请求未发出）不关闭半开的熔断器，只释放探测名额"""
+    breaker = _half_open_breaker(monkeypatch)
+
+    def not_sent(timeout):
+        raise ValueError("rate limit wait exceeds the deadline")
+    with pytest.raises(ValueError):
+        resilience.call_with_resilience("qwen-plus", not_sent, resilience.Attempts())
+    assert breaker.state == "half_open"
+    assert resilience.call_with_resilience("qwen-plus", lambda timeout: "ok", resilience.Attempts()) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_deadline_caps_timeout_and_stops_retries(upstream):
+    """截止时间限制单次超时，耗尽后不再调用"""
+    with resilience.deadline_scope(5):
+        llm_calls.chat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5)
+        with resilience.deadline_scope(30):
+            assert resilience.remaining_time() <= 5
+    assert upstream.timeouts[0] <= 5
+
+    with resilience.deadline_scope(0):
+        with pytest.raises(resilience.DeadlineExceeded):
+            llm_calls.chat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5)
+    assert upstream.calls == 1
+
+
+def test_async_path_retries(upstream, monkeypatch):
+    """异步调用同样重试"""
+    async def no_sleep(_):
+        return None
+    monkeypatch.setattr(resilience.asyncio, "sleep", no_sleep)
+    upstream.errors = [openai.APITimeoutError(httpx.Request("POST", "http://testserver"))]
+    result = asyncio.run(llm_calls.achat_completion("recommend_next_meal", "qwen-plus", MESSAGES, temperature=0.5))
+    assert result == "ok" and upstream.calls == 2
+
+
+def test_retry_after_is_honoured():
+    """Retry-After作为退避下限"""
+    error = _status_error(429, {"retry-after": "2"})
+    assert all(2 <= backoff_delay(0, error, base_delay=0.1, max_delay=8) <= 8 for _ in range(20))
+    assert all(backoff_delay(3, None, base_delay=1, max_delay=4) <= 4 for _ in range(20))
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+测试启动开销：入口模块导入时不加载langgraph/openai等重型依赖，agent图在首次使用时才构建
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+import pytest
+
+from benchmark_imports import import_profile
+
+
+@pytest.mark.parametrize("module", ["tools.db_tools", "pipeline", "agent", "main", "agent_server"])
+def test_entry_points_do_not_import_heavy_packages(module):
+    """导入入口模块（新进程）不会加载langgraph、langchain、openai客户端"""
+    loaded = import_profile(module)["loaded"]
+    assert not {"langgraph", "langchain", "langchain_community", "langchain_openai", "openai"} & set(loaded)
+
+
+def test_agent_graph_is_built_on_first_use(monkeypatch):
+    """流水线模式下构建agent不创建模型和图；首次访问agent_executor时才构建，之后复用"""
+    import agent as agent_module
+    builds = []
+    monkeypatch.setattr(agent_module, "get_chat_model", lambda: builds.append("model") or object())
+    monkeypatch.setattr(agent_module.NutritionAgent, "_build_graph",
+                        lambda self: (builds.append("graph"), self.model)[1])
+
+    agent = agent_module.NutritionAgent(build_graph=False)
+    assert builds == []
+    assert agent.agent_executor is agent.agent_executor
+    assert builds == ["graph", "model"]
+
+    agent_module.NutritionAgent(build_graph=True)
+    assert builds[2:] == ["graph", "model"]
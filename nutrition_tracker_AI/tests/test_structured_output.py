@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+测试结构化输出（JSON模式/Schema约束）与能力探测降级
+"""
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+import pytest
+from fastapi.testclient import TestClient
+from openai import OpenAI
+
+import fake_qwen_server
+from llm import calls as llm_calls
+from llm import cache as llm_cache
+from llm import structured
+from tools.portion_tools import check_and_refine_portions
+from tools.recommendation_tools import score_current_meal_llm
+from schemas.tool_schema import ScoreOutput
+
+
+@pytest.fixture
+def fake_api(tmp_path, monkeypatch):
+    """Route llm.calls to the fake server; returns the list of request bodies it received"""
+    for key, value in (("latency_dist", "fixed"), ("latency_ms", 0), ("error_rate", 0), ("rate_limit_rate", 0)):
+        monkeypatch.setitem(fake_qwen_server.CONFIG, key, value)
+    bodies = []
+    original = fake_qwen_server.build_content
+
+    def recording_build_content(prompt_type, body):
+        bodies.append(body)
+        return original(prompt_type, body)
+
+    monkeypatch.setattr(fake_qwen_server, "build_content", recording_build_content)
+    client = OpenAI(api_key="fake-key", base_url="http://testserver/compatible-mode/v1",
+                    http_client=TestClient(fake_qwen_server.app), max_retries=0)
+    monkeypatch.setattr(llm_calls, "get_client", lambda: client)
+    monkeypatch.setattr(llm_calls, "get_response_cache",
+                        lambda: llm_cache.ResponseCache(str(tmp_path), enabled=False))
+    structured.reset_structured_modes()
+    yield bodies
+    structured.reset_structured_modes()
+
+
+def test_json_schema_requested_and_parsed(fake_api):
+    """支持时请求json_schema，数组结果被包装后仍能解析"""
+    assert score_current_meal_llm.invoke({"nutrition": {"calories": 500}})["score"] == 78
+    assert fake_api[-1]["response_format"]["type"] == "json_schema"
+
+    vision = json.dumps({"dishes": [{"dish_id": "dish_1", "name": "Rice", "estimated_weight_g": 210}],
+                         "image_path": "x.jpg"})
+    result = json.loads(check_and_refine_portions.invoke({"vision_result": vision}))
+    assert result["dishes"][0]["final_weight_g"] == 210
+    schema = fake_api[-1]["response_format"]["json_schema"]["schema"]
+    assert schema["properties"]["items"]["type"] == "array"
+
+
+def test_downgrades_when_unsupported(fake_api, monkeypatch):
+    """模型拒绝json_schema时降级为json_object，数组请求走普通提取"""
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "response_formats", ["json_object"])
+    assert score_current_meal_llm.invoke({"nutrition": {"calories": 500}})["score"] == 78
+    assert structured.get_structured_mode("qwen-plus") == "json_object"
+    assert fake_api[-1]["response_format"] == {"type": "json_object"}
+
+    vision = json.dumps({"dishes": [{"dish_id": "dish_1", "name": "Rice", "estimated_weight_g": 210}],
+                         "image_path": "x.jpg"})
+    json.loads(check_and_refine_portions.invoke({"vision_result": vision}))
+    assert "response_format" not in fake_api[-1]
+
+
+def test_pinned_mode_is_not_retried(fake_api, monkeypatch):
+    """LLM_STRUCTURED_OUTPUT固定模式被拒绝时直接报错，不重复发送同一请求"""
+    import openai
+    monkeypatch.setattr(structured, "LLM_STRUCTURED_OUTPUT", "json_schema")
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "response_formats", ["json_object"])
+    messages = [{"role": "user", "content": "score this meal as JSON"}]
+    fake_qwen_server.STATS.clear()
+    with pytest.raises(openai.BadRequestError):
+        llm_calls.chat_completion("score_current_meal_llm", "qwen-plus", messages, 0.3, use_cache=False,
+                                  response_schema=ScoreOutput)
+    assert fake_qwen_server.STATS["rejected.response_format"] == 1  # sent once, never re-sent
+    assert structured.get_structured_mode("qwen-plus") == "json_schema"
+    assert not structured.downgrade_on_error("qwen-plus", "none", ValueError())
+
+
+def test_probe(fake_api, monkeypatch):
+    """能力探测逐级尝试"""
+    client = llm_calls.get_client()
+    assert structured.probe_structured_output("qwen-vl-plus", client) == "json_schema"
+    monkeypatch.setitem(fake_qwen_server.CONFIG, "response_formats", [])
+    assert structured.probe_structured_output("qwen-vl-plus", client) == "none"
+    assert structured.get_structured_mode("qwen-vl-plus") == "none"
+
+
+def test_json_hint_added():
+    """提示词未提及JSON时补充说明"""
+    _, messages, params = structured.apply_structured_output(
+        "m", [{"role": "user", "content": "score this"}], {}, ScoreOutput, many=False
+    )
+    assert "JSON" in messages[-1]["content"]
+    assert "response_format" in params
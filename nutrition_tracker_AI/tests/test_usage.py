@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+测试上游调用的token、延迟与成本统计
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_nutrition_agent"))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-key")
+
+import pytest
+
+from llm import calls as llm_calls
+from llm import cache as llm_cache
+from llm.context import request_scope
+from llm.usage import CallRecord, UsageTracker, get_usage_tracker, summarize
+
+
+@pytest.fixture
+def fake_upstream(tmp_path, monkeypatch):
+    def create(**kwargs):
+        if kwargs["model"] == "broken":
+            raise RuntimeError("boom")
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='{"score": 80}'))],
+            usage=SimpleNamespace(prompt_tokens=120, completion_tokens=30)
+        )
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    cache = llm_cache.ResponseCache(str(tmp_path), ttl_by_tool={"score_current_meal_llm": 60})
+    monkeypatch.setattr(llm_calls, "get_client", lambda: client)
+    monkeypatch.setattr(llm_calls, "get_response_cache", lambda: cache)
+    get_usage_tracker().reset()
+
+
+def test_calls_are_attributed_to_request(fake_upstream):
+    """请求内的调用按工具汇总，缓存命中不计token"""
+    messages = [{"role": "user", "content": "x"}]
+    with request_scope() as request_id:
+        llm_calls.chat_completion("score_current_meal_llm", "qwen-plus", messages, temperature=0.3)
+        llm_calls.chat_completion("score_current_meal_llm", "qwen-plus", messages, temperature=0.3)
+        with pytest.raises(RuntimeError):
+            llm_calls.chat_completion("recommend_next_meal", "broken", messages, temperature=0.5)
+
+    summary = get_usage_tracker().request_summary(request_id)
+    score = summary["by_tool"]["score_current_meal_llm"]
+    assert score["calls"] == 2 and score["cached"] == 1
+    assert score["prompt_tokens"] == 120 and score["completion_tokens"] == 30
+    assert summary["by_tool"]["recommend_next_meal"]["errors"] == 1
+    assert len(summary["calls"]) == 3
+
+    process = get_usage_tracker().process_summary()
+    assert process["total"]["calls"] == 3
+
+
+def test_cost_and_ordering():
+    """成本按定价计算，汇总按token数降序"""
+    records = [
+        CallRecord(tool="infer_meal_type", model="qwen-plus", prompt_tokens=4000, completion_tokens=5),
+        CallRecord(tool="score_current_meal_llm", model="qwen-plus", prompt_tokens=100, completion_tokens=50),
+    ]
+    summary = summarize(records)
+    assert list(summary["by_tool"])[0] == "infer_meal_type"
+    assert summary["total"]["cost"] == pytest.approx((4100 * 0.0008 + 55 * 0.002) / 1000, rel=1e-3)
+
+
+def test_request_history_is_bounded():
+    """只保留最近N个请求的明细"""
+    tracker = UsageTracker(max_requests=2)
+    for i in range(3):
+        tracker.record(CallRecord(tool="t", model="m", request_id=f"r{i}"))
+    assert tracker.request_records("r0") == []
+    assert tracker.process_summary()["total"]["calls"] == 3
@@ -5,6 +5,22 @@ import path from "path";
 import { addNutritionEntry } from "./helpers/nutritionStorage.js";
 import { v4 as uuidv4 } from "uuid";
 
+const AGENT_URL = "http://localhost:8000";
+const JOB_POLL_INTERVAL_MS = 1000;
+const JOB_TIMEOUT_MS = 300000;
+
+// The agent queues the analysis and answers with a job ID; poll until it finishes
+const waitForJob = async (jobId) => {
+  const deadline = Date.now() + JOB_TIMEOUT_MS;
+  while (Date.now() < deadline) {
+    const { data: job } = await axios.get(`${AGENT_URL}/jobs/${jobId}`);
+    if (job.status === "done") return job.result;
+    if (job.status === "failed") throw new Error(`Analysis job ${jobId} failed: ${job.error}`);
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+  throw new Error(`Analysis job ${jobId} timed out`);
+};
+
 export const analyzeImage = async (req, res) => {
   try {
 
@@ -38,11 +54,13 @@ export const analyzeImage = async (req, res) => {
         contentType: req.file.mimetype,
     });
 
-    const response = await axios.post("http://localhost:8000/analyze", form, {
-      headers: form.getHeaders(),
+    const response = await axios.post(`${AGENT_URL}/analyze`, form, {
+      // The agent caps unfinished analyses per user
+      headers: { ...form.getHeaders(), ...(req.userEmail ? { "X-User-ID": req.userEmail } : {}) },
     });
     // 3. call LangChain
-    const dishes= response.data ? response.data : {
+    const result = await waitForJob(response.data.job_id);
+    const dishes= result ? result.dishes : {
         food :  "Egg Fried Rice",
         calories: 163,
         protein: 18,
@@ -97,6 +115,16 @@ console.log(mainDish);
     res.json({ success: true, mainDish});
 
   } catch (err) {
+    // Agent busy (503) or too many analyses of this user (429): pass it on so the client retries later
+    const status = err.response?.status;
+    if (status === 429 || status === 503) {
+      const retryAfter = err.response.headers["retry-after"];
+      if (retryAfter) res.set("Retry-After", retryAfter);
+      return res.status(status).json({
+        error: status === 429 ? "Too many analyses in progress" : "Analysis service busy",
+        retryAfter: Number(retryAfter) || undefined,
+      });
+    }
     console.error("Analyze error:", err);
     res.status(500).json({
       error: "Internal Server Error",